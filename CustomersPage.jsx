@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
@@ -36,7 +36,9 @@ import apiService from '../lib/api';
 
 const CustomersPage = () => {
   const [customers, setCustomers] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [searchTerm, setSearchTerm] = useState('');
   const [isDialogOpen, setIsDialogOpen] = useState(false);
   const [editingCustomer, setEditingCustomer] = useState(null);
@@ -47,21 +49,45 @@ const CustomersPage = () => {
   });
   const [formLoading, setFormLoading] = useState(false);
   const [error, setError] = useState('');
+  // The search the shown pages belong to; answers to older searches are dropped
+  const activeSearch = useRef('');
 
   useEffect(() => {
-    loadCustomers();
-  }, []);
+    // Searched on the server, so customers beyond the loaded pages are found too
+    const timer = setTimeout(() => loadCustomers(searchTerm), searchTerm ? 300 : 0);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
 
-  const loadCustomers = async () => {
+  const loadCustomers = async (search = searchTerm) => {
+    const term = search.trim();
+    activeSearch.current = term;
     try {
       setLoading(true);
-      const data = await apiService.getCustomers();
-      setCustomers(data);
+      const page = await apiService.getCustomersPage(null, null, term);
+      if (activeSearch.current !== term) return;
+      setCustomers(page.items);
+      setNextCursor(page.next_cursor);
     } catch (error) {
       console.error('Failed to load customers:', error);
       setError('Failed to load customers');
     } finally {
-      setLoading(false);
+      if (activeSearch.current === term) setLoading(false);
+    }
+  };
+
+  const loadMoreCustomers = async () => {
+    try {
+      setLoadingMore(true);
+      const term = activeSearch.current;
+      const page = await apiService.getCustomersPage(nextCursor, null, term);
+      if (activeSearch.current !== term) return;
+      setCustomers(prev => [...prev, ...page.items]);
+      setNextCursor(page.next_cursor);
+    } catch (error) {
+      console.error('Failed to load customers:', error);
+      setError('Failed to load customers');
+    } finally {
+      setLoadingMore(false);
     }
   };
 
@@ -117,12 +143,6 @@ const CustomersPage = () => {
     setError('');
   };
 
-  const filteredCustomers = customers.filter(customer =>
-    customer.name.toLowerCase().includes(searchTerm.toLowerCase()) ||
-    customer.mobile.includes(searchTerm) ||
-    customer.address.toLowerCase().includes(searchTerm.toLowerCase())
-  );
-
   return (
     <div className="space-y-6">
       {/* Header */}
@@ -234,7 +254,7 @@ const CustomersPage = () => {
             <div className="flex items-center space-x-2">
               <Users className="h-8 w-8 text-blue-600" />
               <div>
-                <p className="text-2xl font-bold">{customers.length}</p>
+                <p className="text-2xl font-bold">{customers.length}{nextCursor ? '+' : ''}</p>
                 <p className="text-sm text-muted-foreground">Total Customers</p>
               </div>
             </div>
@@ -267,8 +287,8 @@ const CustomersPage = () => {
                 </TableRow>
               </TableHeader>
               <TableBody>
-                {filteredCustomers.length > 0 ? (
-                  filteredCustomers.map((customer) => (
+                {customers.length > 0 ? (
+                  customers.map((customer) => (
                     <TableRow key={customer.id}>
                       <TableCell className="font-medium">
                         <div className="flex items-center space-x-2">
@@ -329,6 +349,14 @@ const CustomersPage = () => {
               </TableBody>
             </Table>
           )}
+          {!loading && nextCursor && (
+            <div className="flex justify-center pt-4">
+              <Button variant="outline" onClick={loadMoreCustomers} disabled={loadingMore}>
+                {loadingMore && <Loader2 className="h-4 w-4 mr-2 animate-spin" />}
+                Load more
+              </Button>
+            </div>
+          )}
         </CardContent>
       </Card>
     </div>
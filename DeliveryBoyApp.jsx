@@ -17,6 +17,14 @@ import {
 } from 'lucide-react';
 import apiService from '../lib/api';
 
+// Status changes wait here until the server confirms them, so nothing is lost
+// while the phone is offline
+const SYNC_QUEUE_KEY = 'pendingStatusChanges';
+
+const readSyncQueue = () => JSON.parse(localStorage.getItem(SYNC_QUEUE_KEY) || '[]');
+
+const writeSyncQueue = (queue) => localStorage.setItem(SYNC_QUEUE_KEY, JSON.stringify(queue));
+
 const DeliveryBoyApp = ({ user }) => {
   const [deliveries, setDeliveries] = useState([]);
   const [loading, setLoading] = useState(true);
@@ -25,8 +33,36 @@ const DeliveryBoyApp = ({ user }) => {
 
   useEffect(() => {
     loadDeliveries();
+    flushSyncQueue();
+    window.addEventListener('online', flushSyncQueue);
+    return () => window.removeEventListener('online', flushSyncQueue);
   }, []);
 
+  const flushSyncQueue = async () => {
+    const queue = readSyncQueue();
+    if (queue.length === 0) {
+      return;
+    }
+
+    try {
+      // The whole queue goes in one request; retries are safe because every
+      // change carries its own idempotency key
+      const data = await apiService.syncDeliveryStatuses(queue);
+      const sent = new Set(queue.map(change => change.idempotency_key));
+      writeSyncQueue(readSyncQueue().filter(change => !sent.has(change.idempotency_key)));
+
+      const serverState = new Map(data.deliveries.map(delivery => [delivery.id, delivery]));
+      setDeliveries(prev => prev.map(delivery =>
+        serverState.has(delivery.id)
+          ? { ...delivery, ...serverState.get(delivery.id), customer: delivery.customer }
+          : delivery
+      ));
+    } catch (error) {
+      // Still offline or the server is unreachable; the queue is kept for the next attempt
+      console.error('Failed to sync delivery statuses:', error);
+    }
+  };
+
   const loadDeliveries = async () => {
     try {
       setLoading(true);
@@ -77,8 +113,14 @@ const DeliveryBoyApp = ({ user }) => {
           : delivery
       ));
 
-      // In a real app, this would call the API
-      // await apiService.updateDeliveryStatus(deliveryId, newStatus);
+      // Queue the change and try to send it (and anything queued earlier) now
+      writeSyncQueue([...readSyncQueue(), {
+        id: deliveryId,
+        status: newStatus,
+        timestamp: new Date().toISOString(),
+        idempotency_key: crypto.randomUUID()
+      }]);
+      await flushSyncQueue();
       
     } catch (error) {
       console.error('Failed to update delivery status:', error);
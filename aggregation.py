@@ -0,0 +1,357 @@
+"""Aggregation pipeline engine for the in-memory storage backend
+
+Stages are chained as generators, so $match, $project, $skip, $limit and
+$unwind stream documents through while $group, $sort, $facet and $lookup
+consume their input once. Every accumulator of a $group is updated in the
+same pass over the documents, and $lookup resolves all of its input with a
+single $in query against the foreign collection.
+"""
+
+from collections import namedtuple
+from itertools import islice
+
+# Callbacks into the storage backend: match(document, query) -> bool and
+# find(collection, query) -> list of documents
+Backend = namedtuple('Backend', ['match', 'find'])
+
+_MISSING = object()
+
+def get_path(document, path):
+    """Resolve a dotted field path, returning None when any part is missing"""
+    value = document
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part, _MISSING)
+        if value is _MISSING:
+            return None
+    return value
+
+def id_lookup(query):
+    """The _id values a query is restricted to by equality or $in, else None"""
+    if not query or '_id' not in query:
+        return None
+    condition = query['_id']
+    if not isinstance(condition, dict):
+        return [condition]
+    if list(condition) == ['$in']:
+        # Deduplicate while keeping order
+        return list(dict.fromkeys(condition['$in']))
+    return None
+
+class SortKey:
+    """Orders documents by a MongoDB-style sort specification"""
+    __slots__ = ('values', 'directions')
+
+    def __init__(self, document, spec):
+        # Missing fields sort before any value, as they do in MongoDB
+        self.values = []
+        for field, _ in spec:
+            value = get_path(document, field)
+            self.values.append((1, value) if value is not None else (0,))
+        self.directions = [direction for _, direction in spec]
+
+    def __lt__(self, other):
+        for mine, theirs, direction in zip(self.values, other.values, self.directions):
+            if mine == theirs:
+                continue
+            return mine < theirs if direction > 0 else mine > theirs
+        return False
+
+# Expressions
+
+def _cond(args, document):
+    if isinstance(args, dict):
+        args = [args['if'], args['then'], args['else']]
+    condition, then, otherwise = args
+    return evaluate(then if evaluate(condition, document) else otherwise, document)
+
+def _compare(test):
+    def operator(args, document):
+        left, right = (evaluate(arg, document) for arg in args)
+        try:
+            return test(left, right)
+        except TypeError:
+            return False
+    return operator
+
+EXPRESSION_OPERATORS = {
+    '$cond': _cond,
+    '$eq': _compare(lambda a, b: a == b),
+    '$ne': _compare(lambda a, b: a != b),
+    '$gt': _compare(lambda a, b: a > b),
+    '$gte': _compare(lambda a, b: a >= b),
+    '$lt': _compare(lambda a, b: a < b),
+    '$lte': _compare(lambda a, b: a <= b),
+    '$and': lambda args, document: all(evaluate(arg, document) for arg in args),
+    '$or': lambda args, document: any(evaluate(arg, document) for arg in args),
+    '$ifNull': lambda args, document: next(
+        (value for value in (evaluate(arg, document) for arg in args) if value is not None), None),
+}
+
+def evaluate(expression, document):
+    """Evaluate an aggregation expression against a document"""
+    if isinstance(expression, str) and expression.startswith('$'):
+        return get_path(document, expression[1:])
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            operator, args = next(iter(expression.items()))
+            if operator.startswith('$'):
+                if operator not in EXPRESSION_OPERATORS:
+                    raise ValueError(f"Unsupported expression operator: {operator}")
+                return EXPRESSION_OPERATORS[operator](args, document)
+        return {key: evaluate(value, document) for key, value in expression.items()}
+    if isinstance(expression, list):
+        return [evaluate(item, document) for item in expression]
+    return expression
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+# Accumulators
+
+class _Sum:
+    def __init__(self):
+        self.value = 0
+
+    def add(self, value):
+        if _is_number(value):
+            self.value += value
+
+    def result(self):
+        return self.value
+
+class _Avg:
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def add(self, value):
+        if _is_number(value):
+            self.total += value
+            self.count += 1
+
+    def result(self):
+        return self.total / self.count if self.count else None
+
+class _Min:
+    def __init__(self):
+        self.value = None
+
+    def add(self, value):
+        if value is not None and (self.value is None or value < self.value):
+            self.value = value
+
+    def result(self):
+        return self.value
+
+class _Max(_Min):
+    def add(self, value):
+        if value is not None and (self.value is None or value > self.value):
+            self.value = value
+
+class _First:
+    def __init__(self):
+        self.value = _MISSING
+
+    def add(self, value):
+        if self.value is _MISSING:
+            self.value = value
+
+    def result(self):
+        return None if self.value is _MISSING else self.value
+
+class _Last(_First):
+    def add(self, value):
+        self.value = value
+
+ACCUMULATORS = {
+    '$sum': _Sum,
+    '$avg': _Avg,
+    '$min': _Min,
+    '$max': _Max,
+    '$first': _First,
+    '$last': _Last,
+}
+
+def _freeze(value):
+    """Make a group key hashable so compound _id values can key a dict"""
+    if isinstance(value, dict):
+        return tuple((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+# Stages
+
+def _group(documents, spec, backend):
+    id_expression = spec.get('_id')
+    fields = []
+    for name, accumulator in spec.items():
+        if name == '_id':
+            continue
+        (operator, expression), = accumulator.items()
+        if operator not in ACCUMULATORS:
+            raise ValueError(f"Unsupported accumulator: {operator}")
+        fields.append((name, ACCUMULATORS[operator], expression))
+
+    groups = {}
+    for document in documents:
+        group_id = evaluate(id_expression, document)
+        key = _freeze(group_id)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = (group_id, [factory() for _, factory, _ in fields])
+        for (_, _, expression), state in zip(fields, group[1]):
+            state.add(evaluate(expression, document))
+
+    for group_id, states in groups.values():
+        result = {'_id': group_id}
+        for (name, _, _), state in zip(fields, states):
+            result[name] = state.result()
+        yield result
+
+def _match(documents, spec, backend):
+    return (document for document in documents if backend.match(document, spec))
+
+def _sort(documents, spec, backend):
+    order = list(spec.items())
+    return iter(sorted(documents, key=lambda document: SortKey(document, order)))
+
+def _set_path(target, path, value):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        target = target.setdefault(part, {})
+    target[parts[-1]] = value
+
+def _drop_path(target, path):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        target = target.get(part)
+        if not isinstance(target, dict):
+            return
+    target.pop(parts[-1], None)
+
+def _project(documents, spec, backend):
+    exclude_id = spec.get('_id') in (0, False)
+    fields = {key: value for key, value in spec.items() if key != '_id'}
+    exclusion = fields and all(value in (0, False) for value in fields.values())
+
+    for document in documents:
+        if exclusion or not fields:
+            result = _deep_copy(document)
+            for path in fields:
+                _drop_path(result, path)
+        else:
+            result = {}
+            if '_id' in document:
+                result['_id'] = document['_id']
+            for path, value in fields.items():
+                if value in (1, True):
+                    value = get_path(document, path)
+                    if value is None and _missing(document, path):
+                        continue
+                else:
+                    value = evaluate(value, document)
+                _set_path(result, path, value)
+        if exclude_id:
+            result.pop('_id', None)
+        yield result
+
+def _missing(document, path):
+    value = document
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return True
+        value = value[part]
+    return False
+
+def _deep_copy(document):
+    return {key: _deep_copy(value) if isinstance(value, dict) else value
+            for key, value in document.items()}
+
+def _facet(documents, spec, backend):
+    documents = list(documents)
+    yield {name: _run(documents, pipeline, backend) for name, pipeline in spec.items()}
+
+def _lookup(documents, spec, backend):
+    if backend.find is None:
+        raise ValueError('$lookup needs a backend that can query other collections')
+    documents = list(documents)
+    local_field, foreign_field, target = spec['localField'], spec['foreignField'], spec['as']
+
+    values = []
+    for document in documents:
+        value = get_path(document, local_field)
+        values.extend(value if isinstance(value, list) else [value])
+    try:
+        values = list(dict.fromkeys(values))
+    except TypeError:
+        pass
+
+    joined = {}
+    for foreign in backend.find(spec['from'], {foreign_field: {'$in': values}}):
+        try:
+            joined.setdefault(_freeze(get_path(foreign, foreign_field)), []).append(foreign)
+        except TypeError:
+            continue
+
+    for document in documents:
+        value = get_path(document, local_field)
+        matches = []
+        for item in (value if isinstance(value, list) else [value]):
+            matches.extend(joined.get(_freeze(item), []))
+        result = dict(document)
+        _set_path(result, target, [_deep_copy(match) for match in matches])
+        yield result
+
+def _unwind(documents, spec, backend):
+    if isinstance(spec, str):
+        spec = {'path': spec}
+    path = spec['path'][1:]
+    keep_empty = spec.get('preserveNullAndEmptyArrays', False)
+    for document in documents:
+        value = get_path(document, path)
+        if isinstance(value, list) and value:
+            for item in value:
+                result = _deep_copy(document) if '.' in path else dict(document)
+                _set_path(result, path, item)
+                yield result
+        elif isinstance(value, list) or value is None:
+            if keep_empty:
+                result = dict(document)
+                if isinstance(value, list):
+                    _drop_path(result, path)
+                yield result
+        else:
+            yield document
+
+STAGES = {
+    '$match': _match,
+    '$group': _group,
+    '$sort': _sort,
+    '$project': _project,
+    '$facet': _facet,
+    '$lookup': _lookup,
+    '$unwind': _unwind,
+    '$skip': lambda documents, count, backend: islice(documents, count, None),
+    '$limit': lambda documents, count, backend: islice(documents, count),
+}
+
+def _run(documents, pipeline, backend):
+    stream = iter(documents)
+    for stage in pipeline:
+        (operator, spec), = stage.items()
+        if operator not in STAGES:
+            raise ValueError(f"Unsupported pipeline stage: {operator}")
+        stream = STAGES[operator](stream, spec, backend)
+    return list(stream)
+
+def run_pipeline(documents, pipeline, match, find=None):
+    """Run pipeline stages over an iterable of documents
+
+    match(document, query) evaluates $match filters so the engine shares query
+    semantics with the storage backend that feeds it; find(collection, query)
+    serves $lookup.
+    """
+    return _run(documents, pipeline, Backend(match, find))
@@ -98,6 +98,14 @@ class ApiService {
     });
   }
 
+  async getCustomersPage(cursor, limit, search) {
+    const params = new URLSearchParams();
+    if (cursor) params.set('cursor', cursor);
+    if (limit) params.set('limit', limit);
+    if (search) params.set('search', search);
+    return this.request(`/listings/customers?${params}`);
+  }
+
   async deleteCustomer(customerId) {
     return this.request(`/customers/${customerId}`, {
       method: 'DELETE',
@@ -120,6 +128,20 @@ class ApiService {
     });
   }
 
+  async bulkAssignDeliveries(assignments) {
+    return this.request('/deliveries/bulk', {
+      method: 'POST',
+      body: JSON.stringify({ assignments }),
+    });
+  }
+
+  async syncDeliveryStatuses(changes) {
+    return this.request('/deliveries/sync', {
+      method: 'POST',
+      body: JSON.stringify({ changes }),
+    });
+  }
+
   async updateDeliveryStatus(deliveryId, statusData) {
     return this.request(`/deliveries/${deliveryId}/status`, {
       method: 'PUT',
@@ -159,6 +181,21 @@ class ApiService {
     return this.request(`/reports/daily/${date}`);
   }
 
+  // Exports (streamed by the server; resolves to a Blob for download)
+  async exportDeliveries(filters = {}, format = 'csv') {
+    const params = new URLSearchParams({ ...filters, format });
+    const response = await fetch(`${API_BASE_URL}/exports/deliveries?${params}`, {
+      headers: this.getHeaders(),
+    });
+
+    if (!response.ok) {
+      const data = await response.json();
+      throw new Error(data.error || 'Export failed');
+    }
+
+    return response.blob();
+  }
+
   logout() {
     this.setToken(null);
   }
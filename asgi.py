@@ -0,0 +1,191 @@
+"""ASGI entry point for Milk Delivery App
+
+Serves the report and delivery-list endpoints from coroutines (see
+src/routes/async_routes.py) and every other route from the Flask app, which
+runs on a bounded thread pool behind a small WSGI bridge. A burst of slow
+reports then waits on the database without taking the threads the delivery
+status updates need.
+
+Run with any ASGI server, e.g.: uvicorn src.asgi:app --port 5001
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import io
+import logging
+import os
+import sys
+import time
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from src.main import app as flask_app
+from src.database import metrics
+from src.database.async_database import async_db_instance
+from src.database.config import db_instance
+from src.routes.async_routes import AsyncRequest, json_response, match_route
+from src.routes.monitoring import record_request
+
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', '16'))
+# Response chunks a WSGI response may run ahead of a slow client
+ASGI_WSGI_QUEUE_SIZE = int(os.getenv('ASGI_WSGI_QUEUE_SIZE', '16'))
+
+logger = logging.getLogger(__name__)
+
+class WsgiBridge:
+    """Run a WSGI app for ASGI HTTP requests on a thread pool
+
+    The request body is read completely before the app is called; the
+    response is streamed chunk by chunk through a bounded queue, so streaming
+    endpoints such as the exports keep their constant memory use. An error
+    after the status went out is raised to the server, which aborts the
+    response: a truncated export must not end like a complete one.
+    """
+    def __init__(self, wsgi_app, threads):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+    @staticmethod
+    def environ(scope, body):
+        server_name, server_port = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': (scope.get('client') or ('',))[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = 'HTTP_' + name
+            environ[name] = f"{environ[name]},{value}" if name in environ else value
+        # The body was read whole, which also covers chunked uploads without a length
+        environ['CONTENT_LENGTH'] = str(len(body))
+        return environ
+
+    def _run(self, environ, loop, queue):
+        def put(item):
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            put(('start', int(status.split(' ', 1)[0]), headers))
+
+        try:
+            result = self.wsgi_app(environ, start_response)
+            try:
+                for chunk in result:
+                    if chunk:
+                        put(('body', chunk))
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except Exception as e:
+            put(('error', e))
+        put(('end', None))
+
+    async def __call__(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            body.extend(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(ASGI_WSGI_QUEUE_SIZE)
+        worker = loop.run_in_executor(self.executor, self._run, self.environ(scope, bytes(body)), loop, queue)
+        started = False
+        failure = None
+        while True:
+            kind, *payload = await queue.get()
+            if kind == 'start':
+                status, headers = payload
+                await send({
+                    'type': 'http.response.start',
+                    'status': status,
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+                })
+                started = True
+            elif kind == 'body':
+                await send({'type': 'http.response.body', 'body': payload[0], 'more_body': True})
+            elif kind == 'error' and not started:
+                status, headers, error_body = json_response({'error': str(payload[0])}, 500)
+                await send({'type': 'http.response.start', 'status': status,
+                            'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+                await send({'type': 'http.response.body', 'body': error_body})
+                started = None
+            elif kind == 'error':
+                failure = payload[0]
+            elif kind == 'end':
+                break
+        await worker
+        if failure is not None:
+            logger.error('%s %s failed after the response started; aborting it',
+                         scope['method'], scope['path'], exc_info=failure)
+            raise failure
+        if started:
+            await send({'type': 'http.response.body', 'body': b''})
+
+wsgi = WsgiBridge(flask_app, ASGI_WSGI_THREADS)
+
+async def _send_response(send, scope, status, headers, body):
+    request_headers = dict(scope.get('headers', []))
+    if b'origin' in request_headers:
+        # Same open CORS policy as the Flask app
+        headers = headers + [('access-control-allow-origin', '*')]
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            async_db_instance.close()
+            db_instance.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    route = match_route(scope['method'], scope['path'])
+    if route is None:
+        await wsgi(scope, receive, send)
+        return
+
+    # Measured and attributed like the Flask requests (see routes/monitoring.py)
+    endpoint, handler, path_params = route
+    started = time.perf_counter()
+    token = metrics.start_request(endpoint)
+    try:
+        try:
+            status, headers, body = await handler(AsyncRequest(scope, path_params, flask_app))
+        except Exception as e:
+            status, headers, body = json_response({'error': str(e)}, 500)
+        with flask_app.app_context():
+            record_request(endpoint, scope['method'], scope['path'], status, time.perf_counter() - started, len(body))
+    finally:
+        metrics.finish_request(token)
+    await _send_response(send, scope, status, headers, body)
@@ -0,0 +1,170 @@
+"""asyncio access to the database behind db_instance
+
+AsyncDatabase follows whatever backend db_instance is serving. On MongoDB it
+uses motor, the asyncio MongoDB driver, when it is installed. The in-memory
+fallback (and MongoDB without motor) is wrapped by ThreadedDatabase, which
+runs each blocking call on a small thread pool, so a long scan or aggregation
+never blocks the event loop. Both expose the subset of motor's API the async
+models use: awaitable find_one, and find/aggregate cursors with to_list and
+async iteration.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from itertools import islice
+import os
+from src.database.config import MONGO_URI, DATABASE_NAME, MockDatabase, db_instance, mongo_client_options
+from src.database.metrics import CommandCounter
+from src.database.query_stats import query_monitor
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:  # motor is optional; blocking calls then run on threads
+    AsyncIOMotorClient = None
+
+ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', '8'))
+ASYNC_BATCH_SIZE = int(os.getenv('ASYNC_BATCH_SIZE', '500'))
+
+async def _run(executor, function, *args):
+    """Await function(*args) on the executor, in a copy of the caller's context
+
+    The copy carries metrics.start_request's per-request stats, so the calls
+    count towards the request that made them.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, contextvars.copy_context().run, function, *args)
+
+class AsyncCursor:
+    """Awaitable view of a blocking cursor, opened on first fetch"""
+    def __init__(self, executor, open_cursor):
+        self._executor = executor
+        self._open_cursor = open_cursor
+        self._options = []
+        self._cursor = None
+
+    def _option(self, name, *args):
+        if self._cursor is not None:
+            raise RuntimeError('cannot set options after the cursor was opened')
+        self._options.append((name, args))
+        return self
+
+    def sort(self, key_or_list, direction=None):
+        # pymongo rejects a direction alongside a list of keys
+        if direction is None:
+            return self._option('sort', key_or_list)
+        return self._option('sort', key_or_list, direction)
+
+    def skip(self, skip):
+        return self._option('skip', skip)
+
+    def limit(self, limit):
+        return self._option('limit', limit)
+
+    def batch_size(self, batch_size):
+        return self._option('batch_size', batch_size)
+
+    def _fetch(self, length):
+        if self._cursor is None:
+            cursor = self._open_cursor()
+            for name, args in self._options:
+                cursor = getattr(cursor, name)(*args)
+            self._cursor = iter(cursor)
+        return list(islice(self._cursor, length))
+
+    async def to_list(self, length=None):
+        return await _run(self._executor, self._fetch, length)
+
+    async def __aiter__(self):
+        while True:
+            batch = await self.to_list(ASYNC_BATCH_SIZE)
+            for document in batch:
+                yield document
+            if len(batch) < ASYNC_BATCH_SIZE:
+                return
+
+class AsyncCollection:
+    """Coroutine methods over a blocking pymongo or MockCollection collection"""
+    def __init__(self, collection, executor):
+        self._collection = collection
+        self._executor = executor
+
+    async def _call(self, method, *args):
+        return await _run(self._executor, method, *args)
+
+    async def find_one(self, query=None, projection=None):
+        return await self._call(self._collection.find_one, query, projection)
+
+    def find(self, query=None, projection=None):
+        return AsyncCursor(self._executor, lambda: self._collection.find(query, projection))
+
+    def aggregate(self, pipeline):
+        return AsyncCursor(self._executor, lambda: self._collection.aggregate(pipeline))
+
+    async def insert_one(self, document):
+        return await self._call(self._collection.insert_one, document)
+
+    async def update_one(self, query, update, upsert=False):
+        return await self._call(self._collection.update_one, query, update, upsert)
+
+    async def delete_one(self, query):
+        return await self._call(self._collection.delete_one, query)
+
+class ThreadedDatabase:
+    """Async collections over a blocking database, sharing one thread pool"""
+    def __init__(self, db, executor):
+        self._db = db
+        self._executor = executor
+        self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = AsyncCollection(self._db[name], self._executor)
+        return collection
+
+class AsyncDatabase:
+    _instance = None
+    _executor = None
+    _threaded = None
+    _motor_client = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(AsyncDatabase, cls).__new__(cls)
+        return cls._instance
+
+    def get_db(self):
+        db = db_instance.get_db()
+        if db is None:
+            return None
+        if isinstance(db, MockDatabase) or AsyncIOMotorClient is None:
+            # Rewrapped when db_instance is promoted from the fallback to MongoDB
+            if self._threaded is None or self._threaded._db is not db:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=ASYNC_DB_THREADS,
+                                                        thread_name_prefix='async-db')
+                self._threaded = ThreadedDatabase(db, self._executor)
+            return self._threaded
+        if self._motor_client is None:
+            # Created on first use, inside the running event loop
+            self._motor_client = AsyncIOMotorClient(MONGO_URI, event_listeners=[CommandCounter(), query_monitor],
+                                                    **mongo_client_options())
+        return self._motor_client[DATABASE_NAME]
+
+    def close(self):
+        if self._motor_client is not None:
+            self._motor_client.close()
+            self._motor_client = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            self._threaded = None
+
+# Global async database instance
+async_db_instance = AsyncDatabase()
@@ -0,0 +1,126 @@
+"""Coroutine counterparts of the model finders, for the ASGI entry point
+
+They query through async_db_instance and return the ordinary User, Customer
+and Delivery objects, so serialization stays in one place. Independent
+lookups are issued concurrently with asyncio.gather.
+"""
+
+import asyncio
+from datetime import datetime, date
+from bson import ObjectId
+from src.database.async_database import async_db_instance
+from src.database.pagination import keyset_page_async, PAGE_SIZE_DEFAULT
+from src.models.customer import Customer
+from src.models.delivery import Delivery
+from src.models.projection import mongo_projection
+from src.models.user import User
+
+async def _find_one(collection, query, model, fields):
+    db = async_db_instance.get_db()
+    if db is None:
+        return None
+
+    data = await db[collection].find_one(query, mongo_projection(fields))
+    if data:
+        return model._from_document(data, fields)
+    return None
+
+async def _find_by_ids(collection, ids, model, fields):
+    db = async_db_instance.get_db()
+    if db is None or not ids:
+        return {}
+
+    ids = list({ObjectId(_id) for _id in ids})
+    documents = await db[collection].find({'_id': {'$in': ids}}, mongo_projection(fields)).to_list(None)
+    return {data['_id']: model._from_document(data, fields) for data in documents}
+
+class AsyncUser:
+    @staticmethod
+    async def find_by_id(user_id, fields=None):
+        return await _find_one('users', {'_id': ObjectId(user_id)}, User, fields)
+
+    @staticmethod
+    async def find_by_username(username, fields=None):
+        return await _find_one('users', {'username': username}, User, fields)
+
+    @staticmethod
+    async def find_by_ids(user_ids, fields=None):
+        """Load many users with one $in query; returns a dict keyed by _id"""
+        return await _find_by_ids('users', user_ids, User, fields)
+
+class AsyncCustomer:
+    @staticmethod
+    async def find_by_id(customer_id, fields=None):
+        return await _find_one('customers', {'_id': ObjectId(customer_id)}, Customer, fields)
+
+    @staticmethod
+    async def find_by_ids(customer_ids, fields=None):
+        """Load many customers with one $in query; returns a dict keyed by _id"""
+        return await _find_by_ids('customers', customer_ids, Customer, fields)
+
+class AsyncDelivery:
+    @staticmethod
+    async def find_by_id(delivery_id, fields=None):
+        return await _find_one('deliveries', {'_id': ObjectId(delivery_id)}, Delivery, fields)
+
+    @staticmethod
+    async def _find(query, fields, sort=None):
+        db = async_db_instance.get_db()
+        if db is None:
+            return []
+
+        cursor = db.deliveries.find(query, mongo_projection(fields))
+        if sort:
+            cursor = cursor.sort(sort)
+        return [Delivery._from_document(data, fields) for data in await cursor.to_list(None)]
+
+    @staticmethod
+    async def find_by_date_and_delivery_boy(delivery_date, delivery_boy_id, fields=None):
+        query_date = delivery_date if isinstance(delivery_date, date) else datetime.strptime(delivery_date, '%Y-%m-%d').date()
+        return await AsyncDelivery._find(
+            {'delivery_date': query_date, 'delivery_boy_id': ObjectId(delivery_boy_id)}, fields)
+
+    @staticmethod
+    async def find_by_customer_id(customer_id, fields=None):
+        return await AsyncDelivery._find(
+            {'customer_id': ObjectId(customer_id)}, fields, [('delivery_date', -1)])
+
+    @staticmethod
+    async def get_page(cursor=None, limit=PAGE_SIZE_DEFAULT, delivery_boy_id=None, fields=None):
+        """One page of deliveries, newest first by (delivery_date, _id)
+
+        Returns (deliveries, next_cursor).
+        """
+        db = async_db_instance.get_db()
+        if db is None:
+            return [], None
+
+        query = {}
+        if delivery_boy_id:
+            query['delivery_boy_id'] = ObjectId(delivery_boy_id)
+        projection = mongo_projection(None if fields is None else {'delivery_date', *fields})
+        documents, next_cursor = await keyset_page_async(
+            db.deliveries, query, 'delivery_date', -1, cursor, limit, projection)
+        return [Delivery._from_document(data, fields) for data in documents], next_cursor
+
+    @staticmethod
+    async def to_dict_many(deliveries, include_customer=False, include_delivery_boy=False):
+        """Serialize deliveries, loading their customers and delivery boys concurrently"""
+        customers, delivery_boys = await asyncio.gather(
+            AsyncCustomer.find_by_ids({delivery.customer_id for delivery in deliveries})
+            if include_customer else asyncio.sleep(0, {}),
+            AsyncUser.find_by_ids({delivery.delivery_boy_id for delivery in deliveries}, User.PUBLIC_FIELDS)
+            if include_delivery_boy else asyncio.sleep(0, {})
+        )
+
+        results = []
+        for delivery in deliveries:
+            result = delivery.to_dict()
+            if include_customer:
+                customer = customers.get(delivery.customer_id)
+                result['customer'] = customer.to_dict() if customer else None
+            if include_delivery_boy:
+                delivery_boy = delivery_boys.get(delivery.delivery_boy_id)
+                result['delivery_boy'] = delivery_boy.to_dict() if delivery_boy else None
+            results.append(result)
+        return results
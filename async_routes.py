@@ -0,0 +1,241 @@
+"""Coroutine versions of the report and delivery-list endpoints
+
+Served by src/asgi.py on the same URLs as the Flask views, with the same
+request parameters and response bodies: the queries and the bodies come from
+the shared helpers in src/routes/reports.py. A request waiting on the database
+here holds no thread, so slow reports cannot use up the workers the other
+endpoints run on. Independent queries of one request are awaited together.
+
+Each handler takes an AsyncRequest and returns (status, headers, body).
+"""
+
+import asyncio
+import json
+import re
+from functools import wraps
+from urllib.parse import parse_qsl
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask_jwt_extended import decode_token
+from jwt import ExpiredSignatureError
+from werkzeug.http import generate_etag, parse_etags
+from src.database.async_database import async_db_instance
+from src.database.cache import report_cache
+from src.database.pagination import InvalidCursor, page_size
+from src.models.async_models import AsyncCustomer, AsyncDelivery, AsyncUser
+from src.models.user import User
+from src.routes.reports import (
+    CUSTOMER_DELIVERY_FIELDS, EMPTY_STATS, _parse_date, customer_deliveries_query, customer_report_response,
+    daily_pipeline, daily_report_response, delivery_boy_pipeline, delivery_boy_report_response,
+    summary_pipeline, summary_response, summary_scopes
+)
+
+class AsyncRequest:
+    """The parts of an ASGI HTTP scope the handlers read"""
+    def __init__(self, scope, path_params, flask_app):
+        self.path_params = path_params
+        self.flask_app = flask_app
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope.get('headers', [])}
+        # First value wins, as with Flask's request.args.get
+        self.args = {}
+        for name, value in parse_qsl(scope.get('query_string', b'').decode('latin-1')):
+            self.args.setdefault(name, value)
+        self.claims = None
+
+    @property
+    def identity(self):
+        return self.claims['sub']
+
+def json_response(payload, status=200, headers=None):
+    body = json.dumps(payload).encode('utf-8')
+    return status, [('content-type', 'application/json')] + (headers or []), body
+
+def jwt_required(handler):
+    """Decode the bearer token into request.claims, answering 401 like the Flask app"""
+    @wraps(handler)
+    async def wrapper(request):
+        authorization = request.headers.get('authorization', '')
+        if not authorization.startswith('Bearer '):
+            return json_response({'error': 'Authorization token is required'}, 401)
+        try:
+            with request.flask_app.app_context():
+                claims = decode_token(authorization[len('Bearer '):])
+        except ExpiredSignatureError:
+            return json_response({'error': 'Token has expired'}, 401)
+        except Exception:
+            return json_response({'error': 'Invalid token'}, 401)
+        if claims.get('type') != 'access':
+            return json_response({'error': 'Invalid token'}, 401)
+        request.claims = claims
+        return await handler(request)
+    return wrapper
+
+async def current_role(request):
+    """Async counterpart of auth.current_role, checking the token_version too"""
+    user = await AsyncUser.find_by_id(request.identity, User.AUTH_FIELDS)
+    return user.role_for_token(request.claims) if user else None
+
+def cached_report(scopes_for):
+    """Async counterpart of reports.cached_report, sharing report_cache
+
+    Entries are keyed apart from the Flask ones but invalidated by the same
+    scope bumps, so both entry points see a write at once.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(request):
+            if await current_role(request) != 'admin':
+                return json_response({'error': 'Admin access required'}, 403)
+            try:
+                scopes = scopes_for(request)
+            except (ValueError, InvalidId):
+                # Let the handler report the bad parameter
+                return await handler(request)
+
+            key = ('asgi', handler.__name__, tuple(sorted(request.path_params.items())),
+                   tuple(sorted(request.args.items())))
+            cached = report_cache.get(key)
+            if cached is None:
+                # Taken before computing, so a concurrent write leaves the entry stale
+                generations = report_cache.generations(scopes)
+                response = await handler(request)
+                if response[0] != 200:
+                    return response
+                cached = (response[2], generate_etag(response[2]))
+                report_cache.set(key, scopes, generations, cached)
+
+            body, etag = cached
+            headers = [('etag', f'"{etag}"')]
+            if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+                return 304, headers, b''
+            return 200, [('content-type', 'application/json')] + headers, body
+        return wrapper
+    return decorator
+
+@jwt_required
+@cached_report(lambda request: summary_scopes(request.args))
+async def get_delivery_summary(request):
+    try:
+        db = async_db_instance.get_db()
+        if db is None:
+            return json_response(EMPTY_STATS)
+
+        result = await db.daily_rollups.aggregate(summary_pipeline(request.args)).to_list(None)
+        return json_response(summary_response(result))
+
+    except ValueError as e:
+        return json_response({'error': str(e)}, 400)
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+@jwt_required
+@cached_report(lambda request: [('customer', ObjectId(request.path_params['customer_id']))])
+async def get_customer_report(request):
+    try:
+        db = async_db_instance.get_db()
+        if db is None:
+            return json_response([])
+
+        customer_id = ObjectId(request.path_params['customer_id'])
+        query = customer_deliveries_query(customer_id, request.args)
+        # The deliveries are read while the customer is being looked up
+        customer, documents = await asyncio.gather(
+            AsyncCustomer.find_by_id(customer_id),
+            db.deliveries.find(query, CUSTOMER_DELIVERY_FIELDS).sort('delivery_date', -1).to_list(None)
+        )
+        if not customer:
+            return json_response({'error': 'Customer not found'}, 404)
+
+        return json_response(customer_report_response(customer, documents))
+
+    except ValueError as e:
+        return json_response({'error': str(e)}, 400)
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+@jwt_required
+@cached_report(lambda request: [('delivery_boy', ObjectId(request.path_params['delivery_boy_id']))])
+async def get_delivery_boy_report(request):
+    try:
+        db = async_db_instance.get_db()
+        if db is None:
+            return json_response([])
+
+        delivery_boy_id = ObjectId(request.path_params['delivery_boy_id'])
+        delivery_boy, result = await asyncio.gather(
+            AsyncUser.find_by_id(delivery_boy_id, User.PUBLIC_FIELDS),
+            db.daily_rollups.aggregate(delivery_boy_pipeline(delivery_boy_id, request.args)).to_list(None)
+        )
+        if not delivery_boy or delivery_boy.role != 'delivery_boy':
+            return json_response({'error': 'Delivery boy not found'}, 404)
+
+        return json_response(delivery_boy_report_response(delivery_boy, result))
+
+    except ValueError as e:
+        return json_response({'error': str(e)}, 400)
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+@jwt_required
+@cached_report(lambda request: [('date', _parse_date(request.path_params['report_date']))])
+async def get_daily_report(request):
+    try:
+        report_date = request.path_params['report_date']
+        db = async_db_instance.get_db()
+        if db is None:
+            return json_response(dict(EMPTY_STATS, date=report_date, delivery_boys=[]))
+
+        result = await db.daily_rollups.aggregate(daily_pipeline(_parse_date(report_date))).to_list(None)
+        return json_response(daily_report_response(report_date, result))
+
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+@jwt_required
+async def list_deliveries(request):
+    try:
+        # Delivery boys only ever see their own deliveries
+        role = await current_role(request)
+        if role == 'admin':
+            delivery_boy_id = request.args.get('delivery_boy_id')
+        elif role == 'delivery_boy':
+            delivery_boy_id = request.identity
+        else:
+            return json_response({'error': 'Access denied'}, 403)
+
+        limit = page_size(request.args.get('limit'))
+        deliveries, next_cursor = await AsyncDelivery.get_page(request.args.get('cursor'), limit, delivery_boy_id)
+
+        return json_response({
+            'items': await AsyncDelivery.to_dict_many(deliveries, include_customer=True, include_delivery_boy=True),
+            'next_cursor': next_cursor,
+            'limit': limit
+        })
+
+    except (InvalidCursor, InvalidId) as e:
+        return json_response({'error': str(e)}, 400)
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+# (method, path pattern, endpoint of the Flask view it stands in for, handler);
+# the endpoint names the request in the metrics, as it would under Flask
+ROUTES = [
+    ('GET', r'/api/reports/summary', 'reports.get_delivery_summary', get_delivery_summary),
+    ('GET', r'/api/reports/customer/(?P<customer_id>[^/]+)', 'reports.get_customer_report', get_customer_report),
+    ('GET', r'/api/reports/delivery-boy/(?P<delivery_boy_id>[^/]+)', 'reports.get_delivery_boy_report',
+     get_delivery_boy_report),
+    ('GET', r'/api/reports/daily/(?P<report_date>[^/]+)', 'reports.get_daily_report', get_daily_report),
+    ('GET', r'/api/listings/deliveries', 'listings.list_deliveries', list_deliveries),
+]
+
+_COMPILED = [(method, re.compile(pattern + '$'), endpoint, handler) for method, pattern, endpoint, handler in ROUTES]
+
+def match_route(method, path):
+    """(endpoint, handler, path_params) for an async endpoint, or None"""
+    for route_method, pattern, endpoint, handler in _COMPILED:
+        if method == route_method:
+            match = pattern.match(path)
+            if match:
+                return endpoint, handler, match.groupdict()
+    return None
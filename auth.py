@@ -1,9 +1,21 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt, get_jwt_identity
 from src.models.user import User
+from src.models.passwords import PasswordPoolBusy
 
 auth_bp = Blueprint('auth', __name__)
 
+def current_role():
+    """Role of the authenticated user, or None once their tokens are revoked
+    
+    The role comes from the token's claims, but the user's token_version is
+    checked on every request, so a demotion or deletion (User.revoke_tokens)
+    takes effect at once instead of when the token expires. The lookup reads
+    two fields and is shared with the rest of the request by the identity map.
+    """
+    user = User.find_by_id(get_jwt_identity(), User.AUTH_FIELDS)
+    return user.role_for_token(get_jwt()) if user else None
+
 @auth_bp.route('/login', methods=['POST'])
 def login():
     try:
@@ -21,14 +33,24 @@ def login():
         if not user or not user.check_password(password):
             return jsonify({'error': 'Invalid username or password'}), 401
         
+        if user.password_needs_rehash():
+            user.rehash_password_in_background(password)
+        
         # Create access token
-        access_token = create_access_token(identity=str(user._id))
+        access_token = create_access_token(
+            identity=str(user._id),
+            additional_claims=user.token_claims()
+        )
         
         return jsonify({
             'token': access_token,
             'user': user.to_dict()
         }), 200
         
+    except PasswordPoolBusy:
+        response = jsonify({'error': 'Server busy, please retry'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -37,10 +59,7 @@ def login():
 def register():
     try:
         # Only admin can register new users
-        current_user_id = get_jwt_identity()
-        current_user = User.find_by_id(current_user_id)
-        
-        if not current_user or current_user.role != 'admin':
+        if current_role() != 'admin':
             return jsonify({'error': 'Only admin can register new users'}), 403
         
         data = request.get_json()
@@ -82,14 +101,9 @@ def init_admin():
         from src.database.config import db_instance
         db = db_instance.get_db()
         
-        if hasattr(db, 'users'):
-            # Check for existing admin in in-memory storage
-            existing_admins = [u for u in db.users.find({}) if u.get('role') == 'admin']
-        else:
-            # Check for existing admin in MongoDB
-            existing_admins = list(db.users.find({'role': 'admin'}))
+        existing_admin = db.users.find_one({'role': 'admin'}, {'_id': 1})
         
-        if existing_admins:
+        if existing_admin:
             return jsonify({'error': 'Admin user already exists'}), 409
         
         # Create default admin user
@@ -118,7 +132,7 @@ def init_admin():
 def get_current_user():
     try:
         current_user_id = get_jwt_identity()
-        user = User.find_by_id(current_user_id)
+        user = User.find_by_id_cached(current_user_id)
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Endpoint benchmark suite for Milk Delivery App
+Loads a synthetic depot (see src/seed_data.py), then drives every API
+endpoint through the Flask test client and prints throughput and p50/p95/p99
+latency per endpoint. Results are written as JSON; with --compare, each
+endpoint is checked against an earlier results file and the run fails when
+one got slower by more than --threshold.
+
+Path parameters and bodies are drawn from the depot with a seeded random
+generator, so two runs with the same arguments send the same requests.
+Endpoints marked heavy (full exports, whole-collection lists, bcrypt logins,
+materializing a day) run --heavy-requests times instead of --requests.
+
+With --no-seed, the depot already in the database is used; it must have been
+loaded by src/seed_data.py, whose users the benchmark logs in as.
+
+Usage: python src/bench_endpoints.py [--customers 10000] [--delivery-boys 100] [--days 730]
+                                     [--requests 50] [--concurrency 1]
+                                     [--output bench_results.json] [--compare previous.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from bson import ObjectId
+from werkzeug.exceptions import HTTPException
+from src.database.config import INMEMORY_STORAGE_MODE, db_instance
+from src.main import app
+from src.seed_data import ADMIN_USERNAME, SEED_PASSWORD, Depot, load
+
+# Delivery boys logged in to spread their requests over
+DELIVERY_BOY_SESSIONS = 5
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class Pools:
+    """Ids and dates of the depot in the database, to build requests from"""
+    def __init__(self, db):
+        self.customer_ids = [str(document['_id']) for document in db.customers.find({}, {'_id': 1})]
+        self.subscription_ids = [str(document['_id']) for document in db.subscriptions.find({}, {'_id': 1})]
+        self.delivery_boys = {str(document['_id']): document['username'] for document in
+                              db.users.find({'role': 'delivery_boy'}, {'_id': 1, 'username': 1})
+                              if document['username'].startswith('seed_boy')}
+        first = next(iter(db.deliveries.find({}, {'delivery_date': 1}).sort('delivery_date', 1).limit(1)), None)
+        last = next(iter(db.deliveries.find({}, {'delivery_date': 1}).sort('delivery_date', -1).limit(1)), None)
+        if not self.customer_ids or not self.delivery_boys or first is None:
+            raise RuntimeError('No seeded depot in the database; run without --no-seed or run src/seed_data.py')
+        self.first_date = first['delivery_date']
+        self.last_date = last['delivery_date']
+        self.admin_token = None
+        # Logged-in delivery boys: id -> (token, ids of their deliveries on the last day)
+        self.sessions = {}
+
+    def date(self, rng):
+        return self.first_date + timedelta(days=rng.randrange((self.last_date - self.first_date).days + 1))
+
+    def window(self, rng, days=30):
+        """start_date/end_date query arguments for a random window of the depot's history"""
+        start = self.date(rng)
+        return f'start_date={start.isoformat()}&end_date={(start + timedelta(days=days - 1)).isoformat()}'
+
+    def customer(self, rng):
+        return rng.choice(self.customer_ids)
+
+    def delivery_boy(self, rng):
+        return rng.choice(sorted(self.delivery_boys))
+
+    def todays_delivery(self, rng, delivery_boy_id):
+        return rng.choice(self.sessions[delivery_boy_id][1])
+
+class Scenario:
+    """One endpoint and how to call it
+
+    path and body are called with (pools, rng, delivery_boy_id) for every
+    request; delivery_boy_id is the logged-in delivery boy sending it when role
+    is 'delivery_boy'. role may also be 'admin', or None to send no token.
+    """
+    def __init__(self, method, path, role='admin', body=None, heavy=False, expect=(200,), label=None):
+        self.method = method
+        self.path = path
+        self.role = role
+        self.body = body
+        self.heavy = heavy
+        self.expect = expect
+        self.label = label
+
+    def name(self, template):
+        return f'{self.method} {template}' + (f' ({self.label})' if self.label else '')
+
+def _fixed(path):
+    return lambda pools, rng, delivery_boy_id: path
+
+def _bulk_assignments(pools, rng, delivery_boy_id):
+    day = (pools.last_date + timedelta(days=1)).isoformat()
+    delivery_boy_id = pools.delivery_boy(rng)
+    return {'assignments': [{'customer_id': pools.customer(rng), 'delivery_boy_id': delivery_boy_id,
+                             'date': day, 'quantity': rng.choice((1, 2))} for _ in range(20)]}
+
+def _status_changes(pools, rng, delivery_boy_id):
+    now = datetime.utcnow().isoformat() + 'Z'
+    return {'changes': [{'id': pools.todays_delivery(rng, delivery_boy_id),
+                         'status': rng.choice(('Delivered', 'Issue')), 'timestamp': now,
+                         'idempotency_key': str(uuid.UUID(int=rng.getrandbits(128)))} for _ in range(5)]}
+
+# (path template, scenario); the template names the endpoint in the results
+SCENARIOS = [
+    ('/api/health', Scenario('GET', _fixed('/api/health'), role=None)),
+    ('/api/auth/me', Scenario('GET', _fixed('/api/auth/me'))),
+    ('/api/auth/login', Scenario(
+        'POST', _fixed('/api/auth/login'), role=None, heavy=True,
+        body=lambda pools, rng, _: {'username': ADMIN_USERNAME, 'password': SEED_PASSWORD})),
+    ('/api/customers/', Scenario('GET', _fixed('/api/customers/'), heavy=True)),
+    ('/api/listings/customers', Scenario('GET', _fixed('/api/listings/customers?limit=50'))),
+    ('/api/listings/deliveries', Scenario('GET', _fixed('/api/listings/deliveries?limit=50'))),
+    ('/api/listings/deliveries', Scenario('GET', _fixed('/api/listings/deliveries?limit=50'),
+                                          role='delivery_boy', label='delivery boy')),
+    ('/api/deliveries/', Scenario('GET', _fixed('/api/deliveries/'), heavy=True)),
+    ('/api/deliveries/daily/<date>', Scenario(
+        'GET', lambda pools, rng, _: f'/api/deliveries/daily/{pools.last_date.isoformat()}', role='delivery_boy')),
+    ('/api/deliveries/history/<customer_id>', Scenario(
+        'GET', lambda pools, rng, _: f'/api/deliveries/history/{pools.customer(rng)}')),
+    ('/api/reports/summary', Scenario('GET', _fixed('/api/reports/summary'), label='all time')),
+    ('/api/reports/summary', Scenario(
+        'GET', lambda pools, rng, _: f'/api/reports/summary?{pools.window(rng)}', label='30 days')),
+    ('/api/reports/customer/<customer_id>', Scenario(
+        'GET', lambda pools, rng, _: f'/api/reports/customer/{pools.customer(rng)}?{pools.window(rng)}')),
+    ('/api/reports/delivery-boy/<delivery_boy_id>', Scenario(
+        'GET', lambda pools, rng, _: f'/api/reports/delivery-boy/{pools.delivery_boy(rng)}?{pools.window(rng)}')),
+    ('/api/reports/daily/<date>', Scenario(
+        'GET', lambda pools, rng, _: f'/api/reports/daily/{pools.date(rng).isoformat()}')),
+    ('/api/reports/cache-stats', Scenario('GET', _fixed('/api/reports/cache-stats'))),
+    ('/api/exports/customer/<customer_id>', Scenario(
+        'GET', lambda pools, rng, _: f'/api/exports/customer/{pools.customer(rng)}')),
+    ('/api/exports/delivery-boy/<delivery_boy_id>', Scenario(
+        'GET', lambda pools, rng, _: f'/api/exports/delivery-boy/{pools.delivery_boy(rng)}', heavy=True)),
+    ('/api/exports/deliveries', Scenario('GET', _fixed('/api/exports/deliveries'), heavy=True)),
+    ('/api/subscriptions/', Scenario('GET', _fixed('/api/subscriptions/'), heavy=True)),
+    ('/api/metrics', Scenario('GET', _fixed('/api/metrics'))),
+    ('/api/metrics/queries', Scenario('GET', _fixed('/api/metrics/queries'))),
+    # Writes last, so every read sees the depot as it was loaded
+    ('/api/deliveries/<delivery_id>/status', Scenario(
+        'PUT', lambda pools, rng, delivery_boy_id: f'/api/deliveries/{pools.todays_delivery(rng, delivery_boy_id)}'
+                                                   f'/status',
+        role='delivery_boy', body=lambda pools, rng, _: {'status': rng.choice(('Delivered', 'Issue'))})),
+    ('/api/deliveries/sync', Scenario('POST', _fixed('/api/deliveries/sync'), role='delivery_boy',
+                                      body=_status_changes)),
+    ('/api/deliveries/bulk', Scenario('POST', _fixed('/api/deliveries/bulk'), body=_bulk_assignments,
+                                      expect=(201, 207))),
+    ('/api/auth/register', Scenario(
+        'POST', _fixed('/api/auth/register'), heavy=True, expect=(201,),
+        body=lambda pools, rng, _: {'username': f'bench_{rng.getrandbits(48):012x}', 'password': SEED_PASSWORD,
+                                    'role': 'delivery_boy', 'name': 'Bench Delivery Boy'})),
+    ('/api/subscriptions/', Scenario(
+        'POST', _fixed('/api/subscriptions/'), expect=(201,),
+        body=lambda pools, rng, _: {'customer_id': pools.customer(rng),
+                                    'delivery_boy_id': pools.delivery_boy(rng), 'quantity': 1})),
+    ('/api/subscriptions/<subscription_id>', Scenario(
+        'PUT', lambda pools, rng, _: f'/api/subscriptions/{rng.choice(pools.subscription_ids)}',
+        body=lambda pools, rng, _: {'quantity': rng.choice((1, 2, 3))})),
+    ('/api/subscriptions/materialize', Scenario(
+        'POST', _fixed('/api/subscriptions/materialize'), heavy=True,
+        body=lambda pools, rng, _: {'date': (pools.last_date + timedelta(days=2)).isoformat()})),
+    # Each request deletes a different seeded subscription
+    ('/api/subscriptions/<subscription_id>', Scenario(
+        'DELETE', lambda pools, rng, _: f'/api/subscriptions/{pools.subscription_ids.pop()}')),
+]
+
+# Endpoints left out on purpose: init-admin only works on an empty database
+NOT_BENCHMARKED = {'auth.init_admin'}
+
+def _route(method, path):
+    """Endpoint name a request would reach, or None; the SPA catch-all does not count"""
+    try:
+        endpoint, _ = app.url_map.bind('localhost').match(path.split('?', 1)[0], method)
+    except HTTPException:
+        return None
+    return None if endpoint in ('serve', 'static') else endpoint
+
+def login(client, username):
+    response = client.post('/api/auth/login', json={'username': username, 'password': SEED_PASSWORD})
+    if response.status_code != 200:
+        raise RuntimeError(f'Could not log in as {username}: {response.get_json()}')
+    return response.get_json()['token']
+
+def open_sessions(pools, seed):
+    """Log in the admin and a few delivery boys, noting the boys' deliveries on the last day"""
+    client = app.test_client()
+    db = db_instance.get_db()
+    pools.admin_token = login(client, ADMIN_USERNAME)
+    rng = random.Random(f'{seed}:sessions')
+    sessions = min(DELIVERY_BOY_SESSIONS, len(pools.delivery_boys))
+    for delivery_boy_id in rng.sample(sorted(pools.delivery_boys), sessions):
+        deliveries = [str(document['_id']) for document in db.deliveries.find(
+            {'delivery_date': pools.last_date, 'delivery_boy_id': ObjectId(delivery_boy_id)}, {'_id': 1})]
+        if deliveries:
+            pools.sessions[delivery_boy_id] = (login(client, pools.delivery_boys[delivery_boy_id]), deliveries)
+    if not pools.sessions:
+        raise RuntimeError(f'No deliveries on {pools.last_date} for the delivery boys logged in')
+
+def build_requests(scenario, pools, count, rng):
+    requests = []
+    for _ in range(count):
+        delivery_boy_id, token = None, None
+        if scenario.role == 'admin':
+            token = pools.admin_token
+        elif scenario.role == 'delivery_boy':
+            delivery_boy_id = rng.choice(sorted(pools.sessions))
+            token = pools.sessions[delivery_boy_id][0]
+        path = scenario.path(pools, rng, delivery_boy_id)
+        body = scenario.body(pools, rng, delivery_boy_id) if scenario.body else None
+        requests.append((path, {'Authorization': f'Bearer {token}'} if token else {}, body))
+    return requests
+
+def run_scenario(scenario, requests, concurrency):
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    queue = iter(requests)
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                request = next(queue, None)
+            if request is None:
+                return
+            path, headers, body = request
+            started = time.perf_counter()
+            response = client.open(path, method=scenario.method, headers=headers, json=body)
+            # Streaming responses are only done once their body has been read
+            response.get_data()
+            elapsed = time.perf_counter() - started
+            response.close()
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(min(concurrency, len(requests)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+
+    return {
+        'method': scenario.method,
+        'requests': len(requests),
+        'errors': sum(number for status, number in statuses.items() if status not in scenario.expect),
+        'statuses': {str(status): number for status, number in sorted(statuses.items())},
+        'throughput_rps': round(len(requests) / duration, 2) if duration else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3)
+    }
+
+def compare(results, previous, threshold):
+    """Print the change of each endpoint against previous; returns the names that regressed"""
+    regressed = []
+    print(f"\nAgainst {previous['created_at']} (p95 threshold +{threshold:.0%}):")
+    for name, result in results['endpoints'].items():
+        before = previous['endpoints'].get(name)
+        if 'skipped' in result or not before or 'skipped' in before:
+            continue
+        change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] if before['p95_ms'] else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSED'
+            regressed.append(name)
+        print(f"{name:<60} p95 {before['p95_ms']:9.2f} -> {result['p95_ms']:9.2f} ms ({change:+7.1%})  "
+              f"{before['throughput_rps']:8.1f} -> {result['throughput_rps']:8.1f} req/s{flag}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every API endpoint on a synthetic depot')
+    parser.add_argument('--customers', type=int, default=10000)
+    parser.add_argument('--delivery-boys', type=int, default=100)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--end-date', type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                        help='last day of deliveries (default: today)')
+    parser.add_argument('--no-seed', action='store_true', help='use the depot already in the database')
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--heavy-requests', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--only', help='run only endpoints whose name contains this text')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='p95 growth counted as a regression')
+    args = parser.parse_args()
+
+    db_instance.connect()
+    results = {
+        'created_at': datetime.utcnow().isoformat(),
+        'config': {
+            'backend': db_instance.backend,
+            'storage_mode': INMEMORY_STORAGE_MODE if db_instance.backend == 'memory' else None,
+            'seed': args.seed,
+            'customers': args.customers,
+            'delivery_boys': args.delivery_boys,
+            'days': args.days,
+            'requests': args.requests,
+            'heavy_requests': args.heavy_requests,
+            'concurrency': args.concurrency,
+            'python': platform.python_version()
+        },
+        'endpoints': {}
+    }
+
+    if not args.no_seed:
+        depot = Depot(args.seed, args.customers, args.delivery_boys, args.days, args.end_date)
+        print(f"Seeding {args.customers} customers, {args.delivery_boys} delivery boys, "
+              f"{depot.start_date} to {depot.end_date} ({db_instance.backend})...")
+        started = time.time()
+        counts = load(depot)
+        results['seeding'] = {'seconds': round(time.time() - started, 2), 'inserted': counts}
+        print(f"Seeded in {results['seeding']['seconds']}s: {counts}\n")
+
+    pools = Pools(db_instance.get_db())
+    results['config']['first_date'] = pools.first_date.isoformat()
+    results['config']['last_date'] = pools.last_date.isoformat()
+    open_sessions(pools, args.seed)
+
+    covered = set()
+    for template, scenario in SCENARIOS:
+        name = scenario.name(template)
+        if args.only and args.only not in name:
+            continue
+        count = args.heavy_requests if scenario.heavy else args.requests
+        requests = build_requests(scenario, pools, count, random.Random(f'{args.seed}:{name}'))
+        endpoint = _route(scenario.method, requests[0][0]) if requests else None
+        if endpoint is None:
+            results['endpoints'][name] = {'skipped': 'no route in this app'}
+            print(f"{name:<60} skipped: no route in this app")
+            continue
+        covered.add(endpoint)
+        result = run_scenario(scenario, requests, args.concurrency)
+        results['endpoints'][name] = result
+        print(f"{name:<60} {result['throughput_rps']:8.1f} req/s  p50 {result['p50_ms']:8.2f} ms  "
+              f"p95 {result['p95_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+              f"errors {result['errors']}/{result['requests']}")
+
+    if not args.only:
+        uncovered = sorted({rule.endpoint for rule in app.url_map.iter_rules()
+                            if rule.endpoint not in ('serve', 'static')} - covered - NOT_BENCHMARKED)
+        if uncovered:
+            print(f"\nNot benchmarked: {', '.join(uncovered)}")
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as previous:
+            regressed = compare(results, json.load(previous), args.threshold)
+        if regressed:
+            print(f"\n❌ {len(regressed)} endpoint(s) regressed")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Login throughput benchmark for Milk Delivery App
+Fires concurrent logins at /api/auth/login, first with bcrypt running inline
+in the request threads and then on the password worker pool, and prints
+throughput, latency percentiles and how many requests were shed with 503.
+
+Usage: python src/bench_login.py [--users 20] [--logins 200] [--concurrency 32]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from src.main import app
+from src.models import user as user_module
+from src.models.passwords import PasswordHasher, BCRYPT_ROUNDS, BCRYPT_QUEUE_SIZE
+
+PASSWORD = 'bench-password'
+
+def seed_users(count, rounds):
+    """Create bench users whose hashes use the given cost"""
+    user_module.hasher = PasswordHasher(rounds=rounds, workers=0)
+    usernames = []
+    for number in range(count):
+        username = f"bench_user{number}"
+        if not user_module.User.find_by_username(username):
+            user_module.User(username=username, password=PASSWORD,
+                             role='delivery_boy', name=f"Bench User {number}").save()
+        usernames.append(username)
+    return usernames
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def run_scenario(name, hasher, usernames, logins, concurrency):
+    user_module.hasher = hasher
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    counter = iter(range(logins))
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                number = next(counter, None)
+            if number is None:
+                return
+            started = time.perf_counter()
+            response = client.post('/api/auth/login', json={
+                'username': usernames[number % len(usernames)],
+                'password': PASSWORD
+            })
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+    hasher.shutdown()
+
+    succeeded = statuses.get(200, 0)
+    print(f"{name:<24} {succeeded / duration:8.1f} logins/s  "
+          f"p50 {percentile(latencies, 0.50) * 1000:7.1f} ms  "
+          f"p95 {percentile(latencies, 0.95) * 1000:7.1f} ms  "
+          f"p99 {percentile(latencies, 0.99) * 1000:7.1f} ms  "
+          f"statuses {dict(sorted(statuses.items()))}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark concurrent logins')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--rounds', type=int, default=BCRYPT_ROUNDS)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--queue-size', type=int, default=BCRYPT_QUEUE_SIZE)
+    args = parser.parse_args()
+
+    print(f"Seeding {args.users} users at bcrypt cost {args.rounds}...")
+    usernames = seed_users(args.users, args.rounds)
+    print(f"{args.logins} logins from {args.concurrency} concurrent clients\n")
+
+    run_scenario('inline', PasswordHasher(rounds=args.rounds, workers=0),
+                 usernames, args.logins, args.concurrency)
+    run_scenario(f"pool ({args.workers} workers)",
+                 PasswordHasher(rounds=args.rounds, workers=args.workers,
+                                queue_size=args.queue_size),
+                 usernames, args.logins, args.concurrency)
+
+if __name__ == '__main__':
+    main()
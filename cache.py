@@ -0,0 +1,121 @@
+"""In-process caches shared by the models and routes"""
+
+from collections import OrderedDict
+import os
+import threading
+import time
+
+_MISSING = object()
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire ttl seconds after being set
+
+    Per process only: a write in another worker is seen here once the entry
+    expires, so ttl bounds how stale a read can be.
+    """
+    def __init__(self, maxsize=1024, ttl=60, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires, value = entry
+                if expires > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+class ResponseCache:
+    """LRU cache of rendered responses, invalidated through generation counters
+
+    Every entry records the generation of each scope it was computed from,
+    e.g. ('date', day) or ('customer', id). A write bumps the generations of
+    the scopes it affects, which makes every entry depending on them stale
+    without having to find those entries. Per process only, like TTLCache.
+    """
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def bump(self, *scopes):
+        with self._lock:
+            for scope in scopes:
+                self._generations[scope] = self._generations.get(scope, 0) + 1
+
+    def generations(self, scopes):
+        """Current generations of scopes; take them before computing a value"""
+        with self._lock:
+            return tuple(self._generations.get(scope, 0) for scope in scopes)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                scopes, generations, value = entry
+                if generations == tuple(self._generations.get(scope, 0) for scope in scopes):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, scopes, generations, value):
+        with self._lock:
+            self._entries[key] = (tuple(scopes), generations, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+report_cache = ResponseCache(maxsize=int(os.getenv('REPORT_CACHE_SIZE', '256')))
@@ -0,0 +1,799 @@
+"""Column-oriented storage for the in-memory deliveries collection
+
+Instead of one dict per delivery, every field lives in a typed array: dates as
+ordinals, quantities as doubles, timestamps as microseconds and ObjectIds,
+statuses and free-text fields as dictionary-encoded integer codes, and the
+_ids as a column of ObjectId bytes. Documents are only materialized when a
+query returns them, and $group pipelines are answered with masked sums over
+the arrays (vectorized when NumPy is installed) without building any
+documents at all. Reports read the daily rollups, so that path now serves the
+full recount in rollup.rebuild() rather than requests.
+"""
+
+from array import array
+from datetime import date, datetime, timedelta
+import threading
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from src.database.aggregation import id_lookup, run_pipeline
+from src.database.query_stats import scan_tally
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - NumPy is optional
+    np = None
+
+_EPOCH = datetime(1970, 1, 1)
+_NO_CODE = -1
+_NO_TIME = -(2 ** 63)
+
+class _Dictionary:
+    """Maps repeated values (ObjectIds, statuses, notes) to small integer codes"""
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def lookup(self, value):
+        try:
+            return self.codes.get(value)
+        except TypeError:
+            return None
+
+class _CodeColumn:
+    """Dictionary-encoded column for hashable values"""
+    kind = 'code'
+
+    def __init__(self):
+        self.data = array('q')
+        self.dictionary = _Dictionary()
+
+    def encode(self, value):
+        hash(value)
+        return self.dictionary.encode(value)
+
+    def decode(self, code):
+        return self.dictionary.values[code]
+
+    def missing(self, code):
+        return code == _NO_CODE
+
+    def query_value(self, value):
+        """Code to compare against for an equality predicate, or None if absent"""
+        return self.dictionary.lookup(value)
+
+class _DateColumn:
+    kind = 'ordinal'
+
+    def __init__(self):
+        self.data = array('q')
+
+    def encode(self, value):
+        if not isinstance(value, date) or isinstance(value, datetime):
+            raise TypeError('not a date')
+        return value.toordinal()
+
+    def decode(self, code):
+        return date.fromordinal(code)
+
+    def missing(self, code):
+        return code == _NO_CODE
+
+    def query_value(self, value):
+        if not isinstance(value, date) or isinstance(value, datetime):
+            return None
+        return value.toordinal()
+
+class _TimeColumn:
+    kind = 'time'
+
+    def __init__(self):
+        self.data = array('q')
+
+    def encode(self, value):
+        if not isinstance(value, datetime) or value.tzinfo is not None:
+            raise TypeError('not a naive datetime')
+        delta = value - _EPOCH
+        return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+    def decode(self, code):
+        return _EPOCH + timedelta(microseconds=code)
+
+    def missing(self, code):
+        return code == _NO_TIME
+
+    def query_value(self, value):
+        return None
+
+class _NumberColumn:
+    kind = 'number'
+
+    def __init__(self):
+        self.data = array('d')
+
+    def encode(self, value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise TypeError('not a number')
+        return float(value)
+
+    def decode(self, code):
+        return int(code) if code.is_integer() else code
+
+    def missing(self, code):
+        return code != code  # NaN
+
+    def query_value(self, value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        return float(value)
+
+_MISSING_CODES = {'code': _NO_CODE, 'ordinal': _NO_CODE, 'time': _NO_TIME, 'number': float('nan')}
+
+# Field order here is the key order of materialized documents
+COLUMNS = (
+    ('customer_id', _CodeColumn),
+    ('delivery_boy_id', _CodeColumn),
+    ('delivery_date', _DateColumn),
+    ('quantity', _NumberColumn),
+    ('status', _CodeColumn),
+    ('notes', _CodeColumn),
+    ('photo_proof_url', _CodeColumn),
+    ('timestamp', _TimeColumn),
+    ('updated_by', _CodeColumn),
+    ('created_at', _TimeColumn),
+)
+
+_ID_SIZE = 12
+# Rows the first step of an ordered walk sorts; every later step doubles it
+WALK_CHUNK = 256
+
+class _KeyIndex:
+    """Key -> row number without a Python object per row
+
+    Keys (ObjectId bytes or packed int64 codes) are kept in a sorted array
+    with a parallel array of row numbers and found by bisection. Keys added
+    since the last merge wait in a dict until it outgrows a quarter of the
+    array, then go in with one linear merge. Entries whose row was removed or
+    rekeyed since stay in the array until that merge, so callers check the
+    row they get back. Without NumPy, and for tuple keys (values the array
+    cannot hold), the dict is all there is.
+    """
+    MERGE_MIN = 4096
+
+    def __init__(self, dtype, keys_of=None):
+        # keys_of(rows) gives the current keys of rows that can be rekeyed
+        self._keys_of = keys_of
+        self._recent = {}
+        if np is not None:
+            self._keys = np.zeros(0, dtype=dtype)
+            self._rows = np.zeros(0, dtype='i8')
+
+    def get(self, key):
+        """Row last added with key, possibly removed or rekeyed since"""
+        row = self._recent.get(key)
+        if row is not None or np is None or isinstance(key, tuple) or not len(self._keys):
+            return row
+        position = int(self._keys.searchsorted(key))
+        return int(self._rows[position]) if position < len(self._keys) else None
+
+    def add(self, key, row, alive):
+        self._recent[key] = row
+        if np is not None and len(self._recent) > max(self.MERGE_MIN, len(self._keys) // 4):
+            self._merge(alive)
+
+    def discard(self, key, row):
+        if self._recent.get(key) == row:
+            del self._recent[key]
+
+    def _merge(self, alive):
+        pending = [(key, row) for key, row in self._recent.items() if not isinstance(key, tuple)]
+        live = np.frombuffer(alive, dtype='u1')[self._rows].astype(bool)
+        if self._keys_of is not None:
+            live &= self._keys_of(self._rows) == self._keys
+        keys, rows = self._keys[live], self._rows[live]
+        if pending:
+            new_keys = np.array([key for key, _ in pending], dtype=self._keys.dtype)
+            new_rows = np.array([row for _, row in pending], dtype='i8')
+            order = np.argsort(new_keys, kind='stable')
+            new_keys, new_rows = new_keys[order], new_rows[order]
+            positions = np.searchsorted(keys, new_keys)
+            keys = np.insert(keys, positions, new_keys)
+            rows = np.insert(rows, positions, new_rows)
+        self._keys, self._rows = keys, rows
+        self._recent = {key: row for key, row in self._recent.items() if isinstance(key, tuple)}
+
+    def rebuild(self, keys, rows, other):
+        """Index every key at once, as after loading a snapshot; other maps tuple keys to rows"""
+        self._recent = dict(other)
+        if np is None:
+            self._recent.update(zip(keys, rows))
+            return
+        order = np.argsort(keys, kind='stable')
+        self._keys, self._rows = keys[order], rows[order]
+
+_RANGE_TESTS = {
+    '$gte': lambda column, value: column >= value,
+    '$gt': lambda column, value: column > value,
+    '$lte': lambda column, value: column <= value,
+    '$lt': lambda column, value: column < value,
+}
+
+class ColumnarCollection:
+    """Drop-in replacement for MemoryCollection that stores rows as typed columns
+
+    Fields outside COLUMNS, or values a column cannot encode, are kept per row
+    in an overflow dict; such rows are always returned as candidates so the
+    storage filter still sees them, and vectorized aggregation steps aside.
+    """
+    # ordered() breaks ties on _id, so it also serves keyset sorts on (field, _id)
+    orders_ties_by_id = True
+
+    def __init__(self):
+        self.columns = {name: factory() for name, factory in COLUMNS}
+        # ObjectId bytes of each row, _ID_SIZE apiece; other _id types in _other_ids
+        self._ids = bytearray()
+        self._other_ids = {}
+        self._index = _KeyIndex(f'S{_ID_SIZE}')
+        self._pairs = _KeyIndex('i8', self._pair_keys)
+        self._count = 0
+        self._alive = bytearray()
+        self._overflow = {}
+        self._irregular = set()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return (self._materialize(row) for row in self._live_rows())
+
+    def _live_rows(self):
+        return [row for row, alive in enumerate(self._alive) if alive]
+
+    @staticmethod
+    def _id_key(_id):
+        # Other _id types are wrapped so they cannot collide with ObjectId bytes
+        return _id.binary if isinstance(_id, ObjectId) else (_id,)
+
+    def _row(self, _id):
+        key = self._id_key(_id)
+        row = self._index.get(key)
+        if row is None or not self._alive[row]:
+            return None
+        # NumPy drops trailing zero bytes from the keys it returns; the column has them
+        if isinstance(key, bytes) and self._ids[row * _ID_SIZE:(row + 1) * _ID_SIZE] != key:
+            return None
+        return row
+
+    def _id_at(self, row):
+        _id = self._other_ids.get(row)
+        if _id is None:
+            _id = ObjectId(bytes(self._ids[row * _ID_SIZE:(row + 1) * _ID_SIZE]))
+        return _id
+
+    # Unique (customer_id, delivery_date), as MEMORY_INDEXES and indexes.py
+    # declare for the other backends. The customer code and the date ordinal
+    # (below 2 ** 22 through year 9999) are packed into one int64 key; rows
+    # whose values only fit the overflow dict are not guarded.
+
+    @staticmethod
+    def _pair_key(customer, ordinal):
+        if customer is None or ordinal is None or customer == _NO_CODE or ordinal == _NO_CODE:
+            return None
+        return customer << 22 | ordinal
+
+    def _pair_keys(self, rows):
+        customers = np.frombuffer(self.columns['customer_id'].data, dtype='i8')[rows]
+        ordinals = np.frombuffer(self.columns['delivery_date'].data, dtype='i8')[rows]
+        keys = customers << 22 | ordinals
+        keys[(customers == _NO_CODE) | (ordinals == _NO_CODE)] = -1
+        return keys
+
+    def _row_pair(self, row):
+        return self._pair_key(self.columns['customer_id'].data[row], self.columns['delivery_date'].data[row])
+
+    def _check_pair(self, document, row=None):
+        if 'customer_id' not in document or 'delivery_date' not in document:
+            return
+        key = self._pair_key(self.columns['customer_id'].query_value(document['customer_id']),
+                             self.columns['delivery_date'].query_value(document['delivery_date']))
+        existing = self._pairs.get(key) if key is not None else None
+        if existing is not None and existing != row and self._alive[existing] and self._row_pair(existing) == key:
+            fields = {'customer_id': document['customer_id'], 'delivery_date': document['delivery_date']}
+            raise DuplicateKeyError(f"E11000 duplicate key error: {fields}")
+
+    # Row encoding
+
+    def _write(self, row, name, value, present=True):
+        column = self.columns[name]
+        overflow = self._overflow.get(row)
+        if overflow is not None:
+            overflow.pop(name, None)
+        if not present:
+            code = _MISSING_CODES[column.kind]
+        elif value is None and column.kind != 'code':
+            # Keep explicit nulls distinguishable from missing fields
+            code = _MISSING_CODES[column.kind]
+            self._overflow.setdefault(row, {})[name] = None
+        else:
+            try:
+                code = column.encode(value)
+            except TypeError:
+                code = _MISSING_CODES[column.kind]
+                self._overflow.setdefault(row, {})[name] = value
+                self._irregular.add(row)
+        if row == len(column.data):
+            column.data.append(code)
+        else:
+            column.data[row] = code
+
+    def _materialize(self, row):
+        document = {'_id': self._id_at(row)}
+        overflow = self._overflow.get(row, {})
+        for name, column in self.columns.items():
+            code = column.data[row]
+            if not column.missing(code):
+                document[name] = column.decode(code)
+            elif name in overflow:
+                document[name] = overflow[name]
+        for name, value in overflow.items():
+            if name not in document:
+                document[name] = value
+        return document
+
+    # Collection interface used by InMemoryStorage
+
+    def insert(self, document):
+        with self._lock:
+            _id = document['_id']
+            if self._row(_id) is not None:
+                raise DuplicateKeyError(f"E11000 duplicate key error: _id {_id}")
+            self._check_pair(document)
+            row = len(self._alive)
+            if isinstance(_id, ObjectId):
+                self._ids += _id.binary
+            else:
+                self._ids += bytes(_ID_SIZE)
+                self._other_ids[row] = _id
+            self._alive.append(1)
+            for name in self.columns:
+                self._write(row, name, document.get(name), name in document)
+            extra = {key: value for key, value in document.items()
+                     if key != '_id' and key not in self.columns}
+            if extra:
+                self._overflow.setdefault(row, {}).update(extra)
+            self._index.add(self._id_key(_id), row, self._alive)
+            pair = self._row_pair(row)
+            if pair is not None:
+                self._pairs.add(pair, row, self._alive)
+            self._count += 1
+
+    def update(self, document, changes):
+        with self._lock:
+            row = self._row(document['_id'])
+            if row is None:
+                return
+            rekeyed = 'customer_id' in changes or 'delivery_date' in changes
+            if rekeyed:
+                self._check_pair(dict(document, **changes), row)
+                pair = self._row_pair(row)
+            for name, value in changes.items():
+                if name in self.columns:
+                    self._write(row, name, value)
+                elif name != '_id':
+                    self._overflow.setdefault(row, {})[name] = value
+            if rekeyed:
+                if pair is not None:
+                    self._pairs.discard(pair, row)
+                pair = self._row_pair(row)
+                if pair is not None:
+                    self._pairs.add(pair, row, self._alive)
+            document.update(changes)
+
+    def remove(self, document):
+        with self._lock:
+            row = self._row(document['_id'])
+            if row is None:
+                return
+            self._index.discard(self._id_key(document['_id']), row)
+            pair = self._row_pair(row)
+            if pair is not None:
+                self._pairs.discard(pair, row)
+            self._alive[row] = 0
+            self._count -= 1
+            self._overflow.pop(row, None)
+            self._irregular.discard(row)
+
+    def dump(self):
+        """Copy the columns for a snapshot; typed arrays copy as flat buffers"""
+        with self._lock:
+            return {
+                'ids': bytes(self._ids),
+                'other_ids': dict(self._other_ids),
+                'alive': bytes(self._alive),
+                'columns': {
+                    name: (column.data.tobytes(),
+                           list(column.dictionary.values) if column.kind == 'code' else None)
+                    for name, column in self.columns.items()
+                },
+                'overflow': {row: dict(values) for row, values in self._overflow.items()},
+                'irregular': set(self._irregular),
+            }
+
+    def load(self, payload):
+        with self._lock:
+            ids = payload['ids']
+            self._other_ids = dict(payload.get('other_ids', {}))
+            if isinstance(ids, list):
+                # Snapshots from before the _id column kept a list of _ids
+                self._other_ids = {row: _id for row, _id in enumerate(ids) if not isinstance(_id, ObjectId)}
+                ids = b''.join(_id.binary if isinstance(_id, ObjectId) else bytes(_ID_SIZE) for _id in ids)
+            self._ids = bytearray(ids)
+            self._alive = bytearray(payload['alive'])
+            for name, (data, values) in payload['columns'].items():
+                column = self.columns[name]
+                column.data = array(column.data.typecode)
+                column.data.frombytes(data)
+                if values is not None:
+                    column.dictionary = _Dictionary()
+                    for value in values:
+                        column.dictionary.encode(value)
+            self._overflow = dict(payload['overflow'])
+            self._irregular = set(payload['irregular'])
+            self._count = sum(self._alive)
+            self._rebuild_indexes()
+
+    def _rebuild_indexes(self):
+        if np is None:
+            rows = self._live_rows()
+            self._index.rebuild([self._id_key(self._id_at(row)) for row in rows], rows, {})
+            pairs = [(self._row_pair(row), row) for row in rows]
+            pairs = [(key, row) for key, row in pairs if key is not None]
+            self._pairs.rebuild([key for key, _ in pairs], [row for _, row in pairs], {})
+            return
+        mask = np.frombuffer(self._alive, dtype='u1').astype(bool)
+        rows = np.flatnonzero(mask)
+        keys = self._pair_keys(rows)
+        self._pairs.rebuild(keys[keys >= 0], rows[keys >= 0], {})
+        other = {}
+        for row, _id in self._other_ids.items():
+            if mask[row]:
+                other[self._id_key(_id)] = row
+            mask[row] = False
+        rows = np.flatnonzero(mask)
+        self._index.rebuild(np.frombuffer(bytes(self._ids), dtype=f'S{_ID_SIZE}')[rows], rows, other)
+
+    def candidates(self, query):
+        with self._lock:
+            ids = id_lookup(query)
+            if ids is not None:
+                rows = (self._row(_id) for _id in ids)
+                return [self._materialize(row) for row in rows if row is not None]
+            rows = self._select(query or {})
+            if rows is None:
+                rows = self._live_rows()
+            elif np is not None:
+                rows = rows.tolist()
+            return [self._materialize(row) for row in rows]
+
+    def ordered(self, query, field, direction):
+        """Rows matching the column predicates in (field, _id) order, like a sorted index walk"""
+        if np is None or field not in self.columns or self.columns[field].kind == 'code':
+            return None
+        with self._lock:
+            rows = self._select(query or {}, irregular=False)
+            # Rows with other _id types have no key bytes to break ties on
+            if rows is None or self._irregular or self._other_ids:
+                return None
+            values = np.frombuffer(self.columns[field].data, dtype=self._dtype(field))[rows]
+        return self._walk(rows, values, direction)
+
+    def _walk(self, rows, values, direction):
+        """Yield the rows in (value, _id) order, sorting one chunk at a time
+
+        Each step finds the value that ends the chunk with a linear partition
+        and sorts only the rows up to it, ties included, so reading a page off
+        the front costs a pass over the selection rather than sorting all of
+        it; a walk read to the end takes log(n) steps.
+        """
+        chunk = WALK_CHUNK
+        while len(rows):
+            step_rows, step_values = rows, values
+            if len(rows) > chunk:
+                if direction > 0:
+                    taken = values <= np.partition(values, chunk - 1)[chunk - 1]
+                else:
+                    taken = values >= np.partition(values, len(values) - chunk)[len(values) - chunk]
+                # A NaN boundary compares false with everything; take the rest in one step
+                if taken.any():
+                    step_rows, step_values = rows[taken], values[taken]
+                    rows, values = rows[~taken], values[~taken]
+            if step_rows is rows:
+                rows, values = rows[:0], values[:0]
+            with self._lock:
+                ids = np.frombuffer(self._ids, dtype=f'S{_ID_SIZE}')[step_rows]
+            # ObjectId keys are unique, so reversing the order sorts both keys descending
+            order = np.lexsort((ids, step_values))
+            if direction < 0:
+                order = order[::-1]
+            for row in step_rows[order].tolist():
+                # Skip rows removed since the walk started
+                if self._alive[row]:
+                    yield self._materialize(row)
+            chunk *= 2
+
+    # Vectorized query evaluation
+
+    @staticmethod
+    def _dtype(name):
+        return 'f8' if name == 'quantity' else 'i8'
+
+    def _predicates(self, query, exact=False):
+        """Split the query into column tests, or None if any key needs the generic path
+
+        Unless exact is set, $or/$and clauses are left out, so the tests select
+        a superset for the caller to filter.
+        """
+        tests = []
+        for name, condition in query.items():
+            if name in ('$or', '$and') and not exact:
+                continue
+            column = self.columns.get(name)
+            if column is None:
+                return None
+            if not isinstance(condition, dict):
+                if condition is None:
+                    return None
+                code = column.query_value(condition)
+                if code is None and column.kind != 'code':
+                    return None
+                tests.append((name, '$eq', code))
+                continue
+            if not condition or column.kind == 'code':
+                return None
+            for op, value in condition.items():
+                if op not in _RANGE_TESTS:
+                    return None
+                code = column.query_value(value)
+                if code is None:
+                    return None
+                tests.append((name, op, code))
+        return tests
+
+    def _select(self, query, irregular=True, exact=False):
+        """Row numbers satisfying the column predicates of the query
+
+        Returns None when the query cannot be answered from the columns alone.
+        The rows are a superset of the matches; callers still apply the filter,
+        unless exact is set, in which case they are exactly the matches.
+        """
+        tests = self._predicates(query, exact)
+        if tests is None:
+            return None
+        if np is not None:
+            if not self._alive:
+                return np.zeros(0, dtype='i8')
+            mask = np.frombuffer(self._alive, dtype='u1').astype(bool)
+            for name, op, code in tests:
+                if code is None:
+                    mask[:] = False
+                    break
+                column = np.frombuffer(self.columns[name].data, dtype=self._dtype(name))
+                if op == '$eq':
+                    mask &= column == code
+                else:
+                    mask &= _RANGE_TESTS[op](column, code)
+            if irregular and self._irregular:
+                mask[list(self._irregular)] = True
+            return np.flatnonzero(mask)
+
+        rows = []
+        for row in self._live_rows():
+            for name, op, code in tests:
+                if code is None:
+                    break
+                value = self.columns[name].data[row]
+                if op == '$eq':
+                    if value != code:
+                        break
+                elif not _RANGE_TESTS[op](value, code):
+                    break
+            else:
+                rows.append(row)
+        if irregular and self._irregular:
+            rows = sorted(set(rows) | self._irregular)
+        return rows
+
+    # Vectorized aggregation
+
+    def _weights(self, expression):
+        """Compile a $sum argument into (kind, args) evaluable over column codes"""
+        if isinstance(expression, bool):
+            return None
+        if isinstance(expression, (int, float)):
+            return ('constant', expression)
+        if expression == '$quantity':
+            return ('quantity',)
+        if isinstance(expression, dict) and list(expression) == ['$cond']:
+            args = expression['$cond']
+            if isinstance(args, dict):
+                args = [args.get('if'), args.get('then'), args.get('else')]
+            condition, then, otherwise = args
+            if not (isinstance(condition, dict) and list(condition) == ['$eq']):
+                return None
+            left, right = condition['$eq']
+            if not isinstance(left, str) or not left.startswith('$') \
+                    or self.columns.get(left[1:]) is None \
+                    or self.columns[left[1:]].kind != 'code':
+                return None
+            then_weights, else_weights = self._weights(then), self._weights(otherwise)
+            if then_weights is None or else_weights is None:
+                return None
+            return ('cond', left[1:], right, then_weights, else_weights)
+        return None
+
+    def _group_keys(self, expression):
+        if expression is None:
+            return []
+        if isinstance(expression, str) and expression.startswith('$') \
+                and expression[1:] in self.columns:
+            return [expression[1:]]
+        if isinstance(expression, dict) and expression and all(
+                isinstance(value, str) and value.startswith('$') and value[1:] in self.columns
+                for value in expression.values()):
+            return [value[1:] for value in expression.values()]
+        return None
+
+    def aggregate(self, pipeline, match, find=None):
+        """Answer [$match] + $group (+ any trailing stages) from the columns
+
+        Supports $group keys that are None, a column field or an object of
+        column fields, with $sum accumulators over constants, $quantity and
+        $cond/$eq on a dictionary-encoded column. A $facet whose branches all
+        have that shape is answered branch by branch. Returns None for anything
+        else so the caller falls back to the document pipeline. match and find
+        are the storage's filter and query functions, used by the stages after
+        the $group.
+        """
+        stages = list(pipeline)
+        match_stages = []
+        if stages and '$match' in stages[0]:
+            match_stages = [stages.pop(0)]
+        query = match_stages[0]['$match'] if match_stages else {}
+        if len(stages) == 1 and '$facet' in stages[0]:
+            facets = {}
+            for name, branch in stages[0]['$facet'].items():
+                result = self.aggregate(match_stages + list(branch), match, find)
+                if result is None:
+                    return None
+                facets[name] = result
+            return [facets]
+        if not stages or '$group' not in stages[0]:
+            return None
+        group = stages[0]['$group']
+        keys = self._group_keys(group.get('_id'))
+        if keys is None:
+            return None
+        accumulators = []
+        for name, spec in group.items():
+            if name == '_id':
+                continue
+            if not isinstance(spec, dict) or list(spec) != ['$sum']:
+                return None
+            weights = self._weights(spec['$sum'])
+            if weights is None:
+                return None
+            accumulators.append((name, weights))
+
+        with self._lock:
+            if self._irregular:
+                return None
+            rows = self._select(query, irregular=False, exact=True)
+            if rows is None:
+                return None
+            # The predicates ran over the columns; these are the rows actually read
+            scan_tally.examined += len(rows)
+            if np is not None:
+                groups = self._aggregate_numpy(rows, group.get('_id'), keys, accumulators)
+            else:
+                groups = self._aggregate_rows(rows, group.get('_id'), keys, accumulators)
+        return run_pipeline(groups, stages[1:], match, find)
+
+    def _decode_key(self, expression, keys, codes):
+        values = {}
+        for name, code in zip(keys, codes):
+            column = self.columns[name]
+            values[name] = None if column.missing(code) else column.decode(code)
+        if expression is None:
+            return None
+        if isinstance(expression, str):
+            return values[keys[0]]
+        return {label: values[value[1:]] for label, value in expression.items()}
+
+    def _aggregate_numpy(self, rows, expression, keys, accumulators):
+        if len(rows) == 0:
+            return []
+        if keys:
+            stacked = np.stack([
+                np.frombuffer(self.columns[name].data, dtype=self._dtype(name))[rows]
+                for name in keys
+            ], axis=1)
+            unique_keys, inverse = np.unique(stacked, axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+        else:
+            unique_keys, inverse = np.zeros((1, 0)), np.zeros(len(rows), dtype='i8')
+        group_count = len(unique_keys)
+
+        columns = {}
+        def column(name):
+            if name not in columns:
+                columns[name] = np.frombuffer(
+                    self.columns[name].data, dtype=self._dtype(name))[rows]
+            return columns[name]
+
+        def vector(weights):
+            kind = weights[0]
+            if kind == 'constant':
+                return np.full(len(rows), float(weights[1]))
+            if kind == 'quantity':
+                return np.nan_to_num(column('quantity'), nan=0.0)
+            _, name, value, then, otherwise = weights
+            code = self.columns[name].query_value(value)
+            hit = column(name) == code if code is not None else np.zeros(len(rows), dtype=bool)
+            return np.where(hit, vector(then), vector(otherwise))
+
+        sums = [(name, np.bincount(inverse, weights=vector(weights), minlength=group_count))
+                for name, weights in accumulators]
+        results = []
+        for index in range(group_count):
+            codes = [int(code) for code in unique_keys[index]] if keys else []
+            result = {'_id': self._decode_key(expression, keys, codes)}
+            for name, values in sums:
+                result[name] = _number(float(values[index]))
+            results.append(result)
+        return results
+
+    def _aggregate_rows(self, rows, expression, keys, accumulators):
+        data = {name: column.data for name, column in self.columns.items()}
+
+        def weight(weights, row):
+            kind = weights[0]
+            if kind == 'constant':
+                return weights[1]
+            if kind == 'quantity':
+                value = data['quantity'][row]
+                return 0 if value != value else value
+            _, name, value, then, otherwise = weights
+            hit = data[name][row] == self.columns[name].query_value(value)
+            return weight(then if hit else otherwise, row)
+
+        groups = {}
+        for row in rows:
+            key = tuple(data[name][row] for name in keys)
+            totals = groups.get(key)
+            if totals is None:
+                totals = groups[key] = [0] * len(accumulators)
+            for position, (_, weights) in enumerate(accumulators):
+                totals[position] += weight(weights, row)
+
+        results = []
+        for key, totals in groups.items():
+            result = {'_id': self._decode_key(expression, keys, key)}
+            for (name, _), total in zip(accumulators, totals):
+                result[name] = _number(total)
+            results.append(result)
+        return results
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
@@ -1,155 +1,1251 @@
-from pymongo import MongoClient
+from pymongo import DeleteOne, InsertOne, MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import AutoReconnect, BulkWriteError, DuplicateKeyError, InvalidOperation
+from pymongo.monitoring import ConnectionPoolListener
+from bson import ObjectId
 import os
+from contextlib import contextmanager
 from datetime import datetime
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+import heapq
+import re
+import threading
+import time
+from src.database.aggregation import SortKey, id_lookup, run_pipeline
+from src.database.cache import report_cache
+from src.database.columnar import ColumnarCollection
+from src.database.indexes import apply_indexes
+from src.database.metrics import CommandCounter, record_db_call
+from src.database.query_stats import InstrumentedCollection, query_monitor, scan_tally
+from src.database.persistence import Journal
 
 # MongoDB connection configuration
 MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
 DATABASE_NAME = os.getenv('DATABASE_NAME', 'milk_delivery_db')
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+# 0 leaves the driver default (no limit) for the idle, wait queue and socket timeouts
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv('MONGO_MAX_IDLE_TIME_MS', '0'))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '0'))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '0'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+# How long connect() waits for MongoDB before serving from the in-memory fallback
+MONGO_STARTUP_WAIT_MS = int(os.getenv('MONGO_STARTUP_WAIT_MS', '1000'))
+# Seconds between background attempts to reach MongoDB once on the fallback; 0 stops retrying
+MONGO_RETRY_INTERVAL = float(os.getenv('MONGO_RETRY_INTERVAL', '15'))
+# 'columnar' keeps in-memory deliveries in typed arrays instead of dicts
+INMEMORY_STORAGE_MODE = os.getenv('INMEMORY_STORAGE_MODE', 'documents')
+# When set, the in-memory fallback is journaled to this directory and survives restarts
+INMEMORY_DATA_DIR = os.getenv('INMEMORY_DATA_DIR')
+INMEMORY_COMMIT_INTERVAL_MS = float(os.getenv('INMEMORY_COMMIT_INTERVAL_MS', '5'))
+INMEMORY_SNAPSHOT_INTERVAL = float(os.getenv('INMEMORY_SNAPSHOT_INTERVAL', '300'))
+# Create the indexes registered in indexes.py on every MongoDB connect
+MONGO_ENSURE_INDEXES = os.getenv('MONGO_ENSURE_INDEXES', 'true').lower() in ('1', 'true', 'yes')
+
+# Secondary indexes kept by the in-memory backend, per collection.
+# Hash entries are ('hash', fields, unique), ordered entries are ('sorted', field);
+# '_id' is always indexed by the collection itself.
+MEMORY_INDEXES = {
+    'users': [('hash', ('username',), True)],
+    'customers': [
+        ('hash', ('mobile',), True),
+        ('sorted', 'name'),
+    ],
+    'deliveries': [
+        ('hash', ('customer_id',), False),
+        ('hash', ('customer_id', 'delivery_date'), True),
+        ('hash', ('delivery_date', 'delivery_boy_id'), False),
+        ('sorted', 'delivery_date'),
+    ],
+    'daily_rollups': [
+        ('hash', ('date', 'delivery_boy_id'), True),
+        ('hash', ('delivery_boy_id',), False),
+        ('sorted', 'date'),
+    ],
+    'subscriptions': [('hash', ('customer_id',), False)],
+    'sync_keys': [
+        ('hash', ('user_id', 'key'), True),
+        ('hash', ('user_id',), False),
+    ],
+}
+
+RANGE_OPERATORS = ('$gt', '$gte', '$lt', '$lte')
+
+def project(document, projection):
+    """Copy of document restricted by a pymongo-style projection
+    
+    projection is a list of field names or a dict of field: 1 (include) or
+    field: 0 (exclude); _id is kept unless excluded explicitly. Returns the
+    document itself when projection is None.
+    """
+    if projection is None or document is None:
+        return document
+    if not isinstance(projection, dict):
+        projection = dict.fromkeys(projection, 1)
+    include_id = projection.get('_id', 1)
+    fields = {field: flag for field, flag in projection.items() if field != '_id'}
+    # {'_id': 1} alone is an inclusion projection too
+    if any(fields.values()) if fields else projection.get('_id', 0):
+        projected = {field: document[field] for field in fields if field in document}
+    else:
+        projected = {field: value for field, value in document.items() if field not in fields}
+        projected.pop('_id', None)
+    if include_id and '_id' in document:
+        projected['_id'] = document['_id']
+    return projected
+
+class HashIndex:
+    """Dict-based index from a tuple of field values to document ids"""
+    def __init__(self, fields, unique=False):
+        self.fields = tuple(fields)
+        self.unique = unique
+        self._entries = {}
+    
+    def key_for(self, document):
+        try:
+            return tuple([document[field] for field in self.fields])
+        except KeyError:
+            return None
+    
+    def lookup_key(self, query):
+        """Return the index key if the query pins every indexed field by equality"""
+        values = []
+        for field in self.fields:
+            if field not in query or isinstance(query[field], dict):
+                return None
+            values.append(query[field])
+        key = tuple(values)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+    
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return []
+        if self.unique:
+            return [entry]
+        return list(entry)
+    
+    def count(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return 0
+        return 1 if self.unique else len(entry)
+    
+    def plan(self, query):
+        """Return (estimated matches, lookup key) or None if the index does not apply"""
+        key = self.lookup_key(query)
+        if key is None:
+            return None
+        return self.count(key), key
+    
+    def check(self, document):
+        if not self.unique:
+            return
+        key = self.key_for(document)
+        try:
+            existing = self._entries.get(key) if key is not None else None
+        except TypeError:
+            return
+        if existing is not None and existing != document['_id']:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error: {dict(zip(self.fields, key))}"
+            )
+    
+    def add(self, document):
+        key = self.key_for(document)
+        if key is None:
+            return
+        try:
+            if self.unique:
+                self._entries[key] = document['_id']
+            else:
+                # dict used as an insertion-ordered set
+                self._entries.setdefault(key, {})[document['_id']] = None
+        except TypeError:
+            pass  # unhashable values are not indexable
+    
+    def rebuild(self, documents):
+        self._entries = {}
+        for document in documents:
+            self.add(document)
+    
+    def remove(self, document):
+        key = self.key_for(document)
+        try:
+            entry = self._entries.get(key) if key is not None else None
+        except TypeError:
+            return
+        if self.unique:
+            if entry == document['_id']:
+                del self._entries[key]
+        else:
+            if entry is not None:
+                entry.pop(document['_id'], None)
+                if not entry:
+                    del self._entries[key]
+
+class _Bound:
+    """Sentinel that sorts below (or above) every _id sharing a key value"""
+    def __init__(self, high):
+        self.high = high
+    
+    def __lt__(self, other):
+        return not self.high
+    
+    def __gt__(self, other):
+        return self.high
+
+_LOW = _Bound(False)
+_HIGH = _Bound(True)
+
+class SortedIndex:
+    """Ordered index over one field, kept as a sorted array of (value, _id) keys
+    
+    Equality and $gt/$gte/$lt/$lte predicates are answered with two bisections,
+    so a range costs O(log n + k) regardless of how much history is stored.
+    """
+    unique = False
+    
+    def __init__(self, field):
+        self.field = field
+        self.fields = (field,)
+        self._keys = []
+    
+    def __len__(self):
+        return len(self._keys)
+    
+    def bounds(self, query):
+        """Translate the query's predicate on the field into a slice of the key array"""
+        if self.field not in query:
+            return None
+        condition = query[self.field]
+        lo, hi = 0, len(self._keys)
+        if not isinstance(condition, dict):
+            try:
+                return (bisect_left(self._keys, (condition, _LOW)),
+                        bisect_right(self._keys, (condition, _HIGH)))
+            except TypeError:
+                return None
+        if not condition or any(op not in RANGE_OPERATORS for op in condition):
+            return None
+        try:
+            for op, value in condition.items():
+                if op == '$gte':
+                    lo = max(lo, bisect_left(self._keys, (value, _LOW)))
+                elif op == '$gt':
+                    lo = max(lo, bisect_right(self._keys, (value, _HIGH)))
+                elif op == '$lte':
+                    hi = min(hi, bisect_right(self._keys, (value, _HIGH)))
+                elif op == '$lt':
+                    hi = min(hi, bisect_left(self._keys, (value, _LOW)))
+        except TypeError:
+            return None
+        return lo, max(lo, hi)
+    
+    def plan(self, query):
+        bounds = self.bounds(query)
+        if bounds is None:
+            return None
+        return bounds[1] - bounds[0], bounds
+    
+    def get(self, bounds, reverse=False):
+        lo, hi = bounds
+        keys = self._keys[lo:hi]
+        if reverse:
+            keys.reverse()
+        return [_id for _, _id in keys]
+    
+    def values(self, bounds, reverse=False):
+        """Distinct values within bounds in order, one bisection per value"""
+        lo, hi = bounds
+        keys = self._keys
+        while lo < hi:
+            if reverse:
+                value = keys[hi - 1][0]
+                yield value
+                hi = bisect_left(keys, (value, _LOW), lo, hi)
+            else:
+                value = keys[lo][0]
+                yield value
+                lo = bisect_right(keys, (value, _HIGH), lo, hi)
+    
+    def check(self, document):
+        pass
+    
+    def add(self, document):
+        if self.field in document:
+            insort(self._keys, (document[self.field], document['_id']))
+    
+    def rebuild(self, documents):
+        # One sort instead of n insertions when loading a whole collection
+        keys = [(document[self.field], document['_id'])
+                for document in documents if self.field in document]
+        try:
+            # ObjectIds order by their bytes; comparing those skips the Python __lt__
+            keys.sort(key=lambda key: (key[0], key[1].binary))
+        except (AttributeError, TypeError):
+            keys.sort()
+        self._keys = keys
+    
+    def remove(self, document):
+        if self.field not in document:
+            return
+        key = (document[self.field], document['_id'])
+        position = bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            del self._keys[position]
+
+def build_index(spec):
+    kind = spec[0]
+    if kind == 'hash':
+        return HashIndex(spec[1], unique=spec[2])
+    if kind == 'sorted':
+        return SortedIndex(spec[1])
+    raise ValueError(f"Unknown index kind: {kind}")
+
+class MemoryCollection:
+    """Documents of one in-memory collection plus the indexes over them"""
+    # Sorted indexes key on (value, _id), so ordered() walks ties in _id order
+    orders_ties_by_id = True
+    # Documents copied per acquisition of the write lock while dumping
+    DUMP_CHUNK = 4096
+    
+    def __init__(self, index_specs=()):
+        self.documents = {}  # _id -> document, in insertion order
+        self.indexes = [build_index(spec) for spec in index_specs]
+        self._frozen = None  # _id -> pre-image while a dump is in progress
+    
+    def candidates(self, query):
+        """Pick the cheapest access path for a query; callers still apply the filter"""
+        if not query:
+            return list(self.documents.values())
+        
+        ids = id_lookup(query)
+        if ids is not None:
+            documents = self.documents
+            return [documents[_id] for _id in ids if _id in documents]
+        
+        plan = self._best_plan(query)
+        if plan is not None:
+            index, key = plan
+            return [self.documents[_id] for _id in index.get(key)]
+        return list(self.documents.values())
+    
+    def _best_plan(self, query):
+        # Every applicable index reports its match count cheaply (a dict lookup
+        # or two bisections), so the most selective one can be chosen up front
+        best_index, best_key, best_count = None, None, None
+        for index in self.indexes:
+            plan = index.plan(query)
+            if plan is None:
+                continue
+            count, key = plan
+            if best_count is None or count < best_count:
+                best_index, best_key, best_count = index, key, count
+        if best_index is None:
+            return None
+        return best_index, best_key
+    
+    def ordered(self, query, field, direction):
+        """Walk a sorted index on field, or return None if that is not the best plan"""
+        index = next((index for index in self.indexes
+                      if isinstance(index, SortedIndex) and index.field == field), None)
+        if index is None:
+            return None
+        # Documents missing the field are not in the index, so an unfiltered walk
+        # is only complete when every document has it
+        if field not in (query or {}) and len(index) != len(self.documents):
+            return None
+        if id_lookup(query) is not None:
+            return None
+        
+        walk = self._compound_walk(query or {}, index, direction)
+        if walk is not None:
+            return walk
+        plan = self._best_plan(query or {})
+        if plan is None:
+            bounds = (0, len(index))
+        elif plan[0] is index:
+            bounds = plan[1]
+        else:
+            return None
+        ids = index.get(bounds, reverse=direction < 0)
+        documents = self.documents
+        return (documents[_id] for _id in ids if _id in documents)
+    
+    def _compound_walk(self, query, index, direction):
+        """Walk index's distinct values, looking each up in a hash index that adds query fields
+        
+        Serves an equality query ordered by another field, as a compound index
+        on both would: a customer's or a delivery boy's deliveries by date
+        stream out one date at a time, without sorting every match up front
+        or walking everyone else's. Ties come out in _id order. Returns None
+        without such a hash index.
+        """
+        field = index.field
+        compound = next((candidate for candidate in self.indexes
+                         if isinstance(candidate, HashIndex) and len(candidate.fields) > 1
+                         and field in candidate.fields
+                         and all(name == field or (name in query and not isinstance(query[name], dict))
+                                 for name in candidate.fields)), None)
+        if compound is None:
+            return None
+        pinned = [None if name == field else query[name] for name in compound.fields]
+        try:
+            hash(tuple(pinned))
+        except TypeError:
+            return None
+        bounds = index.bounds(query) or (0, len(index))
+        return self._walk_compound(index, compound, pinned, bounds, direction)
+    
+    def _walk_compound(self, index, compound, pinned, bounds, direction):
+        position = compound.fields.index(index.field)
+        documents = self.documents
+        for value in index.values(bounds, reverse=direction < 0):
+            pinned[position] = value
+            try:
+                ids = compound.get(tuple(pinned))
+            except TypeError:
+                continue  # unhashable values are not in the hash index
+            if len(ids) > 1:
+                ids.sort(reverse=direction < 0)
+            for _id in ids:
+                if _id in documents:
+                    yield documents[_id]
+    
+    def insert(self, document):
+        if document['_id'] in self.documents:
+            raise DuplicateKeyError(f"E11000 duplicate key error: _id {document['_id']}")
+        for index in self.indexes:
+            index.check(document)
+        self._add_to_indexes(self.indexes, document)
+        self._preserve(document['_id'], None)
+        self.documents[document['_id']] = document
+    
+    def update(self, document, changes):
+        touched = [index for index in self.indexes
+                   if any(field in changes for field in index.fields)]
+        if touched:
+            updated = dict(document, **changes)
+            for index in touched:
+                index.check(updated)
+            for index in touched:
+                index.remove(document)
+        self._preserve(document['_id'], document)
+        previous = {field: document[field] for field in changes if field in document}
+        document.update(changes)
+        try:
+            self._add_to_indexes(touched, document)
+        except TypeError:
+            for field in changes:
+                if field in previous:
+                    document[field] = previous[field]
+                else:
+                    del document[field]
+            for index in touched:
+                index.add(document)
+            raise
+    
+    @staticmethod
+    def _add_to_indexes(indexes, document):
+        """Add document to every one of indexes or, if one of them fails, to none"""
+        added = []
+        try:
+            for index in indexes:
+                index.add(document)
+                added.append(index)
+        except TypeError:
+            # A sorted index cannot place a value that does not compare with its keys
+            for index in added:
+                index.remove(document)
+            raise
+    
+    def remove(self, document):
+        for index in self.indexes:
+            index.remove(document)
+        self._preserve(document['_id'], document)
+        del self.documents[document['_id']]
+    
+    def _preserve(self, _id, document):
+        # Copy-on-write: keep the first pre-image of a document a dump still needs
+        if self._frozen is not None and _id not in self._frozen:
+            self._frozen[_id] = dict(document) if document is not None else None
+    
+    def __iter__(self):
+        return iter(list(self.documents.values()))
+    
+    def start_dump(self, lock):
+        """Begin copying the documents as they are now; call with lock held
+        
+        Returns a function that finishes the copy, taking lock for one chunk
+        of documents at a time so writers are not stalled behind all of it.
+        Until then writes save the pre-image of each document they touch first.
+        """
+        ids = list(self.documents)
+        self._frozen = frozen = {}
+        
+        def finish():
+            copies = []
+            try:
+                for start in range(0, len(ids), self.DUMP_CHUNK):
+                    with lock:
+                        documents = self.documents
+                        for _id in ids[start:start + self.DUMP_CHUNK]:
+                            if _id in frozen:
+                                copies.append(frozen[_id])
+                            else:
+                                copies.append(dict(documents[_id]))
+            finally:
+                with lock:
+                    self._frozen = None
+            return copies
+        return finish
+    
+    def load(self, documents):
+        self.documents = {document['_id']: document for document in documents}
+        for index in self.indexes:
+            index.rebuild(self.documents.values())
 
 class InMemoryStorage:
-    """Simple in-memory storage for development when MongoDB is not available"""
-    def __init__(self):
-        self.users = []
-        self.customers = []
-        self.deliveries = []
+    """Simple in-memory storage for development when MongoDB is not available
+    
+    With columnar=True the deliveries collection is kept as typed columns
+    (see src.database.columnar), trading per-document access speed for a much
+    smaller footprint and vectorized report aggregation.
+    """
+    def __init__(self, columnar=False):
+        self.collections = {}
+        # Serializes writes so a journal, when attached, records them in apply order
+        self._lock = threading.RLock()
+        self.journal = None
+        # Set once the documents have been handed over to MongoDB
+        self.retired = False
+        if columnar:
+            self.collections['deliveries'] = ColumnarCollection()
+        for name in ('users', 'customers', 'deliveries', 'daily_rollups', 'subscriptions', 'sync_keys'):
+            self._collection(name)
+    
+    def _collection(self, name):
+        collection = self.collections.get(name)
+        if collection is None:
+            collection = MemoryCollection(MEMORY_INDEXES.get(name, ()))
+            self.collections[name] = collection
+        return collection
     
-    def find_one(self, collection, query):
-        data = getattr(self, collection, [])
-        for item in data:
+    def _scan(self, collection, query):
+        query = query or {}
+        candidates = self._collection(collection).candidates(query)
+        query = self.prepare_query(query)
+        for item in candidates:
+            scan_tally.examined += 1
             if self._match_query(item, query):
-                return item
-        return None
+                yield item
+    
+    @staticmethod
+    def prepare_query(query):
+        """Copy of query with $in/$nin lists turned into sets for O(1) membership"""
+        prepared = None
+        for key, value in query.items():
+            if isinstance(value, dict) and ('$in' in value or '$nin' in value):
+                condition = dict(value)
+                for op in ('$in', '$nin'):
+                    if op in condition:
+                        try:
+                            condition[op] = frozenset(condition[op])
+                        except TypeError:
+                            pass
+                if prepared is None:
+                    prepared = dict(query)
+                prepared[key] = condition
+        return query if prepared is None else prepared
     
-    def find(self, collection, query=None):
-        data = getattr(self, collection, [])
-        if query is None:
-            return data
-        return [item for item in data if self._match_query(item, query)]
+    def find_one(self, collection, query, projection=None):
+        return project(next(self._scan(collection, query), None), projection)
+    
+    def find(self, collection, query=None, projection=None):
+        if projection is None:
+            return list(self._scan(collection, query))
+        return [project(item, projection) for item in self._scan(collection, query)]
+    
+    def _journal(self, op, collection, payload):
+        # Only post-images are journaled, so replaying a record is idempotent
+        if self.journal is not None:
+            self.journal.append(op, collection, payload)
+    
+    @contextmanager
+    def _writing(self):
+        # A write that waited out a promotion must not land in storage nobody reads
+        with self._lock:
+            if self.retired:
+                raise AutoReconnect("in-memory storage was handed over to MongoDB; retry the write")
+            yield
     
     def insert_one(self, collection, document):
-        data = getattr(self, collection, [])
-        data.append(document)
+        document.setdefault('_id', ObjectId())
+        with self._writing():
+            self._collection(collection).insert(document)
+            self._journal('insert', collection, dict(document))
         return type('Result', (), {'inserted_id': document.get('_id')})()
     
-    def update_one(self, collection, query, update):
-        data = getattr(self, collection, [])
-        for i, item in enumerate(data):
-            if self._match_query(item, query):
-                if '$set' in update:
-                    item.update(update['$set'])
-                return type('Result', (), {'modified_count': 1})()
-        return type('Result', (), {'modified_count': 0})()
+    def insert_many(self, collection, documents, ordered=True):
+        """Insert documents, reporting duplicates like pymongo's BulkWriteError
+        
+        Unordered inserts keep going past a failed document; ordered ones stop.
+        """
+        inserted_ids = []
+        write_errors = []
+        with self._writing():
+            target = self._collection(collection)
+            for index, document in enumerate(documents):
+                document.setdefault('_id', ObjectId())
+                try:
+                    target.insert(document)
+                except DuplicateKeyError as e:
+                    write_errors.append({'index': index, 'code': 11000, 'errmsg': str(e), 'op': document})
+                    if ordered:
+                        break
+                    continue
+                self._journal('insert', collection, dict(document))
+                inserted_ids.append(document['_id'])
+        if write_errors:
+            raise BulkWriteError({
+                'writeErrors': write_errors,
+                'writeConcernErrors': [],
+                'nInserted': len(inserted_ids),
+                'nUpserted': 0,
+                'nMatched': 0,
+                'nModified': 0,
+                'nRemoved': 0,
+                'upserted': []
+            })
+        return type('Result', (), {'inserted_ids': inserted_ids})()
+    
+    def bulk_write(self, collection, requests, ordered=True):
+        """Apply pymongo InsertOne/UpdateOne/DeleteOne requests under one lock"""
+        counts = {'inserted_count': 0, 'matched_count': 0, 'modified_count': 0,
+                  'deleted_count': 0, 'upserted_count': 0}
+        upserted_ids = {}
+        write_errors = []
+        with self._writing():
+            target = self._collection(collection)
+            for index, operation in enumerate(requests):
+                try:
+                    if isinstance(operation, InsertOne):
+                        document = operation._doc
+                        document.setdefault('_id', ObjectId())
+                        target.insert(document)
+                        self._journal('insert', collection, dict(document))
+                        counts['inserted_count'] += 1
+                    elif isinstance(operation, UpdateOne):
+                        before, _, upserted_id = self._update(
+                            collection, operation._filter, operation._doc, operation._upsert)
+                        if before is not None:
+                            counts['matched_count'] += 1
+                            counts['modified_count'] += 1
+                        if upserted_id is not None:
+                            counts['upserted_count'] += 1
+                            upserted_ids[index] = upserted_id
+                    elif isinstance(operation, DeleteOne):
+                        item = self.find_one(collection, operation._filter)
+                        if item is not None:
+                            target.remove(item)
+                            self._journal('delete', collection, item['_id'])
+                            counts['deleted_count'] += 1
+                    else:
+                        raise TypeError(f"Unsupported bulk write request: {operation!r}")
+                except DuplicateKeyError as e:
+                    write_errors.append({'index': index, 'code': 11000, 'errmsg': str(e), 'op': operation})
+                    if ordered:
+                        break
+        if write_errors:
+            raise BulkWriteError({
+                'writeErrors': write_errors,
+                'writeConcernErrors': [],
+                'nInserted': counts['inserted_count'],
+                'nUpserted': counts['upserted_count'],
+                'nMatched': counts['matched_count'],
+                'nModified': counts['modified_count'],
+                'nRemoved': counts['deleted_count'],
+                'upserted': [{'index': index, '_id': _id} for index, _id in upserted_ids.items()]
+            })
+        return type('Result', (), dict(counts, upserted_ids=upserted_ids, acknowledged=True))()
+    
+    def _update(self, collection, query, update, upsert):
+        """Apply $set/$inc to the first match, or insert one when upserting
+        
+        Returns (before, after, upserted_id); call with the write lock held.
+        """
+        target = self._collection(collection)
+        item = self.find_one(collection, query)
+        if item is None:
+            if not upsert:
+                return None, None, None
+            document = {key: value for key, value in query.items()
+                        if not key.startswith('$') and not isinstance(value, dict)}
+            document.update(update.get('$set', {}))
+            for field, amount in update.get('$inc', {}).items():
+                document[field] = document.get(field, 0) + amount
+            document.setdefault('_id', ObjectId())
+            target.insert(document)
+            self._journal('insert', collection, dict(document))
+            return None, document, document['_id']
+        
+        before = dict(item)
+        changes = dict(update.get('$set', {}))
+        for field, amount in update.get('$inc', {}).items():
+            changes[field] = item.get(field, 0) + amount
+        if changes:
+            target.update(item, changes)
+            self._journal('set', collection, (item['_id'], changes))
+        return before, item, None
+    
+    def update_one(self, collection, query, update, upsert=False):
+        with self._writing():
+            before, _, upserted_id = self._update(collection, query, update, upsert)
+        return type('Result', (), {
+            'matched_count': 1 if before is not None else 0,
+            'modified_count': 1 if before is not None else 0,
+            'upserted_id': upserted_id
+        })()
+    
+    def find_one_and_update(self, collection, query, update, upsert=False, return_document=False):
+        """return_document follows pymongo's ReturnDocument: False is BEFORE, True is AFTER"""
+        with self._writing():
+            before, after, _ = self._update(collection, query, update, upsert)
+            result = after if return_document else before
+            return dict(result) if result is not None else None
     
     def delete_one(self, collection, query):
-        data = getattr(self, collection, [])
-        for i, item in enumerate(data):
-            if self._match_query(item, query):
-                data.pop(i)
+        with self._writing():
+            item = self.find_one(collection, query)
+            if item is not None:
+                self._collection(collection).remove(item)
+                self._journal('delete', collection, item['_id'])
                 return type('Result', (), {'deleted_count': 1})()
         return type('Result', (), {'deleted_count': 0})()
     
+    def apply(self, op, collection, payload):
+        """Re-apply a journaled operation during recovery"""
+        target = self._collection(collection)
+        if op == 'insert':
+            existing = target.candidates({'_id': payload['_id']})
+            if existing:
+                target.update(existing[0], payload)
+            else:
+                target.insert(payload)
+            return
+        _id = payload[0] if op == 'set' else payload
+        existing = target.candidates({'_id': _id})
+        if not existing:
+            return
+        if op == 'set':
+            target.update(existing[0], payload[1])
+        elif op == 'delete':
+            target.remove(existing[0])
+    
+    def start_dump(self):
+        """Begin a consistent copy of every collection; call with the write lock held
+        
+        Columnar collections copy their flat buffers right away. Document
+        collections copy on write, so the returned function can finish them
+        after the lock is released.
+        """
+        finishers = {}
+        for name, collection in self.collections.items():
+            if isinstance(collection, ColumnarCollection):
+                payload = collection.dump()
+                finishers[name] = lambda payload=payload: payload
+            else:
+                finishers[name] = collection.start_dump(self._lock)
+        return lambda: {name: finish() for name, finish in finishers.items()}
+    
+    def dump(self):
+        """Consistent copy of every collection as of the call"""
+        with self._lock:
+            finish = self.start_dump()
+        return finish()
+    
+    def load(self, collections):
+        for name, payload in collections.items():
+            target = self._collection(name)
+            columnar_payload = isinstance(payload, dict)
+            if columnar_payload == isinstance(target, ColumnarCollection):
+                target.load(payload)
+                continue
+            # The storage mode changed since the snapshot; convert through documents
+            source = ColumnarCollection() if columnar_payload else MemoryCollection()
+            source.load(payload)
+            if isinstance(target, ColumnarCollection):
+                for document in source:
+                    target.insert(document)
+            else:
+                target.load(list(source))
+    
     def aggregate(self, collection, pipeline):
-        # Simple aggregation for basic statistics
-        data = getattr(self, collection, [])
-        
-        # Apply match stage if present
-        for stage in pipeline:
-            if '$match' in stage:
-                match_query = stage['$match']
-                data = [item for item in data if self._match_query(item, match_query)]
-            elif '$group' in stage:
-                group_stage = stage['$group']
-                if group_stage.get('_id') is None:
-                    # Simple aggregation for all documents
-                    result = {
-                        'total_deliveries': len(data),
-                        'delivered_count': len([d for d in data if d.get('status') == 'Delivered']),
-                        'pending_count': len([d for d in data if d.get('status') == 'Pending']),
-                        'issue_count': len([d for d in data if d.get('status') == 'Issue']),
-                        'total_quantity': sum(d.get('quantity', 0) for d in data)
-                    }
-                    return [result]
-        return []
+        fast_path = getattr(self._collection(collection), 'aggregate', None)
+        if fast_path is not None:
+            result = fast_path(pipeline, self._match_query, self.find)
+            if result is not None:
+                return result
+        
+        # A leading $match can use the collection indexes; the rest of the
+        # pipeline streams through the aggregation engine
+        if pipeline and '$match' in pipeline[0]:
+            source = self._scan(collection, pipeline[0]['$match'])
+            pipeline = pipeline[1:]
+        else:
+            source = self._scan(collection, None)
+        return run_pipeline(source, pipeline, self._match_query, self.find)
     
     def _match_query(self, item, query):
         for key, value in query.items():
-            if key not in item:
-                return False
+            if key == '$or':
+                if not any(self._match_query(item, clause) for clause in value):
+                    return False
+                continue
+            if key == '$and':
+                if not all(self._match_query(item, clause) for clause in value):
+                    return False
+                continue
             if isinstance(value, dict):
                 # Handle operators like $gte, $lte
+                if key not in item:
+                    # Only negations match documents that lack the field
+                    if any(op not in ('$ne', '$nin') for op in value):
+                        return False
+                    continue
                 item_value = item[key]
                 for op, op_value in value.items():
                     if op == '$gte' and item_value < op_value:
                         return False
+                    elif op == '$gt' and item_value <= op_value:
+                        return False
                     elif op == '$lte' and item_value > op_value:
                         return False
+                    elif op == '$lt' and item_value >= op_value:
+                        return False
+                    elif op == '$in' and item_value not in op_value:
+                        return False
+                    elif op == '$nin' and item_value in op_value:
+                        return False
+                    elif op == '$ne' and item_value == op_value:
+                        return False
+                    elif op == '$regex':
+                        flags = re.IGNORECASE if 'i' in value.get('$options', '') else 0
+                        if not isinstance(item_value, str) or not re.search(op_value, item_value, flags):
+                            return False
             else:
-                if item[key] != value:
+                if key not in item or item[key] != value:
                     return False
         return True
 
+class MockCursor:
+    """Lazily evaluated result of MockCollection.find, mirroring pymongo's Cursor
+    
+    Nothing is read until iteration starts. A sort whose field has a sorted
+    index is answered by walking the index; otherwise sort plus limit keeps
+    only the top skip + limit documents in a heap instead of sorting them all.
+    """
+    def __init__(self, storage, collection, query=None, projection=None):
+        self._storage = storage
+        self._collection = collection
+        self._query = query or {}
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+        self._iterator = None
+    
+    def _check_unstarted(self):
+        if self._iterator is not None:
+            raise InvalidOperation('cannot set options after executing query')
+    
+    def sort(self, key_or_list, direction=1):
+        self._check_unstarted()
+        if isinstance(key_or_list, (list, tuple)):
+            self._sort = [(field, order) for field, order in key_or_list]
+        else:
+            self._sort = [(key_or_list, direction)]
+        return self
+    
+    def skip(self, skip):
+        self._check_unstarted()
+        self._skip = skip
+        return self
+    
+    def limit(self, limit):
+        self._check_unstarted()
+        self._limit = limit
+        return self
+    
+    def batch_size(self, batch_size):
+        # Documents are already in memory, so there are no round trips to size
+        self._check_unstarted()
+        return self
+    
+    def count(self, with_limit_and_skip=False):
+        total = sum(1 for _ in self._storage._scan(self._collection, self._query))
+        if with_limit_and_skip:
+            total = max(0, total - self._skip)
+            if self._limit:
+                total = min(total, self._limit)
+        return total
+    
+    def _evaluate(self):
+        stop = self._skip + self._limit if self._limit else None
+        if not self._sort:
+            matches = self._storage._scan(self._collection, self._query)
+            return islice(matches, self._skip, stop)
+        
+        # A collection whose walk breaks ties on _id also serves a keyset order
+        # on (field, _id) in the same direction
+        field, direction = self._sort[0]
+        collection = self._storage._collection(self._collection)
+        if len(self._sort) == 1 or (self._sort[1:] == [('_id', direction)]
+                                    and getattr(collection, 'orders_ties_by_id', False)):
+            walk = collection.ordered(self._query, field, direction)
+            if walk is not None:
+                query = self._storage.prepare_query(self._query)
+                matches = (item for item in self._tally(walk) if self._storage._match_query(item, query))
+                return islice(matches, self._skip, stop)
+        
+        matches = self._storage._scan(self._collection, self._query)
+        key = lambda item: SortKey(item, self._sort)
+        if stop is not None:
+            ordered = heapq.nsmallest(stop, matches, key=key)
+        else:
+            ordered = sorted(matches, key=key)
+        return iter(ordered[self._skip:stop])
+    
+    @staticmethod
+    def _tally(walk):
+        for item in walk:
+            scan_tally.examined += 1
+            yield item
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        if self._iterator is None:
+            self._iterator = self._evaluate()
+        return project(next(self._iterator), self._projection)
+
 class MockCollection:
-    """Mock collection that uses in-memory storage"""
+    """Mock collection that uses in-memory storage
+    
+    Every call is counted in src.database.metrics under the name of the
+    MongoDB command it stands for.
+    """
     def __init__(self, storage, name):
         self.storage = storage
         self.name = name
     
-    def find_one(self, query):
-        return self.storage.find_one(self.name, query)
+    def find_one(self, query=None, projection=None):
+        record_db_call(self.name, 'find')
+        return self.storage.find_one(self.name, query, projection)
     
-    def find(self, query=None):
-        return self.storage.find(self.name, query)
+    def find(self, query=None, projection=None):
+        record_db_call(self.name, 'find')
+        return MockCursor(self.storage, self.name, query, projection)
     
     def insert_one(self, document):
+        record_db_call(self.name, 'insert')
         return self.storage.insert_one(self.name, document)
     
-    def update_one(self, query, update):
-        return self.storage.update_one(self.name, query, update)
+    def insert_many(self, documents, ordered=True):
+        record_db_call(self.name, 'insert')
+        return self.storage.insert_many(self.name, documents, ordered)
+    
+    def bulk_write(self, requests, ordered=True):
+        record_db_call(self.name, 'bulkWrite')
+        return self.storage.bulk_write(self.name, requests, ordered)
+    
+    def update_one(self, query, update, upsert=False):
+        record_db_call(self.name, 'update')
+        return self.storage.update_one(self.name, query, update, upsert)
+    
+    def find_one_and_update(self, query, update, upsert=False, return_document=ReturnDocument.BEFORE):
+        record_db_call(self.name, 'findAndModify')
+        return self.storage.find_one_and_update(self.name, query, update, upsert, return_document)
     
     def delete_one(self, query):
+        record_db_call(self.name, 'delete')
         return self.storage.delete_one(self.name, query)
     
     def aggregate(self, pipeline):
+        record_db_call(self.name, 'aggregate')
         return self.storage.aggregate(self.name, pipeline)
-    
-    def sort(self, field, direction):
-        # Return self for chaining, sorting will be handled in find
-        return self
 
 class MockDatabase:
-    """Mock database that uses in-memory storage"""
+    """Mock database that uses in-memory storage
+    
+    Each collection is wrapped so its queries feed src.database.query_stats,
+    as command monitoring does for MongoDB.
+    """
     def __init__(self, storage):
         self.storage = storage
-        self.users = MockCollection(storage, 'users')
-        self.customers = MockCollection(storage, 'customers')
-        self.deliveries = MockCollection(storage, 'deliveries')
+        self.users = InstrumentedCollection(MockCollection(storage, 'users'))
+        self.customers = InstrumentedCollection(MockCollection(storage, 'customers'))
+        self.deliveries = InstrumentedCollection(MockCollection(storage, 'deliveries'))
+        self.daily_rollups = InstrumentedCollection(MockCollection(storage, 'daily_rollups'))
+        self.subscriptions = InstrumentedCollection(MockCollection(storage, 'subscriptions'))
+        self.sync_keys = InstrumentedCollection(MockCollection(storage, 'sync_keys'))
+    
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+def mongo_client_options():
+    """MongoClient keyword arguments built from the MONGO_* settings"""
+    options = {
+        'maxPoolSize': MONGO_MAX_POOL_SIZE,
+        'minPoolSize': MONGO_MIN_POOL_SIZE,
+        'connectTimeoutMS': MONGO_CONNECT_TIMEOUT_MS,
+        'serverSelectionTimeoutMS': MONGO_SERVER_SELECTION_TIMEOUT_MS
+    }
+    if MONGO_MAX_IDLE_TIME_MS:
+        options['maxIdleTimeMS'] = MONGO_MAX_IDLE_TIME_MS
+    if MONGO_WAIT_QUEUE_TIMEOUT_MS:
+        options['waitQueueTimeoutMS'] = MONGO_WAIT_QUEUE_TIMEOUT_MS
+    if MONGO_SOCKET_TIMEOUT_MS:
+        options['socketTimeoutMS'] = MONGO_SOCKET_TIMEOUT_MS
+    return options
+
+class PoolStats(ConnectionPoolListener):
+    """Connection counts fed by the driver's pool events, summed over servers"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.checkout_failures = 0
+    
+    def _add(self, counter, amount):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+    
+    def connection_created(self, event):
+        self._add('open', 1)
+    
+    def connection_closed(self, event):
+        self._add('open', -1)
+    
+    def connection_checked_out(self, event):
+        self._add('checked_out', 1)
+    
+    def connection_checked_in(self, event):
+        self._add('checked_out', -1)
+    
+    def connection_check_out_failed(self, event):
+        self._add('checkout_failures', 1)
+    
+    def pool_created(self, event):
+        pass
+    
+    def pool_ready(self, event):
+        pass
+    
+    def pool_cleared(self, event):
+        pass
+    
+    def pool_closed(self, event):
+        pass
+    
+    def connection_ready(self, event):
+        pass
+    
+    def connection_check_out_started(self, event):
+        pass
+    
+    def snapshot(self):
+        with self._lock:
+            return {
+                'max_size': MONGO_MAX_POOL_SIZE,
+                'min_size': MONGO_MIN_POOL_SIZE,
+                'open': self.open,
+                'checked_out': self.checked_out,
+                'utilization': round(self.checked_out / MONGO_MAX_POOL_SIZE, 3) if MONGO_MAX_POOL_SIZE else None,
+                'checkout_failures': self.checkout_failures
+            }
 
 class Database:
+    """Process-wide database handle
+    
+    connect() never blocks longer than MONGO_STARTUP_WAIT_MS. If MongoDB has
+    not answered by then, requests are served from the in-memory fallback
+    while a background thread keeps pinging; once MongoDB answers, the
+    documents written to the fallback meanwhile are copied over, with writes
+    to the fallback held back, and get_db() switches to MongoDB.
+    """
     _instance = None
     _client = None
     _db = None
     _storage = None
+    _ready = None
+    _lock = threading.Lock()
+    backend = 'connecting'
+    backend_since = None
+    last_error = None
+    pool_stats = None
     
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(Database, cls).__new__(cls)
         return cls._instance
     
-    def connect(self):
+    def connect(self, wait=None, require_mongo=False):
+        """Return the active database, waiting up to wait seconds for MongoDB
+        
+        With require_mongo the wait defaults to the server selection timeout and
+        None is returned instead of falling back to in-memory storage, so scripts
+        never write into a store that disappears when they exit.
+        """
+        with self._lock:
+            if self._client is None:
+                self.pool_stats = PoolStats()
+                # The client connects in the background; creating it does not block
+                self._client = MongoClient(MONGO_URI,
+                                           event_listeners=[self.pool_stats, CommandCounter(), query_monitor],
+                                           **mongo_client_options())
+                # Lets the monitor explain slow queries for their documents examined
+                query_monitor.attach(self._client)
+                self._ready = threading.Event()
+                threading.Thread(target=self._connect_loop, name='mongo-connect', daemon=True).start()
+        
+        if require_mongo:
+            self._ready.wait(MONGO_SERVER_SELECTION_TIMEOUT_MS / 1000 if wait is None else wait)
+            return self._db if self.backend == 'mongodb' else None
+        
         if self._db is None:
+            self._ready.wait(MONGO_STARTUP_WAIT_MS / 1000 if wait is None else wait)
+            with self._lock:
+                if self._db is None:
+                    print("MongoDB not available yet; using in-memory storage for development")
+                    self._use_fallback()
+        return self._db
+    
+    def _use_fallback(self):
+        self._storage = InMemoryStorage(columnar=INMEMORY_STORAGE_MODE == 'columnar')
+        if INMEMORY_DATA_DIR:
+            Journal(
+                INMEMORY_DATA_DIR,
+                commit_interval=INMEMORY_COMMIT_INTERVAL_MS / 1000,
+                snapshot_interval=INMEMORY_SNAPSHOT_INTERVAL
+            ).open(self._storage)
+        self._db = MockDatabase(self._storage)
+        self._set_backend('memory')
+    
+    def _set_backend(self, backend):
+        self.backend = backend
+        self.backend_since = datetime.utcnow()
+    
+    def _connect_loop(self):
+        while True:
             try:
-                self._client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-                # Test connection with a short timeout
+                # Blocks for at most MONGO_SERVER_SELECTION_TIMEOUT_MS
                 self._client.admin.command('ping')
-                self._db = self._client[DATABASE_NAME]
-                print(f"Connected to MongoDB database: {DATABASE_NAME}")
+                break
             except Exception as e:
-                print(f"MongoDB not available: {e}")
-                print("Using in-memory storage for development")
-                # Use in-memory storage as fallback
-                self._storage = InMemoryStorage()
-                self._db = MockDatabase(self._storage)
-        return self._db
+                if self.last_error is None:
+                    print(f"MongoDB not available: {e}")
+                self.last_error = str(e)
+            if not MONGO_RETRY_INTERVAL and self._db is not None:
+                return
+            time.sleep(MONGO_RETRY_INTERVAL or 1)
+        self._promote()
+    
+    def _promote(self):
+        db = self._client[DATABASE_NAME]
+        if MONGO_ENSURE_INDEXES:
+            for error in apply_indexes(db):
+                print(f"Index not created: {error}")
+        with self._lock:
+            fallback = self._db
+            if fallback is None:
+                self._switch(db)
+        if fallback is not None:
+            # Writes to the fallback wait until it has been copied, then fail
+            # with AutoReconnect instead of landing where nobody reads them
+            with fallback.storage._lock:
+                self._migrate(fallback, db)
+                fallback.storage.retired = True
+                with self._lock:
+                    self._switch(db)
+            # Cached reports were computed from the fallback's documents
+            report_cache.clear()
+        self._ready.set()
+        print(f"Connected to MongoDB database: {DATABASE_NAME}")
+    
+    def _switch(self, db):
+        self._db = db
+        self._set_backend('mongodb')
+        self.last_error = None
+    
+    def _migrate(self, fallback, db):
+        """Copy what was written to the in-memory fallback into MongoDB
+        
+        Call with the fallback's write lock held. A document with a timestamp
+        (a delivery) replaces an older copy in MongoDB, last writer wins; other
+        documents are only inserted. Every document that is not copied, because
+        MongoDB has it at least as new or it collides on a unique index, is
+        logged. Rollups are not copied but rebuilt for the days with deliveries.
+        """
+        # The models import this module, so rollup is imported when first needed
+        from src.models import rollup
+        
+        days = set()
+        for name in list(fallback.storage.collections):
+            documents = fallback.storage.find(name)
+            if name == 'daily_rollups' or not documents:
+                continue
+            requests = []
+            for document in documents:
+                if 'timestamp' in document:
+                    fields = {field: value for field, value in document.items() if field != '_id'}
+                    requests.append(UpdateOne(
+                        {'_id': document['_id'], 'timestamp': {'$lt': document['timestamp']}},
+                        {'$set': fields},
+                        upsert=True
+                    ))
+                else:
+                    requests.append(InsertOne(document))
+            skipped = {}
+            try:
+                db[name].bulk_write(requests, ordered=False)
+            except BulkWriteError as e:
+                skipped = {error['index']: error['errmsg'] for error in e.details['writeErrors']}
+            except Exception as e:
+                print(f"Could not copy {name} from in-memory storage: {e}")
+                continue
+            for index, reason in skipped.items():
+                print(f"Not copied from in-memory storage: {name} {documents[index]['_id']}: {reason}")
+            if name == 'deliveries':
+                days.update(document['delivery_date'] for document in documents)
+            print(f"Copied {len(documents) - len(skipped)} of {len(documents)} {name} "
+                  f"from in-memory storage to MongoDB")
+        if days:
+            print(f"Rebuilt {rollup.rebuild(days, db)} daily rollups for {len(days)} days "
+                  f"written in in-memory storage")
+    
+    def status(self):
+        """Backend and connection pool state for the health endpoint"""
+        state = {
+            'backend': self.backend,
+            'since': self.backend_since.isoformat() if self.backend_since else None,
+            'database': DATABASE_NAME
+        }
+        if self.backend != 'mongodb':
+            state['last_error'] = self.last_error
+            state['retrying'] = bool(MONGO_RETRY_INTERVAL) or self._db is None
+        if self.pool_stats is not None:
+            state['pool'] = self.pool_stats.snapshot()
+        if self.backend == 'memory':
+            state['journaled'] = self._storage.journal is not None
+        return state
     
     def get_db(self):
         if self._db is None:
@@ -159,6 +1255,8 @@ class Database:
     def close(self):
         if self._client:
             self._client.close()
+        if self._storage is not None and self._storage.journal is not None:
+            self._storage.journal.close()
 
 # Global database instance
 db_instance = Database()
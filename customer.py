@@ -1,8 +1,15 @@
 from datetime import datetime
+import re
 from bson import ObjectId
+from src.database.cache import report_cache
 from src.database.config import db_instance
+from src.database.pagination import keyset_page, PAGE_SIZE_DEFAULT
+from src.models import identity_map
+from src.models.projection import Projectable, hydrate, mongo_projection
 
-class Customer:
+class Customer(Projectable):
+    FIELDS = ('name', 'address', 'mobile', 'created_at')
+    
     def __init__(self, name, address, mobile, _id=None):
         self._id = _id or ObjectId()
         self.name = name
@@ -50,62 +57,96 @@ class Customer:
             {'_id': self._id},
             {'$set': update_data}
         )
+        identity_map.forget('customers', self._id)
+        report_cache.bump(('customer', self._id))
         return result.modified_count > 0
     
     @staticmethod
-    def find_by_id(customer_id):
+    def _from_document(customer_data, fields=None):
+        if fields is not None:
+            return hydrate(Customer, customer_data, fields)
+        customer = Customer(
+            name=customer_data['name'],
+            address=customer_data['address'],
+            mobile=customer_data['mobile'],
+            _id=customer_data['_id']
+        )
+        customer.created_at = customer_data['created_at']
+        return customer
+    
+    @staticmethod
+    def find_by_id(customer_id, fields=None):
         db = db_instance.get_db()
         if db is None:
             return None
         
-        customer_data = db.customers.find_one({'_id': ObjectId(customer_id)})
+        customer_id = ObjectId(customer_id)
+        customer_data = identity_map.lookup('customers', customer_id, fields)
+        if identity_map.is_miss(customer_data):
+            customer_data = db.customers.find_one({'_id': customer_id}, mongo_projection(fields))
+            identity_map.remember('customers', customer_id, customer_data, fields)
         if customer_data:
-            customer = Customer(
-                name=customer_data['name'],
-                address=customer_data['address'],
-                mobile=customer_data['mobile'],
-                _id=customer_data['_id']
-            )
-            customer.created_at = customer_data['created_at']
-            return customer
+            return Customer._from_document(customer_data, fields)
         return None
     
     @staticmethod
-    def find_by_mobile(mobile):
+    def find_by_ids(customer_ids, fields=None):
+        """Load many customers with one $in query; returns a dict keyed by _id"""
+        db = db_instance.get_db()
+        if db is None:
+            return {}
+        
+        documents = identity_map.load_many(
+            'customers',
+            [ObjectId(customer_id) for customer_id in customer_ids],
+            lambda ids: db.customers.find({'_id': {'$in': ids}}, mongo_projection(fields)),
+            fields
+        )
+        return {_id: Customer._from_document(data, fields) for _id, data in documents.items()}
+    
+    @staticmethod
+    def find_by_mobile(mobile, fields=None):
         db = db_instance.get_db()
         if db is None:
             return None
         
-        customer_data = db.customers.find_one({'mobile': mobile})
+        customer_data = db.customers.find_one({'mobile': mobile}, mongo_projection(fields))
         if customer_data:
-            customer = Customer(
-                name=customer_data['name'],
-                address=customer_data['address'],
-                mobile=customer_data['mobile'],
-                _id=customer_data['_id']
-            )
-            customer.created_at = customer_data['created_at']
-            return customer
+            return Customer._from_document(customer_data, fields)
         return None
     
     @staticmethod
-    def get_all():
+    def get_all(fields=None):
         db = db_instance.get_db()
         if db is None:
             return []
         
         customers = []
-        for customer_data in db.customers.find():
-            customer = Customer(
-                name=customer_data['name'],
-                address=customer_data['address'],
-                mobile=customer_data['mobile'],
-                _id=customer_data['_id']
-            )
-            customer.created_at = customer_data['created_at']
-            customers.append(customer)
+        for customer_data in db.customers.find({}, mongo_projection(fields)):
+            customers.append(Customer._from_document(customer_data, fields))
         return customers
     
+    @staticmethod
+    def get_page(cursor=None, limit=PAGE_SIZE_DEFAULT, fields=None, search=None):
+        """One page of customers ordered by (name, _id); returns (customers, next_cursor)
+        
+        search keeps the customers whose name, address or mobile contains it,
+        ignoring case. Such a page walks the name index filtering as it goes.
+        """
+        db = db_instance.get_db()
+        if db is None:
+            return [], None
+        
+        query = {}
+        if search:
+            pattern = re.escape(search)
+            query['$or'] = [{field: {'$regex': pattern, '$options': 'i'}} for field in ('name', 'address', 'mobile')]
+        
+        # The cursor is built from the sort key, so it is always loaded
+        projection = mongo_projection(None if fields is None else {'name', *fields})
+        documents, next_cursor = keyset_page(db.customers, query, 'name', 1, cursor, limit, projection)
+        return [Customer._from_document(data, fields) for data in documents], next_cursor
+    
     @staticmethod
     def delete_by_id(customer_id):
         db = db_instance.get_db()
@@ -113,5 +154,7 @@ class Customer:
             return False
         
         result = db.customers.delete_one({'_id': ObjectId(customer_id)})
+        identity_map.forget('customers', ObjectId(customer_id))
+        report_cache.bump(('customer', ObjectId(customer_id)))
         return result.deleted_count > 0
 
@@ -1,8 +1,17 @@
 from datetime import datetime, date
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from src.database.cache import report_cache
 from src.database.config import db_instance
+from src.database.pagination import keyset_page, PAGE_SIZE_DEFAULT
+from src.models import rollup
+from src.models.projection import Projectable, hydrate, mongo_projection
 
-class Delivery:
+class Delivery(Projectable):
+    FIELDS = ('customer_id', 'delivery_boy_id', 'delivery_date', 'quantity', 'status', 'notes',
+              'photo_proof_url', 'timestamp', 'updated_by', 'created_at')
+    
     def __init__(self, customer_id, delivery_boy_id, delivery_date, quantity, 
                  status='Pending', notes='', photo_proof_url='', _id=None):
         self._id = _id or ObjectId()
@@ -39,17 +48,13 @@ class Delivery:
         
         if include_delivery_boy:
             from src.models.user import User
-            delivery_boy = User.find_by_id(str(self.delivery_boy_id))
+            delivery_boy = User.find_by_id(str(self.delivery_boy_id), User.PUBLIC_FIELDS)
             result['delivery_boy'] = delivery_boy.to_dict() if delivery_boy else None
         
         return result
     
-    def save(self):
-        db = db_instance.get_db()
-        if db is None:
-            return None
-        
-        delivery_data = {
+    def _to_document(self):
+        return {
             '_id': self._id,
             'customer_id': self.customer_id,
             'delivery_boy_id': self.delivery_boy_id,
@@ -62,10 +67,56 @@ class Delivery:
             'updated_by': self.updated_by,
             'created_at': self.created_at
         }
+    
+    def save(self):
+        db = db_instance.get_db()
+        if db is None:
+            return None
+        
+        delivery_data = self._to_document()
         
         result = db.deliveries.insert_one(delivery_data)
+        rollup.apply_change(None, delivery_data)
+        report_cache.bump(*Delivery._report_scopes(delivery_data))
         return result.inserted_id
     
+    @staticmethod
+    def save_many(deliveries, chunk_size=1000):
+        """Insert deliveries with unordered insert_many calls of chunk_size
+        
+        Returns one write error ({'code', 'errmsg'}) per delivery, None for
+        those inserted. A failed document does not stop the rest of its chunk.
+        """
+        db = db_instance.get_db()
+        if db is None:
+            return [{'code': None, 'errmsg': 'Database not available'}] * len(deliveries)
+        
+        errors = [None] * len(deliveries)
+        inserted = []
+        for start in range(0, len(deliveries), chunk_size):
+            documents = [delivery._to_document() for delivery in deliveries[start:start + chunk_size]]
+            failed = {}
+            try:
+                db.deliveries.insert_many(documents, ordered=False)
+            except BulkWriteError as e:
+                for error in e.details.get('writeErrors', []):
+                    failed[error['index']] = {
+                        'code': error.get('code'),
+                        'errmsg': error.get('errmsg', 'Write failed')
+                    }
+            for offset, document in enumerate(documents):
+                if offset in failed:
+                    errors[start + offset] = failed[offset]
+                else:
+                    inserted.append(document)
+        
+        rollup.apply_inserts(inserted)
+        scopes = set()
+        for document in inserted:
+            scopes.update(Delivery._report_scopes(document))
+        report_cache.bump(*scopes)
+        return errors
+    
     def update(self, updated_by_id):
         db = db_instance.get_db()
         if db is None:
@@ -86,38 +137,236 @@ class Delivery:
             'updated_by': self.updated_by
         }
         
-        result = db.deliveries.update_one(
+        # The before-image gives the exact delta to apply to the daily rollups
+        previous = db.deliveries.find_one_and_update(
             {'_id': self._id},
-            {'$set': update_data}
+            {'$set': update_data},
+            return_document=ReturnDocument.BEFORE
         )
-        return result.modified_count > 0
+        if previous is None:
+            return False
+        rollup.apply_change(previous, dict(previous, **update_data))
+        report_cache.bump(*Delivery._report_scopes(previous), *Delivery._report_scopes(update_data))
+        return True
     
     @staticmethod
-    def find_by_id(delivery_id):
+    def sync_statuses(changes, updated_by_id, delivery_boy_id=None):
+        """Apply a batch of offline status changes with a single bulk_write
+        
+        Each change is a dict with '_id', 'status', 'timestamp' (naive UTC, the
+        time the change was made on the device), 'key' (idempotency key) and
+        optionally 'notes' and 'photo_proof_url'. Conflicts are resolved
+        last-writer-wins on timestamp, and every update is conditional on the
+        timestamp it was decided against, so a concurrent write is never lost.
+        With delivery_boy_id set, only that delivery boy's deliveries change.
+        
+        Idempotency keys belong to the user sending them. A key already
+        processed for the same delivery answers with the outcome recorded then;
+        one already used for another delivery answers 'key_reused'.
+        
+        Returns (outcomes, replayed, documents): one of 'applied', 'stale',
+        'not_found' or 'key_reused' per change, whether each one repeated an
+        earlier key, and the server state of every delivery referenced, keyed
+        by _id.
+        """
+        db = db_instance.get_db()
+        if db is None:
+            return ['not_found'] * len(changes), [False] * len(changes), {}
+        
+        updated_by = ObjectId(updated_by_id) if isinstance(updated_by_id, str) else updated_by_id
+        outcomes = [None] * len(changes)
+        replayed = [False] * len(changes)
+        
+        # Keys this user had processed before, and repeats within this batch
+        recorded = Delivery._recorded_sync_keys(db, updated_by, {change['key'] for change in changes})
+        fresh = []
+        first = {}
+        repeats = []
+        for position, change in enumerate(changes):
+            if change['key'] in recorded:
+                outcomes[position] = Delivery._replayed_outcome(recorded[change['key']], change)
+                replayed[position] = True
+            elif change['key'] in first:
+                repeats.append(position)
+            else:
+                first[change['key']] = position
+                fresh.append(position)
+        
+        ids = list({changes[position]['_id'] for position in fresh})
+        # Copies: the in-memory backend hands out its live documents
+        loaded = {document['_id']: dict(document)
+                  for document in db.deliveries.find({'_id': {'$in': ids}})} if ids else {}
+        
+        # The latest change per delivery wins; the rest of the batch is stale
+        winners = {}
+        for position in fresh:
+            change = changes[position]
+            document = loaded.get(change['_id'])
+            if document is None or (delivery_boy_id and document['delivery_boy_id'] != delivery_boy_id):
+                outcomes[position] = 'not_found'
+                continue
+            current = winners.get(change['_id'])
+            if current is None or change['timestamp'] >= changes[current]['timestamp']:
+                if current is not None:
+                    outcomes[current] = 'stale'
+                winners[change['_id']] = position
+            else:
+                outcomes[position] = 'stale'
+        
+        requests = []
+        attempted = {}
+        for _id, position in winners.items():
+            change = changes[position]
+            document = loaded[_id]
+            if change['timestamp'] <= document['timestamp']:
+                outcomes[position] = 'stale'
+                continue
+            update_data = {
+                'status': change['status'],
+                'timestamp': change['timestamp'],
+                'updated_by': updated_by
+            }
+            for field in ('notes', 'photo_proof_url'):
+                if change.get(field) is not None:
+                    update_data[field] = change[field]
+            requests.append(UpdateOne(
+                {'_id': _id, 'timestamp': document['timestamp']},
+                {'$set': update_data}
+            ))
+            attempted[_id] = position
+        
+        if requests:
+            db.deliveries.bulk_write(requests, ordered=False)
+        
+        # Replays are read back too: a retried batch is all replays, and the
+        # client needs the server state to reconcile
+        referenced = list({change['_id'] for change in changes})
+        documents = {document['_id']: document
+                     for document in db.deliveries.find({'_id': {'$in': referenced}})} if referenced else {}
+        
+        # An update whose condition failed lost to a concurrent newer write
+        applied = []
+        for _id, position in attempted.items():
+            document = documents.get(_id)
+            if document is not None and document['timestamp'] == changes[position]['timestamp']:
+                outcomes[position] = 'applied'
+                applied.append((loaded[_id], document))
+            else:
+                outcomes[position] = 'stale'
+        
+        if applied:
+            rollup.apply_changes(applied)
+            scopes = set()
+            for document, _ in applied:
+                scopes.update(Delivery._report_scopes(document))
+            report_cache.bump(*scopes)
+        
+        for position in repeats:
+            origin = first[changes[position]['key']]
+            outcomes[position] = Delivery._replayed_outcome(
+                {'delivery_id': changes[origin]['_id'], 'outcome': outcomes[origin]}, changes[position])
+            replayed[position] = True
+        
+        created_at = datetime.utcnow()
+        key_documents = [{'user_id': updated_by, 'key': changes[position]['key'],
+                          'delivery_id': changes[position]['_id'], 'outcome': outcomes[position],
+                          'created_at': created_at}
+                         for position in fresh if outcomes[position] != 'not_found']
+        if key_documents:
+            try:
+                db.sync_keys.insert_many(key_documents, ordered=False)
+            except BulkWriteError as e:
+                # A concurrent retry recorded some keys first; its update won
+                # the race this one lost as stale, so its outcome stands
+                taken = {key_documents[error['index']]['key'] for error in e.details['writeErrors']}
+                recorded = Delivery._recorded_sync_keys(db, updated_by, taken)
+                for position in fresh + repeats:
+                    record = recorded.get(changes[position]['key'])
+                    if record is not None and outcomes[position] == 'stale':
+                        outcomes[position] = Delivery._replayed_outcome(record, changes[position])
+                        replayed[position] = True
+        
+        return outcomes, replayed, documents
+    
+    @staticmethod
+    def _recorded_sync_keys(db, user_id, keys):
+        """Recorded sync_keys documents of user_id among keys, by key"""
+        if not keys:
+            return {}
+        return {document['key']: document
+                for document in db.sync_keys.find({'user_id': user_id, 'key': {'$in': list(keys)}},
+                                                  {'key': 1, 'delivery_id': 1, 'outcome': 1})}
+    
+    @staticmethod
+    def _replayed_outcome(record, change):
+        if record['delivery_id'] != change['_id']:
+            return 'key_reused'
+        return record['outcome']
+    
+    @staticmethod
+    def _report_scopes(delivery_data):
+        """Report cache scopes whose results depend on this delivery"""
+        return [
+            ('all',),
+            ('date', delivery_data['delivery_date']),
+            ('customer', delivery_data['customer_id']),
+            ('delivery_boy', delivery_data['delivery_boy_id'])
+        ]
+    
+    @staticmethod
+    def _from_document(delivery_data, fields=None):
+        if fields is not None:
+            return hydrate(Delivery, delivery_data, fields)
+        delivery = Delivery(
+            customer_id=delivery_data['customer_id'],
+            delivery_boy_id=delivery_data['delivery_boy_id'],
+            delivery_date=delivery_data['delivery_date'],
+            quantity=delivery_data['quantity'],
+            status=delivery_data['status'],
+            notes=delivery_data['notes'],
+            photo_proof_url=delivery_data['photo_proof_url'],
+            _id=delivery_data['_id']
+        )
+        delivery.timestamp = delivery_data['timestamp']
+        delivery.updated_by = delivery_data.get('updated_by')
+        delivery.created_at = delivery_data['created_at']
+        return delivery
+    
+    @staticmethod
+    def load_related(deliveries, include_customer=False, include_delivery_boy=False):
+        """Batch-load the customers and delivery boys referenced by deliveries
+        
+        Issues at most one $in query per collection and fills the per-request
+        identity map, so the find_by_id calls in to_dict no longer hit the database.
+        """
+        from src.models.customer import Customer
+        from src.models.user import User
+        
+        if include_customer:
+            Customer.find_by_ids({delivery.customer_id for delivery in deliveries})
+        if include_delivery_boy:
+            User.find_by_ids({delivery.delivery_boy_id for delivery in deliveries}, User.PUBLIC_FIELDS)
+    
+    @staticmethod
+    def to_dict_many(deliveries, include_customer=False, include_delivery_boy=False):
+        """Serialize a list of deliveries with a constant number of queries"""
+        Delivery.load_related(deliveries, include_customer, include_delivery_boy)
+        return [delivery.to_dict(include_customer, include_delivery_boy)
+                for delivery in deliveries]
+    
+    @staticmethod
+    def find_by_id(delivery_id, fields=None):
         db = db_instance.get_db()
         if db is None:
             return None
         
-        delivery_data = db.deliveries.find_one({'_id': ObjectId(delivery_id)})
+        delivery_data = db.deliveries.find_one({'_id': ObjectId(delivery_id)}, mongo_projection(fields))
         if delivery_data:
-            delivery = Delivery(
-                customer_id=delivery_data['customer_id'],
-                delivery_boy_id=delivery_data['delivery_boy_id'],
-                delivery_date=delivery_data['delivery_date'],
-                quantity=delivery_data['quantity'],
-                status=delivery_data['status'],
-                notes=delivery_data['notes'],
-                photo_proof_url=delivery_data['photo_proof_url'],
-                _id=delivery_data['_id']
-            )
-            delivery.timestamp = delivery_data['timestamp']
-            delivery.updated_by = delivery_data.get('updated_by')
-            delivery.created_at = delivery_data['created_at']
-            return delivery
+            return Delivery._from_document(delivery_data, fields)
         return None
     
     @staticmethod
-    def find_by_date_and_delivery_boy(delivery_date, delivery_boy_id):
+    def find_by_date_and_delivery_boy(delivery_date, delivery_boy_id, fields=None):
         db = db_instance.get_db()
         if db is None:
             return []
@@ -128,25 +377,12 @@ class Delivery:
         for delivery_data in db.deliveries.find({
             'delivery_date': query_date,
             'delivery_boy_id': ObjectId(delivery_boy_id)
-        }):
-            delivery = Delivery(
-                customer_id=delivery_data['customer_id'],
-                delivery_boy_id=delivery_data['delivery_boy_id'],
-                delivery_date=delivery_data['delivery_date'],
-                quantity=delivery_data['quantity'],
-                status=delivery_data['status'],
-                notes=delivery_data['notes'],
-                photo_proof_url=delivery_data['photo_proof_url'],
-                _id=delivery_data['_id']
-            )
-            delivery.timestamp = delivery_data['timestamp']
-            delivery.updated_by = delivery_data.get('updated_by')
-            delivery.created_at = delivery_data['created_at']
-            deliveries.append(delivery)
+        }, mongo_projection(fields)):
+            deliveries.append(Delivery._from_document(delivery_data, fields))
         return deliveries
     
     @staticmethod
-    def find_by_customer_id(customer_id):
+    def find_by_customer_id(customer_id, fields=None):
         db = db_instance.get_db()
         if db is None:
             return []
@@ -154,44 +390,35 @@ class Delivery:
         deliveries = []
         for delivery_data in db.deliveries.find({
             'customer_id': ObjectId(customer_id)
-        }).sort('delivery_date', -1):
-            delivery = Delivery(
-                customer_id=delivery_data['customer_id'],
-                delivery_boy_id=delivery_data['delivery_boy_id'],
-                delivery_date=delivery_data['delivery_date'],
-                quantity=delivery_data['quantity'],
-                status=delivery_data['status'],
-                notes=delivery_data['notes'],
-                photo_proof_url=delivery_data['photo_proof_url'],
-                _id=delivery_data['_id']
-            )
-            delivery.timestamp = delivery_data['timestamp']
-            delivery.updated_by = delivery_data.get('updated_by')
-            delivery.created_at = delivery_data['created_at']
-            deliveries.append(delivery)
+        }, mongo_projection(fields)).sort('delivery_date', -1):
+            deliveries.append(Delivery._from_document(delivery_data, fields))
         return deliveries
     
     @staticmethod
-    def get_all():
+    def get_all(fields=None):
         db = db_instance.get_db()
         if db is None:
             return []
         
         deliveries = []
-        for delivery_data in db.deliveries.find().sort('delivery_date', -1):
-            delivery = Delivery(
-                customer_id=delivery_data['customer_id'],
-                delivery_boy_id=delivery_data['delivery_boy_id'],
-                delivery_date=delivery_data['delivery_date'],
-                quantity=delivery_data['quantity'],
-                status=delivery_data['status'],
-                notes=delivery_data['notes'],
-                photo_proof_url=delivery_data['photo_proof_url'],
-                _id=delivery_data['_id']
-            )
-            delivery.timestamp = delivery_data['timestamp']
-            delivery.updated_by = delivery_data.get('updated_by')
-            delivery.created_at = delivery_data['created_at']
-            deliveries.append(delivery)
+        for delivery_data in db.deliveries.find({}, mongo_projection(fields)).sort('delivery_date', -1):
+            deliveries.append(Delivery._from_document(delivery_data, fields))
         return deliveries
-
+    
+    @staticmethod
+    def get_page(cursor=None, limit=PAGE_SIZE_DEFAULT, delivery_boy_id=None, fields=None):
+        """One page of deliveries, newest first by (delivery_date, _id)
+        
+        Returns (deliveries, next_cursor).
+        """
+        db = db_instance.get_db()
+        if db is None:
+            return [], None
+        
+        query = {}
+        if delivery_boy_id:
+            query['delivery_boy_id'] = ObjectId(delivery_boy_id)
+        # The cursor is built from the sort key, so it is always loaded
+        projection = mongo_projection(None if fields is None else {'delivery_date', *fields})
+        documents, next_cursor = keyset_page(db.deliveries, query, 'delivery_date', -1, cursor, limit, projection)
+        return [Delivery._from_document(data, fields) for data in documents], next_cursor
@@ -0,0 +1,230 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from datetime import datetime, timezone
+from bson import ObjectId
+from bson.errors import InvalidId
+import os
+from src.database.config import db_instance
+from src.models.delivery import Delivery
+from src.routes.auth import current_role
+
+delivery_bulk_bp = Blueprint('delivery_bulk', __name__)
+
+BULK_MAX_ASSIGNMENTS = int(os.getenv('BULK_MAX_ASSIGNMENTS', '10000'))
+BULK_INSERT_CHUNK_SIZE = int(os.getenv('BULK_INSERT_CHUNK_SIZE', '1000'))
+SYNC_MAX_CHANGES = int(os.getenv('SYNC_MAX_CHANGES', '1000'))
+
+VALID_STATUSES = ('Pending', 'Delivered', 'Issue')
+
+def _parse_assignment(assignment):
+    """Validate one assignment's fields; returns (fields, error)"""
+    if not isinstance(assignment, dict):
+        return None, 'Assignment must be an object'
+    
+    missing = [field for field in ('customer_id', 'delivery_boy_id', 'date', 'quantity')
+               if assignment.get(field) in (None, '')]
+    if missing:
+        return None, f"Missing required fields: {', '.join(missing)}"
+    
+    try:
+        customer_id = ObjectId(assignment['customer_id'])
+        delivery_boy_id = ObjectId(assignment['delivery_boy_id'])
+    except (InvalidId, TypeError):
+        return None, 'Invalid customer_id or delivery_boy_id'
+    
+    try:
+        delivery_date = datetime.strptime(assignment['date'], '%Y-%m-%d').date()
+    except (ValueError, TypeError):
+        return None, 'Invalid date, expected YYYY-MM-DD'
+    
+    try:
+        quantity = float(assignment['quantity'])
+    except (ValueError, TypeError):
+        return None, 'Invalid quantity'
+    if quantity <= 0:
+        return None, 'Quantity must be positive'
+    if quantity.is_integer():
+        quantity = int(quantity)
+    
+    status = assignment.get('status', 'Pending')
+    if status not in VALID_STATUSES:
+        return None, f"Invalid status, expected one of {', '.join(VALID_STATUSES)}"
+    
+    return {
+        'customer_id': customer_id,
+        'delivery_boy_id': delivery_boy_id,
+        'delivery_date': delivery_date,
+        'quantity': quantity,
+        'status': status,
+        'notes': assignment.get('notes', '')
+    }, None
+
+def _existing_ids(collection, ids, extra_query=None):
+    """The subset of ids present in collection, found with a single $in query"""
+    if not ids:
+        return set()
+    query = {'_id': {'$in': list(ids)}}
+    query.update(extra_query or {})
+    return {document['_id'] for document in collection.find(query, {'_id': 1})}
+
+@delivery_bulk_bp.route('/bulk', methods=['POST'])
+@jwt_required()
+def bulk_assign_deliveries():
+    """Create many deliveries at once
+    
+    Body: {"assignments": [{customer_id, delivery_boy_id, date, quantity,
+    status?, notes?}, ...]}. Every row gets a result in request order; valid
+    rows are created even when others fail.
+    """
+    try:
+        if current_role() != 'admin':
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        data = request.get_json(silent=True) or {}
+        assignments = data.get('assignments')
+        if not isinstance(assignments, list) or not assignments:
+            return jsonify({'error': 'assignments must be a non-empty list'}), 400
+        if len(assignments) > BULK_MAX_ASSIGNMENTS:
+            return jsonify({'error': f'At most {BULK_MAX_ASSIGNMENTS} assignments per request'}), 413
+        
+        db = db_instance.get_db()
+        if db is None:
+            return jsonify({'error': 'Database not available'}), 503
+        
+        results = [None] * len(assignments)
+        parsed = []
+        for index, assignment in enumerate(assignments):
+            fields, error = _parse_assignment(assignment)
+            if error:
+                results[index] = {'index': index, 'status': 'error', 'error': error}
+            else:
+                parsed.append((index, fields))
+        
+        # One lookup per referenced collection, however many rows there are
+        customers = _existing_ids(db.customers, {fields['customer_id'] for _, fields in parsed})
+        delivery_boys = _existing_ids(
+            db.users,
+            {fields['delivery_boy_id'] for _, fields in parsed},
+            {'role': 'delivery_boy'}
+        )
+        
+        pending = []
+        for index, fields in parsed:
+            if fields['customer_id'] not in customers:
+                results[index] = {'index': index, 'status': 'error', 'error': 'Customer not found'}
+            elif fields['delivery_boy_id'] not in delivery_boys:
+                results[index] = {'index': index, 'status': 'error', 'error': 'Delivery boy not found'}
+            else:
+                pending.append((index, Delivery(**fields)))
+        
+        errors = Delivery.save_many([delivery for _, delivery in pending], BULK_INSERT_CHUNK_SIZE)
+        for (index, delivery), error in zip(pending, errors):
+            if error:
+                results[index] = {'index': index, 'status': 'error', 'error': error['errmsg']}
+            else:
+                results[index] = {'index': index, 'status': 'created', 'id': str(delivery._id)}
+        
+        created = sum(1 for result in results if result['status'] == 'created')
+        status_code = 201 if created == len(results) else 207
+        return jsonify({
+            'created': created,
+            'failed': len(results) - created,
+            'results': results
+        }), status_code
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _parse_change(change):
+    """Validate one offline status change; returns (fields, error)"""
+    if not isinstance(change, dict):
+        return None, 'Change must be an object'
+    
+    missing = [field for field in ('id', 'status', 'timestamp', 'idempotency_key')
+               if change.get(field) in (None, '')]
+    if missing:
+        return None, f"Missing required fields: {', '.join(missing)}"
+    
+    try:
+        delivery_id = ObjectId(change['id'])
+    except (InvalidId, TypeError):
+        return None, 'Invalid id'
+    
+    if change['status'] not in VALID_STATUSES:
+        return None, f"Invalid status, expected one of {', '.join(VALID_STATUSES)}"
+    
+    try:
+        timestamp = datetime.fromisoformat(str(change['timestamp']).replace('Z', '+00:00'))
+    except ValueError:
+        return None, 'Invalid timestamp, expected ISO 8601'
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    # A device clock running ahead must not win every future conflict, and
+    # MongoDB keeps milliseconds only
+    timestamp = min(timestamp, datetime.utcnow())
+    timestamp = timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000)
+    
+    return {
+        '_id': delivery_id,
+        'status': change['status'],
+        'notes': change.get('notes'),
+        'photo_proof_url': change.get('photo_proof_url'),
+        'timestamp': timestamp,
+        'key': str(change['idempotency_key'])
+    }, None
+
+@delivery_bulk_bp.route('/sync', methods=['POST'])
+@jwt_required()
+def sync_delivery_statuses():
+    """Apply status changes queued on a device while offline
+    
+    Body: {"changes": [{id, status, timestamp, idempotency_key, notes?,
+    photo_proof_url?}, ...]}. Retrying the same request is safe: a change whose
+    idempotency key the same user already sent is marked replayed and answered
+    with the outcome recorded the first time.
+    """
+    try:
+        role = current_role()
+        if role not in ('admin', 'delivery_boy'):
+            return jsonify({'error': 'Access denied'}), 403
+        
+        data = request.get_json(silent=True) or {}
+        changes = data.get('changes')
+        if not isinstance(changes, list) or not changes:
+            return jsonify({'error': 'changes must be a non-empty list'}), 400
+        if len(changes) > SYNC_MAX_CHANGES:
+            return jsonify({'error': f'At most {SYNC_MAX_CHANGES} changes per request'}), 413
+        
+        results = [None] * len(changes)
+        parsed = []
+        for index, change in enumerate(changes):
+            fields, error = _parse_change(change)
+            if error:
+                results[index] = {'index': index, 'status': 'error', 'error': error}
+            else:
+                parsed.append((index, fields))
+        
+        user_id = get_jwt_identity()
+        # Delivery boys may only touch their own deliveries
+        own_deliveries = ObjectId(user_id) if role == 'delivery_boy' else None
+        outcomes, replayed, documents = Delivery.sync_statuses(
+            [fields for _, fields in parsed], user_id, own_deliveries)
+        
+        for (index, fields), outcome, repeated in zip(parsed, outcomes, replayed):
+            results[index] = {
+                'index': index,
+                'id': str(fields['_id']),
+                'idempotency_key': fields['key'],
+                'status': outcome,
+                'replayed': repeated
+            }
+        
+        visible = [Delivery._from_document(document) for document in documents.values()
+                   if own_deliveries is None or document['delivery_boy_id'] == own_deliveries]
+        return jsonify({
+            'results': results,
+            'deliveries': [delivery.to_dict() for delivery in visible]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
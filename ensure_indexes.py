@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Index provisioning script for Milk Delivery App
+Creates the MongoDB indexes registered in src/database/indexes.py. Safe to
+run repeatedly; indexes that already exist are left alone. With --verify it
+also explains every registered model query and exits non-zero if any of them
+would scan a whole collection.
+
+Usage: python src/ensure_indexes.py [--verify]
+"""
+
+import sys
+import os
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from src.database.config import db_instance
+from src.database.indexes import apply_indexes, verify_indexes
+
+def ensure_indexes(verify=False):
+    """Create the registered indexes, optionally checking the query plans"""
+    print("Ensuring MongoDB indexes...")
+    
+    db = db_instance.connect(require_mongo=True)
+    
+    if db is None:
+        print("❌ MongoDB not available; the in-memory storage keeps its own indexes.")
+        return 1
+    
+    errors = apply_indexes(db)
+    for error in errors:
+        print(f"❌ {error}")
+    if not errors:
+        print("✅ All indexes present")
+    
+    if not verify:
+        return 1 if errors else 0
+    
+    failures = verify_indexes(db)
+    for description, stages in failures:
+        print(f"❌ {description} scans the whole collection: {' > '.join(stages)}")
+    if not failures:
+        print("✅ Every registered query uses an index")
+    return 1 if errors or failures else 0
+
+if __name__ == '__main__':
+    sys.exit(ensure_indexes('--verify' in sys.argv[1:]))
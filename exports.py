@@ -0,0 +1,140 @@
+from flask import Blueprint, Response, request, jsonify
+from flask_jwt_extended import jwt_required
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+import csv
+import io
+import json
+import os
+from src.database.config import db_instance
+from src.routes.auth import current_role
+
+exports_bp = Blueprint('exports', __name__)
+
+# Documents fetched per database round trip and rows written per response chunk
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '500'))
+
+EXPORT_FIELDS = [
+    'id', 'delivery_date', 'customer_id', 'delivery_boy_id', 'quantity', 'status',
+    'notes', 'photo_proof_url', 'timestamp', 'updated_by', 'created_at'
+]
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+def _export_row(delivery_data):
+    """Flatten a delivery document to JSON-friendly values"""
+    row = {}
+    for field in EXPORT_FIELDS:
+        value = delivery_data.get('_id' if field == 'id' else field)
+        if isinstance(value, ObjectId):
+            value = str(value)
+        elif hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        row[field] = value
+    return row
+
+def _ndjson_chunk(rows):
+    return ''.join(json.dumps(row) + '\n' for row in rows)
+
+def _csv_chunk(rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    if header:
+        writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+def _generate(cursor, export_format):
+    """Yield the export one batch of rows at a time
+    
+    The first chunk is sent before the query runs, so clients see the first
+    byte immediately; only one batch of documents is held in memory at once.
+    """
+    yield _csv_chunk([], header=True) if export_format == 'csv' else ''
+    
+    rows = []
+    for delivery_data in cursor:
+        rows.append(_export_row(delivery_data))
+        if len(rows) >= EXPORT_BATCH_SIZE:
+            yield _csv_chunk(rows) if export_format == 'csv' else _ndjson_chunk(rows)
+            rows = []
+    if rows:
+        yield _csv_chunk(rows) if export_format == 'csv' else _ndjson_chunk(rows)
+
+def _stream_deliveries(query, filename):
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in CONTENT_TYPES:
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    if start_date or end_date:
+        date_range = {}
+        if start_date:
+            date_range['$gte'] = datetime.strptime(start_date, '%Y-%m-%d').date()
+        if end_date:
+            date_range['$lte'] = datetime.strptime(end_date, '%Y-%m-%d').date()
+        query['delivery_date'] = date_range
+    
+    db = db_instance.get_db()
+    if db is None:
+        return jsonify({'error': 'Database not available'}), 503
+    
+    cursor = db.deliveries.find(query).sort('delivery_date', 1).batch_size(EXPORT_BATCH_SIZE)
+    
+    response = Response(_generate(cursor, export_format), mimetype=CONTENT_TYPES[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    # Keep reverse proxies from buffering the whole export before sending it
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def _export(query, filename):
+    try:
+        if current_role() != 'admin':
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        return _stream_deliveries(query, filename)
+    
+    except (ValueError, InvalidId) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@exports_bp.route('/deliveries', methods=['GET'])
+@jwt_required()
+def export_deliveries():
+    """All deliveries, optionally narrowed by customer_id, delivery_boy_id and dates"""
+    try:
+        query = {}
+        if request.args.get('customer_id'):
+            query['customer_id'] = ObjectId(request.args['customer_id'])
+        if request.args.get('delivery_boy_id'):
+            query['delivery_boy_id'] = ObjectId(request.args['delivery_boy_id'])
+    except InvalidId as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return _export(query, 'deliveries')
+
+@exports_bp.route('/customer/<customer_id>', methods=['GET'])
+@jwt_required()
+def export_customer_deliveries(customer_id):
+    try:
+        query = {'customer_id': ObjectId(customer_id)}
+    except InvalidId as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return _export(query, f'customer-{customer_id}')
+
+@exports_bp.route('/delivery-boy/<delivery_boy_id>', methods=['GET'])
+@jwt_required()
+def export_delivery_boy_deliveries(delivery_boy_id):
+    try:
+        query = {'delivery_boy_id': ObjectId(delivery_boy_id)}
+    except InvalidId as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return _export(query, f'delivery-boy-{delivery_boy_id}')
@@ -0,0 +1,73 @@
+"""Per-request identity map for documents loaded by the models
+
+Lives on flask.g, so it is dropped at the end of every request and never
+serves stale data across requests. Outside an app context nothing is cached.
+Both found documents and confirmed misses (None) are remembered.
+
+Documents loaded with a projection are remembered with their field list and
+only served to lookups asking for a subset of those fields.
+"""
+
+from flask import g, has_app_context
+
+_MISS = object()
+
+def _entries():
+    if not has_app_context():
+        return None
+    entries = getattr(g, '_identity_map', None)
+    if entries is None:
+        entries = g._identity_map = {}
+    return entries
+
+def lookup(collection, _id, fields=None):
+    """Return the cached document (or None for a known miss), else MISS"""
+    entries = _entries()
+    if entries is None:
+        return _MISS
+    document, loaded = entries.get((collection, _id), (_MISS, None))
+    if document is not None and loaded is not None and (fields is None or not loaded.issuperset(fields)):
+        return _MISS
+    return document
+
+def remember(collection, _id, document, fields=None):
+    entries = _entries()
+    if entries is None:
+        return
+    if document is not None and fields is not None:
+        cached, loaded = entries.get((collection, _id), (None, None))
+        if cached is not None and loaded is None:
+            # Never replace a whole document with a narrower one
+            return
+        fields = frozenset(fields)
+    entries[(collection, _id)] = (document, fields)
+
+def forget(collection, _id):
+    entries = _entries()
+    if entries is not None:
+        entries.pop((collection, _id), None)
+
+def is_miss(value):
+    return value is _MISS
+
+def load_many(collection, ids, fetch, fields=None):
+    """Documents for ids, fetching the uncached ones with a single fetch(ids) call
+
+    fetch receives a list of ids and returns an iterable of documents; ids it
+    does not return are remembered as misses.
+    """
+    documents = {}
+    missing = []
+    for _id in dict.fromkeys(ids):
+        cached = lookup(collection, _id, fields)
+        if is_miss(cached):
+            missing.append(_id)
+        elif cached is not None:
+            documents[_id] = cached
+    if missing:
+        fetched = {document['_id']: document for document in fetch(missing)}
+        for _id in missing:
+            remember(collection, _id, fetched.get(_id), fields)
+            if _id in fetched:
+                documents[_id] = fetched[_id]
+    return documents
@@ -0,0 +1,139 @@
+"""Declarative MongoDB index registry
+
+INDEXES lists every index the models' queries rely on. apply_indexes creates
+them idempotently: create_indexes is a no-op for an index that already exists
+with the same key and options. verify_indexes runs explain() on one
+representative query per model access path and reports the ones whose
+winning plan still contains a COLLSCAN.
+
+The in-memory backend has its own equivalent in config.MEMORY_INDEXES.
+"""
+
+from datetime import datetime
+import os
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+SYNC_KEY_TTL_SECONDS = int(os.getenv('SYNC_KEY_TTL_SECONDS', str(7 * 24 * 3600)))
+
+INDEXES = {
+    'users': [
+        IndexModel([('username', ASCENDING)], name='username_unique', unique=True),
+        IndexModel([('role', ASCENDING)], name='role'),
+    ],
+    'customers': [
+        IndexModel([('mobile', ASCENDING)], name='mobile_unique', unique=True),
+        IndexModel([('name', ASCENDING), ('_id', ASCENDING)], name='name_id'),
+    ],
+    'deliveries': [
+        IndexModel([('delivery_date', ASCENDING), ('delivery_boy_id', ASCENDING)], name='date_delivery_boy'),
+        # At most one delivery per customer and day; also serves per-customer history
+        IndexModel([('customer_id', ASCENDING), ('delivery_date', DESCENDING)], name='customer_date_unique',
+                   unique=True),
+        IndexModel([('delivery_boy_id', ASCENDING), ('delivery_date', DESCENDING), ('_id', DESCENDING)],
+                   name='delivery_boy_date_id'),
+        IndexModel([('delivery_date', DESCENDING), ('_id', DESCENDING)], name='date_id'),
+    ],
+    'daily_rollups': [
+        IndexModel([('date', ASCENDING), ('delivery_boy_id', ASCENDING)], name='date_delivery_boy_unique', unique=True),
+        IndexModel([('delivery_boy_id', ASCENDING), ('date', ASCENDING)], name='delivery_boy_date'),
+    ],
+    'subscriptions': [
+        IndexModel([('customer_id', ASCENDING)], name='customer'),
+        IndexModel([('active', ASCENDING)], name='active'),
+    ],
+    'sync_keys': [
+        IndexModel([('created_at', ASCENDING)], name='created_at_ttl', expireAfterSeconds=SYNC_KEY_TTL_SECONDS),
+        # Keys are per user; sparse skips the unscoped keys recorded before
+        IndexModel([('user_id', ASCENDING), ('key', ASCENDING)], name='user_key_unique', unique=True,
+                   sparse=True),
+    ],
+}
+
+# Indexes an entry above has replaced, dropped by apply_indexes before creating
+RETIRED_INDEXES = {
+    # Same keys as customer_date_unique, which MongoDB will not build beside it
+    'deliveries': ['customer_date'],
+}
+
+# Only the shape of a query decides its plan, so any sample values will do.
+# Dates are datetimes here because BSON has no plain date type.
+_ID = ObjectId()
+_DAY = datetime(2024, 1, 1)
+
+# (description, collection, filter, sort)
+VERIFY_QUERIES = [
+    ('User.find_by_username', 'users', {'username': 'admin'}, None),
+    ('register: existing admins', 'users', {'role': 'admin'}, None),
+    ('Customer.find_by_mobile', 'customers', {'mobile': '0000000000'}, None),
+    ('Customer.get_page', 'customers',
+     {'name': {'$gte': 'a'}, '$or': [{'name': {'$gt': 'a'}}, {'name': 'a', '_id': {'$gt': _ID}}]},
+     [('name', ASCENDING), ('_id', ASCENDING)]),
+    ('Customer.get_page with a search', 'customers',
+     {'$or': [{field: {'$regex': 'a', '$options': 'i'}} for field in ('name', 'address', 'mobile')]},
+     [('name', ASCENDING), ('_id', ASCENDING)]),
+    ('Delivery.find_by_date_and_delivery_boy', 'deliveries',
+     {'delivery_date': _DAY, 'delivery_boy_id': _ID}, None),
+    ('Delivery.find_by_customer_id', 'deliveries', {'customer_id': _ID}, [('delivery_date', DESCENDING)]),
+    ('Delivery.get_all', 'deliveries', {}, [('delivery_date', DESCENDING)]),
+    ('Delivery.get_page', 'deliveries',
+     {'delivery_date': {'$lte': _DAY},
+      '$or': [{'delivery_date': {'$lt': _DAY}}, {'delivery_date': _DAY, '_id': {'$lt': _ID}}]},
+     [('delivery_date', DESCENDING), ('_id', DESCENDING)]),
+    ('Delivery.get_page for a delivery boy', 'deliveries', {'delivery_boy_id': _ID},
+     [('delivery_date', DESCENDING), ('_id', DESCENDING)]),
+    ('customer report', 'deliveries',
+     {'customer_id': _ID, 'delivery_date': {'$gte': _DAY, '$lte': _DAY}}, [('delivery_date', DESCENDING)]),
+    ('delivery export', 'deliveries', {'delivery_date': {'$gte': _DAY, '$lte': _DAY}},
+     [('delivery_date', ASCENDING)]),
+    ('summary report', 'daily_rollups', {'date': {'$gte': _DAY, '$lte': _DAY}}, None),
+    ('delivery boy report', 'daily_rollups', {'delivery_boy_id': _ID, 'date': {'$gte': _DAY, '$lte': _DAY}}, None),
+    ('daily rollup increment', 'daily_rollups', {'date': _DAY, 'delivery_boy_id': _ID}, None),
+    ('Subscription.find_by_customer_id', 'subscriptions', {'customer_id': _ID}, None),
+    ('Subscription.materialize', 'subscriptions', {'active': True}, None),
+    ('Delivery.sync_statuses: recorded keys', 'sync_keys', {'user_id': _ID, 'key': {'$in': ['key']}}, None),
+]
+
+def apply_indexes(db):
+    """Create every registered index; returns a list of error messages"""
+    errors = []
+    for collection, names in RETIRED_INDEXES.items():
+        existing = db[collection].index_information()
+        for name in names:
+            if name in existing:
+                try:
+                    db[collection].drop_index(name)
+                except OperationFailure as e:
+                    errors.append(f"{collection}: {e}")
+    for collection, models in INDEXES.items():
+        try:
+            db[collection].create_indexes(models)
+        except OperationFailure as e:
+            # Typically an existing index with the same name but other options, or
+            # documents that already break a unique index
+            errors.append(f"{collection}: {e}")
+    return errors
+
+def _stages(plan):
+    """Every stage name in an explain() plan tree"""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for key in ('inputStage', 'queryPlan', 'winningPlan'):
+            if key in plan:
+                yield from _stages(plan[key])
+        for child in plan.get('inputStages', []):
+            yield from _stages(child)
+
+def verify_indexes(db):
+    """explain() each registered query; returns (description, stages) for COLLSCANs"""
+    failures = []
+    for description, collection, query, sort in VERIFY_QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        stages = list(_stages(cursor.explain().get('queryPlanner', {}).get('winningPlan', {})))
+        if 'COLLSCAN' in stages:
+            failures.append((description, stages))
+    return failures
@@ -17,13 +17,14 @@ def init_database():
     """Initialize database with default admin user"""
     print("Initializing Milk Delivery Database...")
     
-    # Connect to database
-    db = db_instance.connect()
+    # Connect to database; users created in in-memory storage would be lost on exit
+    db = db_instance.connect(require_mongo=True)
     
     if db is None:
-        print("Warning: MongoDB not available. Using in-memory storage for development.")
-    else:
-        print("Connected to MongoDB successfully.")
+        print("❌ MongoDB not available; no users were created.")
+        return 1
+    
+    print("Connected to MongoDB successfully.")
     
     # Check if admin user already exists
     admin_user = User.find_by_username('admin')
@@ -32,7 +33,7 @@ def init_database():
         print("Admin user already exists.")
         print(f"Username: admin")
         print("Use the existing admin credentials to login.")
-        return
+        return 0
     
     # Create default admin user
     admin = User(
@@ -52,6 +53,7 @@ def init_database():
         print("⚠️  IMPORTANT: Change the default password in production!")
     else:
         print("❌ Failed to create admin user.")
+        return 1
     
     # Create a sample delivery boy user
     delivery_boy = User.find_by_username('delivery_boy1')
@@ -76,7 +78,8 @@ def init_database():
     
     print("\nDatabase initialization completed!")
     print("You can now start the Flask application with: python src/main.py")
+    return 0
 
 if __name__ == '__main__':
-    init_database()
+    sys.exit(init_database())
 
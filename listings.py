@@ -0,0 +1,58 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from bson.errors import InvalidId
+from src.models.customer import Customer
+from src.models.delivery import Delivery
+from src.database.pagination import InvalidCursor, page_size
+from src.routes.auth import current_role
+
+listings_bp = Blueprint('listings', __name__)
+
+@listings_bp.route('/customers', methods=['GET'])
+@jwt_required()
+def list_customers():
+    try:
+        if current_role() != 'admin':
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        limit = page_size(request.args.get('limit'))
+        customers, next_cursor = Customer.get_page(request.args.get('cursor'), limit,
+                                                   search=request.args.get('search', '').strip())
+        
+        return jsonify({
+            'items': [customer.to_dict() for customer in customers],
+            'next_cursor': next_cursor,
+            'limit': limit
+        }), 200
+        
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@listings_bp.route('/deliveries', methods=['GET'])
+@jwt_required()
+def list_deliveries():
+    try:
+        # Delivery boys only ever see their own deliveries
+        role = current_role()
+        if role == 'admin':
+            delivery_boy_id = request.args.get('delivery_boy_id')
+        elif role == 'delivery_boy':
+            delivery_boy_id = get_jwt_identity()
+        else:
+            return jsonify({'error': 'Access denied'}), 403
+        
+        limit = page_size(request.args.get('limit'))
+        deliveries, next_cursor = Delivery.get_page(request.args.get('cursor'), limit, delivery_boy_id)
+        
+        return jsonify({
+            'items': Delivery.to_dict_many(deliveries, include_customer=True, include_delivery_boy=True),
+            'next_cursor': next_cursor,
+            'limit': limit
+        }), 200
+        
+    except (InvalidCursor, InvalidId) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
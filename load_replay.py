@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Morning-rush load replay for Milk Delivery App
+Replays the shift change against a running app over HTTP: every virtual
+delivery boy fetches their list for the day from /api/deliveries/daily/<date>,
+then marks each delivery Delivered or Issue with PUT /api/deliveries/<id>/status
+(or in batches through /api/deliveries/sync with --writes sync), and starts
+over; meanwhile virtual admins poll /api/reports/daily/<date>.
+
+The number of concurrent delivery boys steps up through --steps, each step
+running for --step-seconds. After each step the latency percentiles and error
+rate of every endpoint are printed; the saturation point is the first step
+where throughput stops growing by --min-gain, p95 exceeds --p95-limit-ms or
+the error rate exceeds --error-limit.
+
+The virtual users log in as the users of src/seed_data.py, so load a depot
+whose last day is --date first, e.g.:
+    INMEMORY_DATA_DIR=data python src/seed_data.py --days 30
+    INMEMORY_DATA_DIR=data python src/main.py
+
+Usage: python src/load_replay.py [--base-url http://localhost:5001] [--date YYYY-MM-DD]
+                                 [--steps 5,10,20,40] [--step-seconds 30] [--admins 2]
+                                 [--writes put|sync] [--output load_results.json]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import date, datetime
+from urllib.parse import urlsplit
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from src.seed_data import ADMIN_USERNAME, SEED_PASSWORD
+
+# Share of status updates that report an issue instead of a delivery
+ISSUE_SHARE = 0.03
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class Client:
+    """One virtual user's keep-alive connection to the app"""
+    def __init__(self, base_url, timeout, recorder=None):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.secure = parts.scheme == 'https'
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.recorder = recorder
+        self.token = None
+        self._connection = None
+
+    def _connect(self):
+        connection_class = http.client.HTTPSConnection if self.secure else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, endpoint, body=None):
+        """Send one request and record it under endpoint; returns (status, parsed JSON or None)
+
+        status is None when the request failed before a response arrived.
+        """
+        headers = {'Accept': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+
+        started = time.perf_counter()
+        status, data = None, None
+        try:
+            if self._connection is None:
+                self._connection = self._connect()
+            self._connection.request(method, self.prefix + path, payload, headers)
+            response = self._connection.getresponse()
+            raw = response.read()
+            status = response.status
+            if response.getheader('Content-Type', '').startswith('application/json'):
+                data = json.loads(raw)
+        except (OSError, http.client.HTTPException, ValueError):
+            # Reconnect on the next request; the server may have dropped the connection
+            self.close()
+        if self.recorder is not None:
+            self.recorder.record(endpoint, status, time.perf_counter() - started)
+        return status, data
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+class Recorder:
+    """Latencies and statuses per endpoint for one step"""
+    def __init__(self):
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, status, seconds):
+        with self._lock:
+            entry = self.endpoints.get(endpoint)
+            if entry is None:
+                entry = self.endpoints[endpoint] = {'latencies': [], 'statuses': {}}
+            entry['latencies'].append(seconds)
+            key = str(status) if status is not None else 'failed'
+            entry['statuses'][key] = entry['statuses'].get(key, 0) + 1
+
+    def summary(self, duration):
+        endpoints = {}
+        everything = []
+        errors = 0
+        with self._lock:
+            for endpoint, entry in sorted(self.endpoints.items()):
+                latencies = entry['latencies']
+                failed = sum(count for status, count in entry['statuses'].items()
+                             if status == 'failed' or int(status) >= 400)
+                endpoints[endpoint] = {
+                    'requests': len(latencies),
+                    'errors': failed,
+                    'error_rate': round(failed / len(latencies), 4),
+                    'statuses': dict(sorted(entry['statuses'].items())),
+                    'throughput_rps': round(len(latencies) / duration, 2),
+                    'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+                    'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+                    'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+                    'max_ms': round(max(latencies) * 1000, 3)
+                }
+                everything.extend(latencies)
+                errors += failed
+        return {
+            'requests': len(everything),
+            'errors': errors,
+            'error_rate': round(errors / len(everything), 4) if everything else 0.0,
+            'throughput_rps': round(len(everything) / duration, 2),
+            'p95_ms': round(percentile(everything, 0.95) * 1000, 3),
+            'endpoints': endpoints
+        }
+
+def login(client, username):
+    status, data = client.request('POST', '/api/auth/login', 'POST /api/auth/login',
+                                  {'username': username, 'password': SEED_PASSWORD})
+    if status != 200 or not data:
+        raise RuntimeError(f'Could not log in as {username} (status {status}); was src/seed_data.py run?')
+    client.token = data['token']
+
+def _delivery_ids(data):
+    """Ids in a daily list response, a list of deliveries or {'deliveries': [...]}"""
+    if isinstance(data, dict):
+        data = data.get('deliveries')
+    if not isinstance(data, list):
+        return []
+    return [delivery['id'] for delivery in data if isinstance(delivery, dict) and delivery.get('id')]
+
+class Profile:
+    """The traffic mix each virtual user replays"""
+    def __init__(self, day, writes='put', sync_batch=10, updates_per_round=0, think_seconds=0.0,
+                 admin_interval=1.0):
+        self.day = day.isoformat()
+        self.writes = writes
+        self.sync_batch = sync_batch
+        self.updates_per_round = updates_per_round
+        self.think_seconds = think_seconds
+        self.admin_interval = admin_interval
+
+    def _status(self, rng):
+        return 'Issue' if rng.random() < ISSUE_SHARE else 'Delivered'
+
+    def delivery_boy(self, client, rng, stop):
+        """Fetch the day's list, update every delivery on it, repeat until stop is set"""
+        while not stop.is_set():
+            status, data = client.request('GET', f'/api/deliveries/daily/{self.day}',
+                                          'GET /api/deliveries/daily/<date>')
+            delivery_ids = _delivery_ids(data) if status == 200 else []
+            rng.shuffle(delivery_ids)
+            if self.updates_per_round:
+                delivery_ids = delivery_ids[:self.updates_per_round]
+            if not delivery_ids:
+                # Nothing to update; wait instead of hammering the list endpoint
+                stop.wait(max(self.think_seconds, 0.5))
+                continue
+
+            if self.writes == 'sync':
+                for start in range(0, len(delivery_ids), self.sync_batch):
+                    if stop.is_set():
+                        return
+                    now = datetime.utcnow().isoformat() + 'Z'
+                    changes = [{'id': delivery_id, 'status': self._status(rng), 'timestamp': now,
+                                'idempotency_key': str(uuid.UUID(int=rng.getrandbits(128)))}
+                               for delivery_id in delivery_ids[start:start + self.sync_batch]]
+                    client.request('POST', '/api/deliveries/sync', 'POST /api/deliveries/sync',
+                                   {'changes': changes})
+                    stop.wait(self.think_seconds)
+            else:
+                for delivery_id in delivery_ids:
+                    if stop.is_set():
+                        return
+                    status = self._status(rng)
+                    client.request('PUT', f'/api/deliveries/{delivery_id}/status',
+                                   'PUT /api/deliveries/<id>/status',
+                                   {'status': status, 'notes': 'Gate locked' if status == 'Issue' else ''})
+                    stop.wait(self.think_seconds)
+
+    def admin(self, client, rng, stop):
+        """Poll the day's report"""
+        while not stop.is_set():
+            client.request('GET', f'/api/reports/daily/{self.day}', 'GET /api/reports/daily/<date>')
+            # Jitter keeps the admins from polling in lockstep
+            stop.wait(self.admin_interval * rng.uniform(0.5, 1.5))
+
+def run_step(profile, delivery_boys, admins, seconds, seed):
+    """Run the profile with the given logged-in clients for seconds; returns the step summary"""
+    recorder = Recorder()
+    stop = threading.Event()
+    threads = []
+    for number, client in enumerate(delivery_boys):
+        client.recorder = recorder
+        rng = random.Random(f'{seed}:delivery_boy:{number}')
+        threads.append(threading.Thread(target=profile.delivery_boy, args=(client, rng, stop), daemon=True))
+    for number, client in enumerate(admins):
+        client.recorder = recorder
+        rng = random.Random(f'{seed}:admin:{number}')
+        threads.append(threading.Thread(target=profile.admin, args=(client, rng, stop), daemon=True))
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    stop.wait(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return recorder.summary(time.perf_counter() - started)
+
+def saturation(previous, current, args):
+    """Why current is past the saturation point, or None"""
+    if current['error_rate'] > args.error_limit:
+        return f"error rate {current['error_rate']:.1%} above {args.error_limit:.1%}"
+    if current['p95_ms'] > args.p95_limit_ms:
+        return f"p95 {current['p95_ms']:.0f} ms above {args.p95_limit_ms:.0f} ms"
+    if previous and current['throughput_rps'] < previous['throughput_rps'] * (1 + args.min_gain):
+        return (f"throughput {previous['throughput_rps']:.1f} -> {current['throughput_rps']:.1f} req/s, "
+                f"less than {args.min_gain:.0%} more")
+    return None
+
+def print_step(step):
+    print(f"\n{step['delivery_boys']} delivery boys, {step['admins']} admins: "
+          f"{step['throughput_rps']:.1f} req/s, p95 {step['p95_ms']:.1f} ms, "
+          f"errors {step['errors']}/{step['requests']}")
+    for endpoint, result in step['endpoints'].items():
+        print(f"  {endpoint:<38} {result['throughput_rps']:8.1f} req/s  p50 {result['p50_ms']:8.1f}  "
+              f"p95 {result['p95_ms']:8.1f}  p99 {result['p99_ms']:8.1f} ms  "
+              f"errors {result['error_rate']:6.1%}  {result['statuses']}")
+        if set(result['statuses']) <= {'404', '405'}:
+            print(f"  ⚠️  {endpoint} is not served by this app")
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the morning rush against a running app')
+    parser.add_argument('--base-url', default='http://localhost:5001')
+    parser.add_argument('--date', type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                        default=date.today(), help='delivery day to replay (default: today)')
+    parser.add_argument('--steps', type=lambda value: [int(part) for part in value.split(',')],
+                        default=[5, 10, 20, 40], help='concurrent delivery boys per step')
+    parser.add_argument('--step-seconds', type=float, default=30)
+    parser.add_argument('--admins', type=int, default=2, help='admins polling the daily report')
+    parser.add_argument('--admin-interval', type=float, default=1.0, help='seconds between report polls')
+    parser.add_argument('--writes', choices=('put', 'sync'), default='put')
+    parser.add_argument('--sync-batch', type=int, default=10, help='status changes per sync request')
+    parser.add_argument('--updates-per-round', type=int, default=0,
+                        help='updates after each list fetch (default: the whole list)')
+    parser.add_argument('--think-ms', type=float, default=0, help='pause between a delivery boy\'s requests')
+    parser.add_argument('--p95-limit-ms', type=float, default=500)
+    parser.add_argument('--error-limit', type=float, default=0.01)
+    parser.add_argument('--min-gain', type=float, default=0.1,
+                        help='throughput growth a step needs to count as not saturated')
+    parser.add_argument('--all-steps', action='store_true', help='keep stepping past the saturation point')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    profile = Profile(args.date, args.writes, args.sync_batch, args.updates_per_round,
+                      args.think_ms / 1000, args.admin_interval)
+    print(f"Replaying {args.date} against {args.base_url}: steps {args.steps} delivery boys, "
+          f"{args.admins} admins, {args.step_seconds:g}s each, writes via {args.writes}")
+
+    # Log everyone in up front, so bcrypt does not count against the first step
+    started = time.time()
+    try:
+        admins = []
+        for _ in range(args.admins):
+            client = Client(args.base_url, args.timeout)
+            login(client, ADMIN_USERNAME)
+            admins.append(client)
+        delivery_boys = []
+        for number in range(1, max(args.steps) + 1):
+            client = Client(args.base_url, args.timeout)
+            login(client, f'seed_boy{number:03d}')
+            delivery_boys.append(client)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(f"Logged in {len(admins)} admins and {len(delivery_boys)} delivery boys "
+          f"in {time.time() - started:.1f}s")
+
+    # Without a list to work through, the delivery boys would only fetch it
+    status, data = delivery_boys[0].request('GET', f'/api/deliveries/daily/{args.date}', None)
+    if not _delivery_ids(data):
+        print(f"⚠️  /api/deliveries/daily/{args.date} gave seed_boy001 no deliveries (status {status}); "
+              f"is the depot's last day {args.date} and the delivery routes module deployed?")
+
+    steps = []
+    saturated = None
+    for concurrency in args.steps:
+        step = run_step(profile, delivery_boys[:concurrency], admins, args.step_seconds, args.seed)
+        step = dict({'delivery_boys': concurrency, 'admins': args.admins}, **step)
+        print_step(step)
+        reason = saturation(steps[-1] if steps else None, step, args)
+        steps.append(step)
+        if reason and saturated is None:
+            saturated = {'delivery_boys': concurrency, 'reason': reason}
+            if not args.all_steps:
+                break
+
+    for client in admins + delivery_boys:
+        client.close()
+
+    if saturated:
+        capacity = [step for step in steps if step['delivery_boys'] < saturated['delivery_boys']]
+        print(f"\n⚠️  Saturated at {saturated['delivery_boys']} delivery boys: {saturated['reason']}")
+        if capacity:
+            best = capacity[-1]
+            print(f"   Last healthy step: {best['delivery_boys']} delivery boys at "
+                  f"{best['throughput_rps']:.1f} req/s, p95 {best['p95_ms']:.1f} ms")
+    else:
+        print(f"\n✅ Not saturated up to {args.steps[-1]} delivery boys")
+
+    if args.output:
+        results = {
+            'created_at': datetime.utcnow().isoformat(),
+            'config': {
+                'base_url': args.base_url,
+                'date': args.date.isoformat(),
+                'steps': args.steps,
+                'step_seconds': args.step_seconds,
+                'admins': args.admins,
+                'admin_interval': args.admin_interval,
+                'writes': args.writes,
+                'sync_batch': args.sync_batch,
+                'updates_per_round': args.updates_per_round,
+                'think_ms': args.think_ms,
+                'seed': args.seed
+            },
+            'steps': steps,
+            'saturated': saturated
+        }
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -15,7 +15,12 @@ from src.database.config import db_instance
 from src.routes.auth import auth_bp
 from src.routes.customer import customer_bp
 from src.routes.delivery import delivery_bp
+from src.routes.delivery_bulk import delivery_bulk_bp
 from src.routes.reports import reports_bp
+from src.routes.exports import exports_bp
+from src.routes.listings import listings_bp
+from src.routes.subscriptions import subscriptions_bp
+from src.routes.monitoring import monitoring_bp, init_request_metrics
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 
@@ -28,14 +33,22 @@ app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
 jwt = JWTManager(app)
 CORS(app, origins="*")  # Allow all origins for development
 
-# Initialize database connection
+# Per-endpoint latency, status, size and database operation metrics
+init_request_metrics(app)
+
+# Start connecting to the database; waits at most MONGO_STARTUP_WAIT_MS
 db_instance.connect()
 
 # Register blueprints
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
 app.register_blueprint(customer_bp, url_prefix='/api/customers')
 app.register_blueprint(delivery_bp, url_prefix='/api/deliveries')
+app.register_blueprint(delivery_bulk_bp, url_prefix='/api/deliveries')
 app.register_blueprint(reports_bp, url_prefix='/api/reports')
+app.register_blueprint(exports_bp, url_prefix='/api/exports')
+app.register_blueprint(listings_bp, url_prefix='/api/listings')
+app.register_blueprint(subscriptions_bp, url_prefix='/api/subscriptions')
+app.register_blueprint(monitoring_bp, url_prefix='/api')
 
 # JWT error handlers
 @jwt.expired_token_loader
@@ -56,7 +69,8 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'message': 'Milk Delivery API is running',
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'database': db_instance.status()
     }), 200
 
 # Serve static files (for admin web panel)
@@ -82,6 +96,11 @@ def serve(path):
                     'customers': '/api/customers',
                     'deliveries': '/api/deliveries',
                     'reports': '/api/reports',
+                    'exports': '/api/exports',
+                    'listings': '/api/listings',
+                    'subscriptions': '/api/subscriptions',
+                    'metrics': '/api/metrics',
+                    'query_stats': '/api/metrics/queries',
                     'health': '/api/health'
                 }
             }), 200
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Subscription scheduler job for Milk Delivery App
+Creates the deliveries that active subscriptions owe on a date (tomorrow by
+default). Meant to run daily from cron; running it again for the same date
+creates nothing new.
+
+Usage: python src/materialize_subscriptions.py [YYYY-MM-DD]
+"""
+
+import sys
+import os
+import time
+from datetime import date, timedelta
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from src.database.config import db_instance
+from src.models.subscription import Subscription
+
+def materialize(delivery_date):
+    """Materialize subscription deliveries for delivery_date"""
+    print(f"Materializing subscription deliveries for {delivery_date}...")
+    
+    db = db_instance.connect(require_mongo=True)
+    
+    if db is None:
+        print("❌ MongoDB not available; nothing was written.")
+        return 1
+    
+    started = time.time()
+    summary = Subscription.materialize(delivery_date, int(os.getenv('MATERIALIZE_CHUNK_SIZE', '1000')))
+    print(f"✅ {summary['due']} subscriptions due: {summary['created']} deliveries created, "
+          f"{summary['skipped']} already existed, {summary['failed']} failed "
+          f"in {time.time() - started:.2f}s")
+    return 1 if summary['failed'] else 0
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(materialize(sys.argv[1]))
+    else:
+        sys.exit(materialize((date.today() + timedelta(days=1)).isoformat()))
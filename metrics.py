@@ -0,0 +1,155 @@
+"""Process-wide request and database metrics in Prometheus text format
+
+Counters and histograms are kept in memory per label set and rendered by
+render(). The request in progress is tracked in a context variable, so every
+database operation issued while serving it, through MongoDB's command
+monitoring or the in-memory MockCollection, is attributed to its endpoint.
+"""
+
+from bisect import bisect_left
+from contextvars import ContextVar
+import threading
+from pymongo.monitoring import CommandListener
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+DB_CALL_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, [("le", _number(bound))])} '
+                                 f'{cumulative}')
+                lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}')
+                lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time spent serving a request.', ('endpoint', 'method'))
+REQUESTS = Counter(
+    'http_requests_total', 'Requests served, by response status.', ('endpoint', 'method', 'status'))
+RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes', 'Size of response bodies with a known length.', ('endpoint', 'method'),
+    SIZE_BUCKETS)
+REQUEST_DB_CALLS = Histogram(
+    'http_request_db_operations', 'Database operations issued per request.', ('endpoint', 'method'),
+    DB_CALL_BUCKETS)
+DB_OPERATIONS = Counter(
+    'db_operations_total', 'Database operations, by the endpoint that issued them.',
+    ('endpoint', 'collection', 'operation'))
+
+REGISTRY = [REQUEST_LATENCY, REQUESTS, RESPONSE_SIZE, REQUEST_DB_CALLS, DB_OPERATIONS]
+
+class RequestStats:
+    """What one request has done so far"""
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.db_calls = 0
+        self.operations = {}
+
+_current = ContextVar('request_stats', default=None)
+
+def start_request(endpoint):
+    """Start attributing database operations to endpoint; returns a reset token"""
+    return _current.set(RequestStats(endpoint))
+
+def current_request():
+    return _current.get()
+
+def finish_request(token):
+    _current.reset(token)
+
+def record_db_call(collection, operation):
+    stats = _current.get()
+    endpoint = stats.endpoint if stats is not None else ''
+    if stats is not None:
+        stats.db_calls += 1
+        key = f'{collection}.{operation}'
+        stats.operations[key] = stats.operations.get(key, 0) + 1
+    DB_OPERATIONS.inc((endpoint, collection, operation))
+
+# Driver commands that are not operations on application data
+_IGNORED_COMMANDS = {'ping', 'hello', 'ismaster', 'isMaster', 'buildInfo', 'endSessions',
+                     'saslStart', 'saslContinue', 'killCursors', 'listIndexes', 'createIndexes'}
+
+class CommandCounter(CommandListener):
+    """Counts the MongoDB commands each request sends, via command monitoring"""
+    def started(self, event):
+        if event.command_name in _IGNORED_COMMANDS:
+            return
+        command = event.command
+        if event.command_name == 'getMore':
+            collection = command.get('collection', '')
+        else:
+            collection = command.get(event.command_name, '')
+        record_db_call(collection if isinstance(collection, str) else '', event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,95 @@
+from flask import Blueprint, Response, current_app, g, request, jsonify
+from flask_jwt_extended import verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
+import os
+import time
+from src.database import metrics
+from src.database.query_stats import query_stats
+from src.routes.auth import current_role
+
+monitoring_bp = Blueprint('monitoring', __name__)
+
+# Requests issuing more database operations than this are logged; 0 disables
+METRICS_DB_CALLS_LOG_THRESHOLD = int(os.getenv('METRICS_DB_CALLS_LOG_THRESHOLD', '25'))
+# /api/metrics and /api/metrics/queries answer "Authorization: Bearer
+# <METRICS_TOKEN>" when it is set, and admin JWTs always
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+def _endpoint():
+    # Unmatched URLs share one label so they cannot grow the label set
+    return request.endpoint or 'unmatched'
+
+def _before_request():
+    g._metrics_started = time.perf_counter()
+    g._metrics_token = metrics.start_request(_endpoint())
+
+def _after_request(response):
+    started = g.pop('_metrics_started', None)
+    if started is None:
+        return response
+    size = response.content_length if not response.is_streamed else None
+    record_request(_endpoint(), request.method, request.path, response.status_code,
+                   time.perf_counter() - started, size)
+    return response
+
+def record_request(endpoint, method, path, status, seconds, size=None):
+    """Record one finished request, inside metrics.start_request
+    
+    Shared by the Flask hooks and the ASGI entry point; needs an app context
+    for the log. size is the body length when it is known up front.
+    """
+    metrics.REQUEST_LATENCY.observe((endpoint, method), seconds)
+    metrics.REQUESTS.inc((endpoint, method, str(status)))
+    if size is not None:
+        metrics.RESPONSE_SIZE.observe((endpoint, method), size)
+    
+    stats = metrics.current_request()
+    if stats is not None:
+        metrics.REQUEST_DB_CALLS.observe((endpoint, method), stats.db_calls)
+        if METRICS_DB_CALLS_LOG_THRESHOLD and stats.db_calls > METRICS_DB_CALLS_LOG_THRESHOLD:
+            busiest = sorted(stats.operations.items(), key=lambda item: -item[1])[:5]
+            current_app.logger.warning(
+                '%s %s issued %d database operations (threshold %d): %s',
+                method, path, stats.db_calls, METRICS_DB_CALLS_LOG_THRESHOLD,
+                ', '.join(f'{operation} x{count}' for operation, count in busiest)
+            )
+
+def _teardown_request(error=None):
+    token = g.pop('_metrics_token', None)
+    if token is not None:
+        metrics.finish_request(token)
+
+def init_request_metrics(app):
+    """Record latency, status, response size and database operations of every request"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    if not METRICS_TOKEN:
+        app.logger.warning('METRICS_TOKEN is not set: /api/metrics and /api/metrics/queries '
+                           'only answer admin tokens, so a metrics scraper cannot read them')
+
+def _authorized():
+    """The request carries METRICS_TOKEN or an admin's JWT"""
+    if METRICS_TOKEN and request.headers.get('Authorization') == f'Bearer {METRICS_TOKEN}':
+        return True
+    try:
+        verify_jwt_in_request()
+    except (JWTExtendedException, PyJWTError):
+        return False
+    return current_role() == 'admin'
+
+@monitoring_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    if not _authorized():
+        return jsonify({'error': 'Metrics token or admin access required'}), 401
+    
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@monitoring_bp.route('/metrics/queries', methods=['GET'])
+def get_query_stats():
+    """Per-shape query statistics and the slow-query log, optionally for one collection"""
+    if not _authorized():
+        return jsonify({'error': 'Metrics token or admin access required'}), 401
+    
+    return jsonify(query_stats.snapshot(request.args.get('collection')))
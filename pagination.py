@@ -0,0 +1,119 @@
+"""Keyset pagination over (field, _id)
+
+A page is read as "the next limit documents after the last one returned",
+expressed as a range predicate on the sort key, so every page costs one index
+seek plus the page itself no matter how deep into the listing it is. The
+position travels between requests as an opaque cursor token.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, datetime
+import binascii
+import json
+import os
+from bson import ObjectId
+from bson.errors import InvalidId
+
+PAGE_SIZE_DEFAULT = int(os.getenv('PAGE_SIZE_DEFAULT', '50'))
+PAGE_SIZE_MAX = int(os.getenv('PAGE_SIZE_MAX', '200'))
+
+class InvalidCursor(ValueError):
+    """Raised for a cursor token that was not produced by encode_cursor"""
+
+def page_size(requested):
+    """Clamp a client-requested page size to the server limits"""
+    try:
+        size = int(requested) if requested else PAGE_SIZE_DEFAULT
+    except (TypeError, ValueError):
+        size = PAGE_SIZE_DEFAULT
+    return max(1, min(size, PAGE_SIZE_MAX))
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    return value
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+        raise InvalidCursor('Invalid cursor')
+    return value
+
+def encode_cursor(value, _id):
+    data = json.dumps([_encode_value(value), str(_id)], separators=(',', ':'))
+    return urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(token):
+    """Return the (value, _id) position a cursor token points after"""
+    try:
+        data = urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        value, _id = json.loads(data)
+        return _decode_value(value), ObjectId(_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, InvalidId):
+        raise InvalidCursor('Invalid cursor')
+
+def after_query(field, direction, position):
+    """Query clause selecting the documents that sort after position
+
+    The redundant $gte/$lte on field lets an index on field seek straight to
+    the position; the $or then skips the ties already returned.
+    """
+    value, _id = position
+    past, tie_break = ('$gt', '$gte') if direction > 0 else ('$lt', '$lte')
+    return {
+        field: {tie_break: value},
+        '$or': [
+            {field: {past: value}},
+            {field: value, '_id': {past: _id}}
+        ]
+    }
+
+def _page_query(query, field, direction, cursor):
+    query = dict(query or {})
+    if cursor:
+        position = decode_cursor(cursor)
+        if field in query or '$or' in query:
+            # Keep the caller's own condition on field, or its own $or, alongside the seek
+            query = {'$and': [query, after_query(field, direction, position)]}
+        else:
+            query.update(after_query(field, direction, position))
+    return query
+
+def _page_result(documents, field, limit):
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        last = documents[-1]
+        next_cursor = encode_cursor(last.get(field), last['_id'])
+    return documents, next_cursor
+
+def keyset_page(collection, query, field, direction=1, cursor=None, limit=PAGE_SIZE_DEFAULT,
+                projection=None):
+    """Read one page of collection ordered by (field, _id)
+
+    Returns (documents, next_cursor); next_cursor is None on the last page.
+    A projection must include field, which the next cursor is built from.
+    """
+    # One extra document tells whether another page follows
+    documents = list(
+        collection.find(_page_query(query, field, direction, cursor), projection)
+        .sort([(field, direction), ('_id', direction)])
+        .limit(limit + 1)
+    )
+    return _page_result(documents, field, limit)
+
+async def keyset_page_async(collection, query, field, direction=1, cursor=None, limit=PAGE_SIZE_DEFAULT,
+                            projection=None):
+    """keyset_page for an async (motor-style) collection"""
+    documents = await (
+        collection.find(_page_query(query, field, direction, cursor), projection)
+        .sort([(field, direction), ('_id', direction)])
+        .limit(limit + 1)
+        .to_list(limit + 1)
+    )
+    return _page_result(documents, field, limit)
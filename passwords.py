@@ -0,0 +1,83 @@
+"""Password hashing on a bounded worker pool
+
+bcrypt is deliberately CPU-bound. Running it on a fixed-size thread pool (the
+bcrypt extension releases the GIL while hashing) caps how many hashes run at
+once. A bounded wait queue in front of the pool applies backpressure: when it
+is full, callers get PasswordPoolBusy after BCRYPT_QUEUE_TIMEOUT seconds
+instead of piling up behind each other.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+# 0 hashes inline in the calling thread
+BCRYPT_WORKERS = int(os.getenv('BCRYPT_WORKERS', str(os.cpu_count() or 2)))
+BCRYPT_QUEUE_SIZE = int(os.getenv('BCRYPT_QUEUE_SIZE', '64'))
+BCRYPT_QUEUE_TIMEOUT = float(os.getenv('BCRYPT_QUEUE_TIMEOUT', '5'))
+
+class PasswordPoolBusy(Exception):
+    """Raised when the hashing queue stays full for longer than the timeout"""
+
+def hash_cost(hashed):
+    """Work factor of a bcrypt hash such as $2b$12$..."""
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+class PasswordHasher:
+    def __init__(self, rounds=BCRYPT_ROUNDS, workers=BCRYPT_WORKERS,
+                 queue_size=BCRYPT_QUEUE_SIZE, queue_timeout=BCRYPT_QUEUE_TIMEOUT):
+        self.rounds = rounds
+        self.queue_timeout = queue_timeout
+        self._executor = None
+        if workers > 0:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_size)
+
+    def _submit(self, function, *args, wait=True):
+        if self._executor is None:
+            return None if not wait else function(*args)
+        if not self._slots.acquire(timeout=self.queue_timeout if wait else 0):
+            if not wait:
+                return None
+            raise PasswordPoolBusy('Password hashing queue is full')
+        future = self._executor.submit(function, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result() if wait else future
+
+    def hash(self, password):
+        return self._submit(self._hash, password)
+
+    def _hash(self, password):
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+    def verify(self, password, hashed):
+        return self._submit(self._verify, password, hashed)
+
+    @staticmethod
+    def _verify(password, hashed):
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed):
+        return hash_cost(hashed) != self.rounds
+
+    def rehash_in_background(self, password, on_done):
+        """Hash password at the configured cost and pass the result to on_done
+
+        Best effort: skipped when the pool is saturated, since the next login
+        will try again. Inline mode has no background, so it is skipped too.
+        """
+        def work():
+            on_done(self._hash(password))
+        self._submit(work, wait=False)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+hasher = PasswordHasher()
@@ -0,0 +1,40 @@
+"""Partially loaded models
+
+A finder given fields=(...) asks the database for those fields only and
+returns a model hydrated from them. Reading any other model field on such an
+object raises FieldNotLoaded instead of quietly returning a default, so a
+projection that is too narrow fails loudly in development.
+"""
+
+class FieldNotLoaded(AttributeError):
+    """Raised when reading a model field the query's projection left out"""
+
+class Projectable:
+    """Mixin for models that may be hydrated from a projected document
+
+    FIELDS names every persisted field besides _id. Loaded fields are plain
+    instance attributes, so __getattr__ only runs for the missing ones.
+    """
+    FIELDS = ()
+
+    def __getattr__(self, name):
+        if name in type(self).FIELDS:
+            raise FieldNotLoaded(f"{type(self).__name__}.{name} was not loaded by the query's projection")
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+def mongo_projection(fields):
+    """The find() projection for fields, or None to load whole documents"""
+    if fields is None:
+        return None
+    # Listing _id keeps an empty field list from meaning "everything"
+    projection = {'_id': 1}
+    projection.update(dict.fromkeys(fields, 1))
+    return projection
+
+def hydrate(cls, document, fields):
+    """A cls instance carrying only _id and the projected fields of document"""
+    model = object.__new__(cls)
+    model._id = document['_id']
+    for field in fields:
+        setattr(model, field, document.get(field))
+    return model
@@ -0,0 +1,549 @@
+"""Per-query-shape statistics and the slow-query log
+
+Every find, find_one, aggregate, insert_one, update_one and delete_one is
+timed: on MongoDB through the driver's command monitoring (QueryMonitor), in
+memory through InstrumentedCollection, which MockDatabase puts in front of each
+MockCollection. Queries are grouped by shape, the filter with its values
+replaced by '?', so Delivery.find_by_date_and_delivery_boy for any day and
+delivery boy is one entry. Each shape keeps its count, p50/p99 latency and the
+documents examined against those returned; a query outgrowing its index shows
+up as a rising examined/returned ratio.
+
+Queries slower than SLOW_QUERY_MS go to the slow-query log with the model
+method that issued them, or the route for queries issued from a view such as
+the report pipelines.
+"""
+
+from collections import OrderedDict, deque
+from datetime import datetime
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from pymongo.monitoring import CommandListener
+from src.database.metrics import current_request
+
+# Queries taking at least this many milliseconds are logged; 0 disables the log
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '100'))
+# Most recent slow queries kept for /api/metrics/queries
+SLOW_QUERY_LOG_SIZE = int(os.getenv('SLOW_QUERY_LOG_SIZE', '100'))
+# Most recent durations kept per shape for its percentiles
+QUERY_STATS_SAMPLES = int(os.getenv('QUERY_STATS_SAMPLES', '512'))
+# Shapes past this many are pooled per collection and operation
+QUERY_STATS_MAX_SHAPES = int(os.getenv('QUERY_STATS_MAX_SHAPES', '1000'))
+# MongoDB does not report documents examined per command; a slow shape is
+# explain()ed at most once per this many seconds to learn it. 0 disables
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv('SLOW_QUERY_EXPLAIN_INTERVAL', '60'))
+
+OTHER_SHAPES = '<other shapes>'
+
+logger = logging.getLogger(__name__)
+
+def _shape(value):
+    if isinstance(value, dict):
+        shaped = {}
+        for key, item in value.items():
+            if key in ('$and', '$or', '$nor') and isinstance(item, (list, tuple)):
+                shaped[key] = [_shape(clause) for clause in item]
+            else:
+                shaped[key] = _shape(item)
+        return shaped
+    if isinstance(value, (list, tuple, set, frozenset)):
+        # $in lists and the like vary in length between calls
+        return ['?']
+    return '?'
+
+def _dumps(value, sort_keys=True):
+    return json.dumps(value, sort_keys=sort_keys, separators=(',', ':'))
+
+def _structure(value):
+    # A hashable stand-in for _shape(value), much cheaper than rendering it
+    if isinstance(value, dict):
+        return tuple((key, _structure(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)) and value and isinstance(value[0], dict):
+        return tuple(_structure(item) for item in value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return ()
+    return None
+
+# Rendered shapes by structure; shapes repeat, so this stays small
+_rendered = {}
+
+def _cached(key, render):
+    shape = _rendered.get(key)
+    if shape is None:
+        shape = render()
+        if len(_rendered) < QUERY_STATS_MAX_SHAPES:
+            _rendered[key] = shape
+    return shape
+
+def _render_filter(query, sort):
+    shape = _dumps(_shape(query or {}))
+    if sort:
+        # The sort is part of the plan, and its key order matters
+        shape += ' sort ' + _dumps(dict(sort), sort_keys=False)
+    return shape
+
+def filter_shape(query, sort=None):
+    """A filter (and sort) with every value replaced by '?'"""
+    sort = tuple((field, direction) for field, direction in (sort.items() if isinstance(sort, dict) else sort or ()))
+    return _cached(('filter', _structure(query or {}), sort), lambda: _render_filter(query, sort))
+
+def write_shape(query, update):
+    return _cached(('write', _structure(query or {}), _structure(update)),
+                   lambda: f'{_render_filter(query, None)} {_dumps(_shape(update))}')
+
+def pipeline_shape(pipeline):
+    """Stage names of a pipeline; only the $match filters are spelled out"""
+    stages = []
+    for stage in pipeline or ():
+        operator = next(iter(stage))
+        if operator == '$match':
+            stages.append({'$match': _shape(stage[operator])})
+        elif operator == '$lookup':
+            stages.append(f"$lookup:{stage[operator].get('from')}")
+        else:
+            stages.append(operator)
+    return _dumps(stages)
+
+# Model-layer helpers that query on behalf of the model method calling them
+_HELPER_MODULES = ('src.models.identity_map', 'src.models.projection')
+
+def calling_method():
+    """The model method behind the current query, else the route, else None
+
+    Model methods appear as Class.method, other functions as module.function.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith(('src.models.', 'src.routes.')) and module not in _HELPER_MODULES:
+            name = frame.f_code.co_qualname.split('.<locals>')[0]
+            return name if '.' in name else f"{module.rsplit('.', 1)[-1]}.{name}"
+        frame = frame.f_back
+    return None
+
+class _ScanTally(threading.local):
+    """Documents the in-memory storage has looked at on this thread"""
+    examined = 0
+
+scan_tally = _ScanTally()
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class ShapeStats:
+    def __init__(self, caller):
+        self.caller = caller
+        self.count = 0
+        self.errors = 0
+        self.slow = 0
+        self.seconds = 0.0
+        self.durations = deque(maxlen=QUERY_STATS_SAMPLES)
+        self.returned = 0
+        # Only queries whose examined count is known enter the ratio
+        self.examined = 0
+        self.examined_returned = 0
+        self.examined_queries = 0
+
+    def add(self, seconds, returned, examined, error, slow):
+        self.count += 1
+        self.errors += error
+        self.slow += slow
+        self.seconds += seconds
+        self.durations.append(seconds)
+        self.returned += returned
+        if examined is not None:
+            self.add_examined(examined, returned)
+
+    def add_examined(self, examined, returned):
+        self.examined += examined
+        self.examined_returned += returned
+        self.examined_queries += 1
+
+    def to_dict(self):
+        ordered = sorted(self.durations)
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'slow': self.slow,
+            'total_ms': round(self.seconds * 1000, 3),
+            'p50_ms': round(_percentile(ordered, 0.5) * 1000, 3) if ordered else None,
+            'p99_ms': round(_percentile(ordered, 0.99) * 1000, 3) if ordered else None,
+            'docs_returned': self.returned,
+            'docs_examined': self.examined if self.examined_queries else None,
+            'examined_per_returned': round(self.examined / max(self.examined_returned, 1), 2)
+                                     if self.examined_queries else None,
+            'caller': self.caller
+        }
+
+class QueryStats:
+    """Statistics per (collection, operation, shape) and the recent slow queries"""
+    def __init__(self):
+        self._shapes = {}
+        self._slow = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+        self._lock = threading.Lock()
+
+    def _entry(self, key, caller):
+        # Call with the lock held
+        stats = self._shapes.get(key)
+        if stats is None:
+            if len(self._shapes) >= QUERY_STATS_MAX_SHAPES:
+                key = key[:2] + (OTHER_SHAPES,)
+                stats = self._shapes.get(key)
+            if stats is None:
+                stats = self._shapes[key] = ShapeStats(caller)
+        return stats
+
+    def record(self, collection, operation, shape, seconds, returned=0, examined=None, error=False):
+        """Add one query; returns whether it was slow
+
+        Call from the thread that issued the query, so its caller can be found.
+        """
+        key = (collection, operation, shape)
+        slow = bool(SLOW_QUERY_MS) and seconds * 1000 >= SLOW_QUERY_MS
+        # Walking the stack is only worth it for a new shape or a slow query
+        caller = calling_method() if slow or key not in self._shapes else None
+        with self._lock:
+            self._entry(key, caller).add(seconds, returned, examined, error, slow)
+            if slow:
+                request = current_request()
+                self._slow.append({
+                    'at': datetime.utcnow().isoformat(),
+                    'collection': collection,
+                    'operation': operation,
+                    'shape': shape,
+                    'duration_ms': round(seconds * 1000, 3),
+                    'docs_returned': returned,
+                    'docs_examined': examined,
+                    'caller': caller,
+                    'endpoint': request.endpoint if request is not None else None,
+                    'error': error
+                })
+        if slow:
+            logger.warning('Slow query (%.1f ms) %s.%s %s from %s: %d returned, %s examined',
+                           seconds * 1000, collection, operation, shape, caller or 'unknown',
+                           returned, 'unknown' if examined is None else examined)
+        return slow
+
+    def record_examined(self, collection, operation, shape, examined, returned):
+        """Add the documents examined by one query of a shape, learnt after the fact"""
+        with self._lock:
+            self._entry((collection, operation, shape), None).add_examined(examined, returned)
+
+    def snapshot(self, collection=None):
+        """Shape statistics, most total time first, and the slow queries, newest first"""
+        with self._lock:
+            shapes = [dict(collection=key[0], operation=key[1], shape=key[2], **stats.to_dict())
+                      for key, stats in self._shapes.items()
+                      if collection is None or key[0] == collection]
+            slow = [entry for entry in reversed(self._slow)
+                    if collection is None or entry['collection'] == collection]
+        shapes.sort(key=lambda entry: -entry['total_ms'])
+        return {'slow_query_ms': SLOW_QUERY_MS, 'shapes': shapes, 'slow_queries': slow}
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+            self._slow.clear()
+
+query_stats = QueryStats()
+
+class InstrumentedCursor:
+    """MockCursor proxy that records its query once it is exhausted or dropped
+
+    Only the time spent producing documents counts, not the time the caller
+    spends between them.
+    """
+    def __init__(self, cursor, collection, query):
+        self._cursor = cursor
+        self._collection = collection
+        self._query = query
+        self._sort = None
+        self._seconds = 0.0
+        self._returned = 0
+        self._examined = 0
+        self._open = False
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def sort(self, key_or_list, direction=1):
+        self._cursor.sort(key_or_list, direction)
+        self._sort = key_or_list if isinstance(key_or_list, (list, tuple)) else [(key_or_list, direction)]
+        return self
+
+    def skip(self, skip):
+        self._cursor.skip(skip)
+        return self
+
+    def limit(self, limit):
+        self._cursor.limit(limit)
+        return self
+
+    def batch_size(self, batch_size):
+        self._cursor.batch_size(batch_size)
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self._open = True
+        examined = scan_tally.examined
+        started = time.perf_counter()
+        try:
+            document = next(self._cursor)
+        except StopIteration:
+            self._finish(started, examined)
+            raise
+        except Exception:
+            self._finish(started, examined, error=True)
+            raise
+        self._seconds += time.perf_counter() - started
+        self._examined += scan_tally.examined - examined
+        self._returned += 1
+        return document
+
+    def _finish(self, started, examined, error=False):
+        self._seconds += time.perf_counter() - started
+        self._examined += scan_tally.examined - examined
+        self._record(error)
+
+    def _record(self, error=False):
+        if self._open:
+            self._open = False
+            query_stats.record(self._collection, 'find', filter_shape(self._query, self._sort),
+                               self._seconds, self._returned, self._examined, error)
+
+    def __del__(self):
+        # A cursor abandoned before its end still counts
+        self._record()
+
+class InstrumentedCollection:
+    """MockCollection proxy timing every MockCollection call into query_stats
+
+    Operations and shapes are named as describe_command names the MongoDB
+    commands, so both backends report a workload alike.
+    """
+    def __init__(self, collection):
+        self._collection = collection
+        self.name = collection.name
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def _timed(self, operation, shape, call, returned, scans=True):
+        examined = scan_tally.examined
+        started = time.perf_counter()
+        try:
+            result = call()
+        except Exception:
+            query_stats.record(self.name, operation, shape, time.perf_counter() - started,
+                               examined=scan_tally.examined - examined if scans else None, error=True)
+            raise
+        query_stats.record(self.name, operation, shape, time.perf_counter() - started,
+                           returned(result), scan_tally.examined - examined if scans else None)
+        return result
+
+    def find_one(self, query=None, projection=None):
+        return self._timed('find_one', filter_shape(query),
+                           lambda: self._collection.find_one(query, projection),
+                           lambda document: int(document is not None))
+
+    def find(self, query=None, projection=None):
+        return InstrumentedCursor(self._collection.find(query, projection), self.name, query)
+
+    def aggregate(self, pipeline):
+        return self._timed('aggregate', pipeline_shape(pipeline),
+                           lambda: self._collection.aggregate(pipeline), len)
+
+    def insert_one(self, document):
+        return self._timed('insert_one', '-', lambda: self._collection.insert_one(document),
+                           lambda result: 1, scans=False)
+
+    def insert_many(self, documents, ordered=True):
+        documents = list(documents)
+        operation = 'insert_one' if len(documents) == 1 else 'insert_many'
+        return self._timed(operation, '-', lambda: self._collection.insert_many(documents, ordered),
+                           lambda result: len(result.inserted_ids), scans=False)
+
+    def bulk_write(self, requests, ordered=True):
+        return self._timed('bulk_write', '-', lambda: self._collection.bulk_write(requests, ordered),
+                           lambda result: (result.inserted_count + result.matched_count
+                                           + result.deleted_count + result.upserted_count))
+
+    def update_one(self, query, update, upsert=False):
+        return self._timed('update_one', write_shape(query, update),
+                           lambda: self._collection.update_one(query, update, upsert),
+                           lambda result: result.matched_count)
+
+    def find_one_and_update(self, query, update, upsert=False, return_document=False):
+        return self._timed('find_one_and_update', write_shape(query, update),
+                           lambda: self._collection.find_one_and_update(query, update, upsert, return_document),
+                           lambda document: int(document is not None))
+
+    def delete_one(self, query):
+        return self._timed('delete_one', filter_shape(query),
+                           lambda: self._collection.delete_one(query),
+                           lambda result: result.deleted_count)
+
+def describe_command(name, command):
+    """(operation, shape) of a MongoDB command, named after the collection method that sends it"""
+    if name == 'find':
+        single = command.get('limit') == 1 and command.get('singleBatch')
+        return 'find_one' if single else 'find', filter_shape(command.get('filter'), command.get('sort'))
+    if name == 'aggregate':
+        return 'aggregate', pipeline_shape(command.get('pipeline'))
+    if name == 'insert':
+        return 'insert_one' if len(command.get('documents', ())) == 1 else 'insert_many', '-'
+    if name == 'findAndModify':
+        return 'find_one_and_update', write_shape(command.get('query'), command.get('update'))
+    statements = command.get('updates' if name == 'update' else 'deletes', ())
+    if len(statements) != 1:
+        return 'bulk_write', '-'
+    statement = statements[0]
+    if name == 'update':
+        return ('update_many' if statement.get('multi') else 'update_one',
+                write_shape(statement.get('q'), statement.get('u')))
+    return 'delete_one' if statement.get('limit') == 1 else 'delete_many', filter_shape(statement.get('q'))
+
+def _returned(reply):
+    if 'lastErrorObject' in reply:
+        return reply['lastErrorObject'].get('n', 0)
+    return reply.get('n', 0)
+
+def _docs_examined(explain):
+    """The first totalDocsExamined in an explain result, searching depth first"""
+    if isinstance(explain, dict):
+        if 'totalDocsExamined' in explain:
+            return explain['totalDocsExamined']
+        values = explain.values()
+    elif isinstance(explain, list):
+        values = explain
+    else:
+        return None
+    for value in values:
+        examined = _docs_examined(value)
+        if examined is not None:
+            return examined
+    return None
+
+# Keys of a sent command that explain does not accept
+_NOT_EXPLAINABLE = ('lsid', 'txnNumber', 'autocommit', 'startTransaction', 'writeConcern')
+# Cursors whose getMores are still awaited; the oldest are recorded as they are
+MAX_OPEN_CURSORS = 1000
+
+class QueryMonitor(CommandListener):
+    """Feeds query_stats from MongoDB's command monitoring
+
+    A find or aggregate is recorded once its cursor is exhausted or killed,
+    with the time and documents of all its getMores. attach() a client to
+    have slow shapes explained for their documents examined.
+    """
+    def __init__(self):
+        self._pending = {}
+        self._cursors = OrderedDict()
+        self._explained = {}
+        self._client = None
+        self._lock = threading.Lock()
+
+    def attach(self, client):
+        self._client = client
+
+    def started(self, event):
+        name, command = event.command_name, event.command
+        key = (event.connection_id, event.request_id)
+        if name == 'getMore':
+            self._pending[key] = command.get('getMore')
+        elif name == 'killCursors':
+            for cursor_id in command.get('cursors', ()):
+                with self._lock:
+                    cursor = self._cursors.pop(cursor_id, None)
+                if cursor is not None:
+                    self._finish(*cursor)
+        elif name in ('find', 'aggregate', 'insert', 'update', 'delete', 'findAndModify'):
+            operation, shape = describe_command(name, command)
+            self._pending[key] = (command.get(name), operation, shape, event.database_name, command)
+
+    def succeeded(self, event):
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        seconds, reply = event.duration_micros / 1e6, event.reply
+        if not isinstance(pending, tuple):
+            # A getMore, continuing the cursor its find or aggregate opened
+            with self._lock:
+                cursor = self._cursors.pop(pending, None)
+            if cursor is not None:
+                cursor[5] += seconds
+                cursor[6] += len(reply.get('cursor', {}).get('nextBatch', ()))
+                self._open_or_finish(reply.get('cursor', {}).get('id'), cursor)
+            return
+
+        collection, operation, shape, database, command = pending
+        if 'cursor' in reply:
+            cursor = [collection, operation, shape, database, command, seconds,
+                      len(reply['cursor'].get('firstBatch', ()))]
+            self._open_or_finish(reply['cursor'].get('id'), cursor)
+        else:
+            self._finish(collection, operation, shape, database, command, seconds, _returned(reply))
+
+    def failed(self, event):
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        seconds = event.duration_micros / 1e6
+        if not isinstance(pending, tuple):
+            with self._lock:
+                cursor = self._cursors.pop(pending, None)
+            if cursor is not None:
+                cursor[5] += seconds
+                self._finish(*cursor, error=True)
+            return
+        self._finish(*pending, seconds, 0, error=True)
+
+    def _open_or_finish(self, cursor_id, cursor):
+        if not cursor_id:
+            self._finish(*cursor)
+            return
+        evicted = None
+        with self._lock:
+            self._cursors[cursor_id] = cursor
+            if len(self._cursors) > MAX_OPEN_CURSORS:
+                evicted = self._cursors.popitem(last=False)[1]
+        if evicted is not None:
+            self._finish(*evicted)
+
+    def _finish(self, collection, operation, shape, database, command, seconds, returned, error=False):
+        slow = query_stats.record(collection, operation, shape, seconds, returned, error=error)
+        if slow and not error:
+            self._explain(collection, operation, shape, database, command, returned)
+
+    def _explain(self, collection, operation, shape, database, command, returned):
+        if self._client is None or not SLOW_QUERY_EXPLAIN_INTERVAL or operation == 'bulk_write':
+            return
+        key, now = (collection, operation, shape), time.monotonic()
+        with self._lock:
+            if now - self._explained.get(key, -SLOW_QUERY_EXPLAIN_INTERVAL) < SLOW_QUERY_EXPLAIN_INTERVAL:
+                return
+            self._explained[key] = now
+        explained = {name: value for name, value in command.items()
+                     if not name.startswith('$') and name not in _NOT_EXPLAINABLE}
+        # Off the issuing thread, which is waiting on its own results
+        threading.Thread(target=self._run_explain, args=(key, database, explained, returned),
+                         name='slow-query-explain', daemon=True).start()
+
+    def _run_explain(self, key, database, command, returned):
+        try:
+            explain = self._client[database].command({'explain': command, 'verbosity': 'executionStats'})
+        except Exception as e:
+            logger.info('Could not explain slow %s.%s: %s', key[0], key[1], e)
+            return
+        examined = _docs_examined(explain)
+        if examined is not None:
+            query_stats.record_examined(*key, examined, returned)
+
+query_monitor = QueryMonitor()
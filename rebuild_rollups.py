@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Daily rollup rebuild script for Milk Delivery App
+Recomputes the daily_rollups collection from the deliveries collection.
+Run it once after upgrading to backfill the rollups, or any time they may
+have drifted. Stop the app first so no deliveries are written meanwhile.
+"""
+
+import sys
+import os
+import time
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from src.database.config import db_instance
+from src.models import rollup
+
+def rebuild_rollups():
+    """Rebuild every daily rollup from the raw deliveries"""
+    print("Rebuilding daily delivery rollups...")
+    
+    db = db_instance.connect(require_mongo=True)
+    
+    if db is None:
+        print("❌ MongoDB not available; nothing was written.")
+        return 1
+    
+    started = time.time()
+    written = rollup.rebuild()
+    print(f"✅ Wrote {written} daily rollups in {time.time() - started:.2f}s")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(rebuild_rollups())
@@ -1,21 +1,199 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from datetime import datetime, date
+from flask import Blueprint, current_app, request, jsonify, make_response
+from flask_jwt_extended import jwt_required
+from functools import wraps
+from datetime import datetime, date, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
 from src.models.user import User
 from src.models.customer import Customer
 from src.models.delivery import Delivery
+from src.database.cache import report_cache
 from src.database.config import db_instance
+from src.models.rollup import rollup_stats_group
+from src.routes.auth import current_role
 
 reports_bp = Blueprint('reports', __name__)
 
+EMPTY_STATS = {
+    'total_deliveries': 0,
+    'delivered_count': 0,
+    'pending_count': 0,
+    'issue_count': 0,
+    'total_quantity': 0
+}
+
+def stats_from_group(group):
+    return {
+        'total_deliveries': group['total_deliveries'],
+        'delivered_count': group['delivered_count'],
+        'pending_count': group['pending_count'],
+        'issue_count': group['issue_count'],
+        'total_quantity': group['total_quantity']
+    }
+
 def admin_required():
     """Check if current user is admin"""
-    current_user_id = get_jwt_identity()
-    current_user = User.find_by_id(current_user_id)
-    return current_user and current_user.role == 'admin'
+    return current_role() == 'admin'
+
+def cached_report(scopes_for):
+    """Serve a report from report_cache and answer If-None-Match with 304
+    
+    scopes_for(**view_args) lists the cache scopes the report depends on; the
+    model writes bump them (see Delivery._report_scopes). Only successful
+    responses are cached, and they carry a strong ETag of their body.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**view_args):
+            if not admin_required():
+                return jsonify({'error': 'Admin access required'}), 403
+            try:
+                scopes = scopes_for(**view_args)
+            except (ValueError, InvalidId):
+                # Let the view report the bad parameter
+                return view(**view_args)
+            
+            key = (request.endpoint, tuple(sorted(view_args.items())),
+                   tuple(sorted(request.args.items(multi=True))))
+            cached = report_cache.get(key)
+            if cached is None:
+                # Taken before computing, so a concurrent write leaves the entry stale
+                generations = report_cache.generations(scopes)
+                response = make_response(view(**view_args))
+                if response.status_code != 200:
+                    return response
+                response.add_etag()
+                cached = (response.get_data(), response.mimetype, response.get_etag()[0])
+                report_cache.set(key, scopes, generations, cached)
+            
+            body, mimetype, etag = cached
+            response = current_app.response_class(body, mimetype=mimetype)
+            response.set_etag(etag)
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+# Queries and response bodies of the reports, shared with their coroutine
+# versions in async_routes so both entry points answer alike. args is the
+# request's query string arguments.
+
+def date_range(args):
+    """$gte/$lte bounds from the optional start_date and end_date, or None"""
+    start_date = args.get('start_date')
+    end_date = args.get('end_date')
+    if start_date and end_date:
+        start, end = _parse_date(start_date), _parse_date(end_date)
+        if end < start:
+            raise ValueError('end_date is before start_date')
+        return {'$gte': start, '$lte': end}
+    return None
+
+# A longer range depends on ('all',) alone, so a request cannot make a cache
+# entry track one scope per day of an arbitrarily wide range
+MAX_SCOPED_DAYS = 366
+
+def summary_scopes(args):
+    bounds = date_range(args)
+    if bounds is None:
+        return [('all',)]
+    start, end = bounds['$gte'], bounds['$lte']
+    days = (end - start).days + 1
+    if days > MAX_SCOPED_DAYS:
+        return [('all',)]
+    return [('date', start + timedelta(days=offset)) for offset in range(days)]
+
+def summary_pipeline(args):
+    query = {}
+    bounds = date_range(args)
+    if bounds:
+        query['date'] = bounds
+    # Add up the daily rollups: one document per day and delivery boy
+    return [{'$match': query}, rollup_stats_group(None)]
+
+def summary_response(result):
+    return stats_from_group(result[0]) if result else dict(EMPTY_STATS)
+
+CUSTOMER_DELIVERY_FIELDS = {'_id': 0, 'delivery_date': 1, 'status': 1, 'quantity': 1, 'notes': 1, 'timestamp': 1}
+
+def customer_deliveries_query(customer_id, args):
+    query = {'customer_id': customer_id}
+    bounds = date_range(args)
+    if bounds:
+        query['delivery_date'] = bounds
+    return query
+
+def customer_report_response(customer, documents):
+    return {
+        'customer': customer.to_dict(),
+        'deliveries': [{
+            'date': delivery_data['delivery_date'].isoformat(),
+            'status': delivery_data['status'],
+            'quantity': delivery_data['quantity'],
+            'notes': delivery_data.get('notes', ''),
+            'timestamp': delivery_data['timestamp'].isoformat()
+        } for delivery_data in documents]
+    }
+
+def delivery_boy_pipeline(delivery_boy_id, args):
+    query = {'delivery_boy_id': delivery_boy_id}
+    bounds = date_range(args)
+    if bounds:
+        query['date'] = bounds
+    # Aggregate delivery boy statistics from the daily rollups
+    return [{'$match': query}, rollup_stats_group(None)]
+
+def delivery_boy_report_response(delivery_boy, result):
+    return {
+        'delivery_boy': delivery_boy.to_dict(),
+        'statistics': stats_from_group(result[0]) if result else dict(EMPTY_STATS)
+    }
+
+def daily_pipeline(query_date):
+    # The day's rollups hold one document per delivery boy: $facet adds them
+    # up and lists them together and $lookup joins the users
+    return [
+        {'$match': {'date': query_date, 'total_deliveries': {'$gt': 0}}},
+        {
+            '$facet': {
+                'overall': [rollup_stats_group(None)],
+                'delivery_boys': [
+                    rollup_stats_group('$delivery_boy_id'),
+                    {
+                        '$lookup': {
+                            'from': 'users',
+                            'localField': '_id',
+                            'foreignField': '_id',
+                            'as': 'delivery_boy'
+                        }
+                    },
+                    {'$unwind': '$delivery_boy'},
+                    {'$project': {'delivery_boy.password': 0}}
+                ]
+            }
+        }
+    ]
+
+def daily_report_response(report_date, result):
+    facets = result[0] if result else {'overall': [], 'delivery_boys': []}
+    delivery_boys = []
+    for db_result in facets['delivery_boys']:
+        delivery_boy = User._from_document(db_result['delivery_boy'], User.PUBLIC_FIELDS)
+        delivery_boys.append({
+            'delivery_boy': delivery_boy.to_dict(),
+            'statistics': stats_from_group(db_result)
+        })
+    return {
+        'date': report_date,
+        'overall_statistics': stats_from_group(facets['overall'][0]) if facets['overall'] else dict(EMPTY_STATS),
+        'delivery_boys': delivery_boys
+    }
 
 @reports_bp.route('/summary', methods=['GET'])
 @jwt_required()
+@cached_report(lambda: summary_scopes(request.args))
 def get_delivery_summary():
     try:
         if not admin_required():
@@ -23,71 +201,19 @@ def get_delivery_summary():
         
         db = db_instance.get_db()
         if db is None:
-            return jsonify({
-                'total_deliveries': 0,
-                'delivered_count': 0,
-                'pending_count': 0,
-                'issue_count': 0,
-                'total_quantity': 0
-            }), 200
+            return jsonify(EMPTY_STATS), 200
         
-        # Get date range from query parameters (optional)
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        
-        # Build query
-        query = {}
-        if start_date and end_date:
-            start = datetime.strptime(start_date, '%Y-%m-%d').date()
-            end = datetime.strptime(end_date, '%Y-%m-%d').date()
-            query['delivery_date'] = {'$gte': start, '$lte': end}
-        
-        # Aggregate delivery statistics
-        pipeline = [
-            {'$match': query},
-            {
-                '$group': {
-                    '_id': None,
-                    'total_deliveries': {'$sum': 1},
-                    'delivered_count': {
-                        '$sum': {'$cond': [{'$eq': ['$status', 'Delivered']}, 1, 0]}
-                    },
-                    'pending_count': {
-                        '$sum': {'$cond': [{'$eq': ['$status', 'Pending']}, 1, 0]}
-                    },
-                    'issue_count': {
-                        '$sum': {'$cond': [{'$eq': ['$status', 'Issue']}, 1, 0]}
-                    },
-                    'total_quantity': {'$sum': '$quantity'}
-                }
-            }
-        ]
-        
-        result = list(db.deliveries.aggregate(pipeline))
-        
-        if result:
-            summary = result[0]
-            return jsonify({
-                'total_deliveries': summary['total_deliveries'],
-                'delivered_count': summary['delivered_count'],
-                'pending_count': summary['pending_count'],
-                'issue_count': summary['issue_count'],
-                'total_quantity': summary['total_quantity']
-            }), 200
-        else:
-            return jsonify({
-                'total_deliveries': 0,
-                'delivered_count': 0,
-                'pending_count': 0,
-                'issue_count': 0,
-                'total_quantity': 0
-            }), 200
+        result = list(db.daily_rollups.aggregate(summary_pipeline(request.args)))
+        return jsonify(summary_response(result)), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @reports_bp.route('/customer/<customer_id>', methods=['GET'])
 @jwt_required()
+@cached_report(lambda customer_id: [('customer', ObjectId(customer_id))])
 def get_customer_report(customer_id):
     try:
         if not admin_required():
@@ -98,118 +224,47 @@ def get_customer_report(customer_id):
         if not customer:
             return jsonify({'error': 'Customer not found'}), 404
         
-        # Get date range from query parameters (optional)
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        
         db = db_instance.get_db()
         if db is None:
             return jsonify([]), 200
         
-        # Build query
-        query = {'customer_id': customer._id}
-        if start_date and end_date:
-            start = datetime.strptime(start_date, '%Y-%m-%d').date()
-            end = datetime.strptime(end_date, '%Y-%m-%d').date()
-            query['delivery_date'] = {'$gte': start, '$lte': end}
-        
-        # Get customer deliveries
-        deliveries = []
-        for delivery_data in db.deliveries.find(query).sort('delivery_date', -1):
-            deliveries.append({
-                'date': delivery_data['delivery_date'].isoformat(),
-                'status': delivery_data['status'],
-                'quantity': delivery_data['quantity'],
-                'notes': delivery_data.get('notes', ''),
-                'timestamp': delivery_data['timestamp'].isoformat()
-            })
-        
-        return jsonify({
-            'customer': customer.to_dict(),
-            'deliveries': deliveries
-        }), 200
+        query = customer_deliveries_query(customer._id, request.args)
+        documents = db.deliveries.find(query, CUSTOMER_DELIVERY_FIELDS).sort('delivery_date', -1)
+        return jsonify(customer_report_response(customer, documents)), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @reports_bp.route('/delivery-boy/<delivery_boy_id>', methods=['GET'])
 @jwt_required()
+@cached_report(lambda delivery_boy_id: [('delivery_boy', ObjectId(delivery_boy_id))])
 def get_delivery_boy_report(delivery_boy_id):
     try:
         if not admin_required():
             return jsonify({'error': 'Admin access required'}), 403
         
         # Validate delivery boy exists
-        delivery_boy = User.find_by_id(delivery_boy_id)
+        delivery_boy = User.find_by_id(delivery_boy_id, User.PUBLIC_FIELDS)
         if not delivery_boy or delivery_boy.role != 'delivery_boy':
             return jsonify({'error': 'Delivery boy not found'}), 404
         
-        # Get date range from query parameters (optional)
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        
         db = db_instance.get_db()
         if db is None:
             return jsonify([]), 200
         
-        # Build query
-        query = {'delivery_boy_id': delivery_boy._id}
-        if start_date and end_date:
-            start = datetime.strptime(start_date, '%Y-%m-%d').date()
-            end = datetime.strptime(end_date, '%Y-%m-%d').date()
-            query['delivery_date'] = {'$gte': start, '$lte': end}
-        
-        # Aggregate delivery boy statistics
-        pipeline = [
-            {'$match': query},
-            {
-                '$group': {
-                    '_id': None,
-                    'total_deliveries': {'$sum': 1},
-                    'delivered_count': {
-                        '$sum': {'$cond': [{'$eq': ['$status', 'Delivered']}, 1, 0]}
-                    },
-                    'pending_count': {
-                        '$sum': {'$cond': [{'$eq': ['$status', 'Pending']}, 1, 0]}
-                    },
-                    'issue_count': {
-                        '$sum': {'$cond': [{'$eq': ['$status', 'Issue']}, 1, 0]}
-                    },
-                    'total_quantity': {'$sum': '$quantity'}
-                }
-            }
-        ]
-        
-        result = list(db.deliveries.aggregate(pipeline))
-        
-        if result:
-            summary = result[0]
-            stats = {
-                'total_deliveries': summary['total_deliveries'],
-                'delivered_count': summary['delivered_count'],
-                'pending_count': summary['pending_count'],
-                'issue_count': summary['issue_count'],
-                'total_quantity': summary['total_quantity']
-            }
-        else:
-            stats = {
-                'total_deliveries': 0,
-                'delivered_count': 0,
-                'pending_count': 0,
-                'issue_count': 0,
-                'total_quantity': 0
-            }
-        
-        return jsonify({
-            'delivery_boy': delivery_boy.to_dict(),
-            'statistics': stats
-        }), 200
+        result = list(db.daily_rollups.aggregate(delivery_boy_pipeline(delivery_boy._id, request.args)))
+        return jsonify(delivery_boy_report_response(delivery_boy, result)), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @reports_bp.route('/daily/<report_date>', methods=['GET'])
 @jwt_required()
+@cached_report(lambda report_date: [('date', _parse_date(report_date))])
 def get_daily_report(report_date):
     try:
         if not admin_required():
@@ -217,103 +272,18 @@ def get_daily_report(report_date):
         
         db = db_instance.get_db()
         if db is None:
-            return jsonify({
-                'date': report_date,
-                'total_deliveries': 0,
-                'delivered_count': 0,
-                'pending_count': 0,
-                'issue_count': 0,
-                'total_quantity': 0,
-                'delivery_boys': []
-            }), 200
-        
-        query_date = datetime.strptime(report_date, '%Y-%m-%d').date()
-        
-        # Aggregate daily statistics
-        pipeline = [
-            {'$match': {'delivery_date': query_date}},
-            {
-                '$group': {
-                    '_id': None,
-                    'total_deliveries': {'$sum': 1},
-                    'delivered_count': {
-                        '$sum': {'$cond': [{'$eq': ['$status', 'Delivered']}, 1, 0]}
-                    },
-                    'pending_count': {
-                        '$sum': {'$cond': [{'$eq': ['$status', 'Pending']}, 1, 0]}
-                    },
-                    'issue_count': {
-                        '$sum': {'$cond': [{'$eq': ['$status', 'Issue']}, 1, 0]}
-                    },
-                    'total_quantity': {'$sum': '$quantity'}
-                }
-            }
-        ]
-        
-        result = list(db.deliveries.aggregate(pipeline))
+            return jsonify(dict(EMPTY_STATS, date=report_date, delivery_boys=[])), 200
         
-        if result:
-            summary = result[0]
-            stats = {
-                'total_deliveries': summary['total_deliveries'],
-                'delivered_count': summary['delivered_count'],
-                'pending_count': summary['pending_count'],
-                'issue_count': summary['issue_count'],
-                'total_quantity': summary['total_quantity']
-            }
-        else:
-            stats = {
-                'total_deliveries': 0,
-                'delivered_count': 0,
-                'pending_count': 0,
-                'issue_count': 0,
-                'total_quantity': 0
-            }
-        
-        # Get delivery boy performance for the day
-        delivery_boy_pipeline = [
-            {'$match': {'delivery_date': query_date}},
-            {
-                '$group': {
-                    '_id': '$delivery_boy_id',
-                    'total_deliveries': {'$sum': 1},
-                    'delivered_count': {
-                        '$sum': {'$cond': [{'$eq': ['$status', 'Delivered']}, 1, 0]}
-                    },
-                    'pending_count': {
-                        '$sum': {'$cond': [{'$eq': ['$status', 'Pending']}, 1, 0]}
-                    },
-                    'issue_count': {
-                        '$sum': {'$cond': [{'$eq': ['$status', 'Issue']}, 1, 0]}
-                    },
-                    'total_quantity': {'$sum': '$quantity'}
-                }
-            }
-        ]
-        
-        delivery_boy_results = list(db.deliveries.aggregate(delivery_boy_pipeline))
-        
-        delivery_boys = []
-        for db_result in delivery_boy_results:
-            delivery_boy = User.find_by_id(str(db_result['_id']))
-            if delivery_boy:
-                delivery_boys.append({
-                    'delivery_boy': delivery_boy.to_dict(),
-                    'statistics': {
-                        'total_deliveries': db_result['total_deliveries'],
-                        'delivered_count': db_result['delivered_count'],
-                        'pending_count': db_result['pending_count'],
-                        'issue_count': db_result['issue_count'],
-                        'total_quantity': db_result['total_quantity']
-                    }
-                })
-        
-        return jsonify({
-            'date': report_date,
-            'overall_statistics': stats,
-            'delivery_boys': delivery_boys
-        }), 200
+        result = list(db.daily_rollups.aggregate(daily_pipeline(_parse_date(report_date))))
+        return jsonify(daily_report_response(report_date, result)), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@reports_bp.route('/cache-stats', methods=['GET'])
+@jwt_required()
+def get_cache_stats():
+    if not admin_required():
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    return jsonify(report_cache.stats()), 200
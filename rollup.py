@@ -0,0 +1,142 @@
+"""Per-day, per-delivery-boy delivery statistics
+
+The daily_rollups collection holds one document per (date, delivery_boy_id)
+with the same counters the reports return. Delivery writes keep it current by
+$inc-ing the difference between a delivery's old and new contribution, so a
+report over a date range reads one document per day and delivery boy instead
+of every delivery in the range.
+
+The delivery write and the rollup increment are separate operations; if the
+process dies between them, run src/rebuild_rollups.py to recompute the rollups.
+"""
+
+from src.database.config import db_instance
+
+STAT_FIELDS = ('total_deliveries', 'delivered_count', 'pending_count', 'issue_count', 'total_quantity')
+
+STATUS_FIELDS = {
+    'Delivered': 'delivered_count',
+    'Pending': 'pending_count',
+    'Issue': 'issue_count'
+}
+
+def delivery_stats_group(group_id):
+    """$group stage counting deliveries by status and summing quantities"""
+    return {
+        '$group': {
+            '_id': group_id,
+            'total_deliveries': {'$sum': 1},
+            'delivered_count': {
+                '$sum': {'$cond': [{'$eq': ['$status', 'Delivered']}, 1, 0]}
+            },
+            'pending_count': {
+                '$sum': {'$cond': [{'$eq': ['$status', 'Pending']}, 1, 0]}
+            },
+            'issue_count': {
+                '$sum': {'$cond': [{'$eq': ['$status', 'Issue']}, 1, 0]}
+            },
+            'total_quantity': {'$sum': '$quantity'}
+        }
+    }
+
+def rollup_stats_group(group_id):
+    """$group stage adding up daily_rollups documents"""
+    group = {'_id': group_id}
+    for field in STAT_FIELDS:
+        group[field] = {'$sum': f'${field}'}
+    return {'$group': group}
+
+def contribution(delivery_data):
+    """What one delivery document adds to its rollup"""
+    stats = dict.fromkeys(STAT_FIELDS, 0)
+    stats['total_deliveries'] = 1
+    if delivery_data.get('status') in STATUS_FIELDS:
+        stats[STATUS_FIELDS[delivery_data['status']]] = 1
+    stats['total_quantity'] = delivery_data.get('quantity') or 0
+    return stats
+
+def _key(delivery_data):
+    return {'date': delivery_data['delivery_date'], 'delivery_boy_id': delivery_data['delivery_boy_id']}
+
+def _increment(db, key, stats, sign):
+    amounts = {field: sign * value for field, value in stats.items() if value}
+    if amounts:
+        db.daily_rollups.update_one(key, {'$inc': amounts}, upsert=True)
+
+def apply_change(old_data, new_data):
+    """Move a delivery's contribution from old_data to new_data
+
+    Either side may be None, for an inserted or a removed delivery.
+    """
+    db = db_instance.get_db()
+    if db is None:
+        return
+
+    old_key = _key(old_data) if old_data else None
+    new_key = _key(new_data) if new_data else None
+    old_stats = contribution(old_data) if old_data else dict.fromkeys(STAT_FIELDS, 0)
+    new_stats = contribution(new_data) if new_data else dict.fromkeys(STAT_FIELDS, 0)
+
+    if old_key == new_key:
+        delta = {field: new_stats[field] - old_stats[field] for field in STAT_FIELDS}
+        _increment(db, new_key, delta, 1)
+        return
+    if old_key:
+        _increment(db, old_key, old_stats, -1)
+    if new_key:
+        _increment(db, new_key, new_stats, 1)
+
+def apply_changes(changes):
+    """Apply many (old_data, new_data) moves with one increment per rollup touched"""
+    db = db_instance.get_db()
+    if db is None:
+        return
+
+    totals = {}
+    for old_data, new_data in changes:
+        for delivery_data, sign in ((old_data, -1), (new_data, 1)):
+            if not delivery_data:
+                continue
+            key = (delivery_data['delivery_date'], delivery_data['delivery_boy_id'])
+            stats = totals.setdefault(key, dict.fromkeys(STAT_FIELDS, 0))
+            for field, value in contribution(delivery_data).items():
+                stats[field] += sign * value
+    for (delivery_date, delivery_boy_id), stats in totals.items():
+        _increment(db, {'date': delivery_date, 'delivery_boy_id': delivery_boy_id}, stats, 1)
+
+def apply_inserts(documents):
+    """Add many new deliveries with one increment per rollup they touch"""
+    apply_changes((None, delivery_data) for delivery_data in documents)
+
+def rebuild(dates=None, db=None):
+    """Recompute the rollups from the deliveries collection
+
+    Only the rollups of dates are recomputed when it is given, and db defaults
+    to the active database. Run while deliveries are not being written, or
+    increments made during the rebuild can be overwritten. Returns the number
+    of rollups written.
+    """
+    if db is None:
+        db = db_instance.get_db()
+    if db is None:
+        return 0
+
+    scope = {'date': {'$in': list(dates)}} if dates is not None else {}
+    pipeline = [delivery_stats_group({'date': '$delivery_date', 'delivery_boy_id': '$delivery_boy_id'})]
+    if dates is not None:
+        pipeline.insert(0, {'$match': {'delivery_date': scope['date']}})
+    written = set()
+    for group in db.deliveries.aggregate(pipeline):
+        key = group['_id']
+        db.daily_rollups.update_one(
+            {'date': key['date'], 'delivery_boy_id': key['delivery_boy_id']},
+            {'$set': {field: group[field] for field in STAT_FIELDS}},
+            upsert=True
+        )
+        written.add((key['date'], key['delivery_boy_id']))
+
+    # Drop rollups for days and delivery boys that no longer have deliveries
+    for rollup in list(db.daily_rollups.find(scope)):
+        if (rollup['date'], rollup['delivery_boy_id']) not in written:
+            db.daily_rollups.delete_one({'_id': rollup['_id']})
+    return len(written)
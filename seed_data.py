@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Synthetic data generator for Milk Delivery App
+Bulk-loads a depot of customers, delivery boys, their subscriptions and a
+history of daily deliveries with matching daily rollups, into MongoDB or the
+in-memory storage, whichever db_instance connects to.
+
+The documents, _ids included, follow from --seed, the scale and --end-date
+alone, so two runs with the same arguments load the same depot. Delivery _ids
+are the ones Subscription.materialize would give, so loading the depot again or
+materializing one of its days adds nothing twice.
+
+Every seeded user logs in with the password "seed-password"; the admin is
+seed_admin and the delivery boys are seed_boy001, seed_boy002, ...
+
+The default scale (10k customers, 100 delivery boys, two years) is several
+million deliveries: give the in-memory storage INMEMORY_STORAGE_MODE=columnar
+or a few GB of memory. The in-memory storage only outlives this script with
+INMEMORY_DATA_DIR set; src/bench_endpoints.py seeds in-process instead.
+
+Usage: python src/seed_data.py [--customers 10000] [--delivery-boys 100] [--days 730]
+                               [--seed 1] [--end-date YYYY-MM-DD]
+"""
+
+import argparse
+import calendar
+import os
+import random
+import struct
+import sys
+import time
+from datetime import date, datetime, timedelta
+from hashlib import sha1
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from src.database.cache import report_cache
+from src.database.config import MONGO_SERVER_SELECTION_TIMEOUT_MS, db_instance
+from src.models import rollup
+from src.models.passwords import hasher
+from src.models.subscription import ALL_WEEKDAYS, subscription_delivery_id
+
+SEED_PASSWORD = 'seed-password'
+ADMIN_USERNAME = 'seed_admin'
+BATCH_SIZE = 5000
+
+FIRST_NAMES = ('Aarav', 'Ananya', 'Arjun', 'Diya', 'Ishaan', 'Kavya', 'Meera', 'Nikhil', 'Priya',
+               'Rahul', 'Riya', 'Rohan', 'Sanjay', 'Sneha', 'Tara', 'Varun', 'Vikram', 'Zoya')
+LAST_NAMES = ('Bose', 'Das', 'Gupta', 'Iyer', 'Joshi', 'Kapoor', 'Khan', 'Menon', 'Nair',
+              'Patel', 'Rao', 'Reddy', 'Shah', 'Sharma', 'Singh', 'Verma')
+STREETS = ('MG Road', 'Park Street', 'Lake View', 'Station Road', 'Temple Street', 'Hill Road',
+           'Market Lane', 'Church Street', 'Canal Road', 'Garden Avenue')
+ISSUE_NOTES = ('Customer not at home', 'Gate locked', 'Short of stock', 'Address not found')
+
+# Share of past deliveries ending in each status; the rest stay Pending
+DELIVERED_SHARE = 0.93
+ISSUE_SHARE = 0.03
+
+def _object_id(rng, moment):
+    """ObjectId with moment as its timestamp and the rest drawn from rng"""
+    return ObjectId(struct.pack('>I', calendar.timegm(moment.timetuple())) + rng.randbytes(8))
+
+def rollup_id(delivery_date, delivery_boy_id):
+    """Deterministic _id for a seeded daily rollup, like subscription_delivery_id"""
+    digest = sha1(b'rollup' + delivery_boy_id.binary + delivery_date.isoformat().encode('ascii')).digest()
+    return ObjectId(digest[:12])
+
+class Depot:
+    """One synthetic depot; every document follows from the seed and the scale
+
+    Each kind of document, and each day of deliveries, draws from its own
+    random stream, so the result does not depend on the order they are
+    generated or loaded in.
+    """
+    def __init__(self, seed=1, customers=10000, delivery_boys=100, days=730, end_date=None):
+        self.seed = seed
+        self.customer_count = customers
+        self.delivery_boy_count = delivery_boys
+        self.days = days
+        self.end_date = end_date or date.today()
+        self.start_date = self.end_date - timedelta(days=days - 1)
+        # Everything but the deliveries was set up the evening before the first day
+        self.opened_at = datetime.combine(self.start_date - timedelta(days=1), datetime.min.time()) + timedelta(hours=18)
+
+    def _rng(self, *stream):
+        return random.Random(':'.join(str(part) for part in (self.seed,) + stream))
+
+    def users(self, password_hash):
+        rng = self._rng('users')
+        users = [{
+            '_id': _object_id(rng, self.opened_at),
+            'username': ADMIN_USERNAME,
+            'password': password_hash,
+            'role': 'admin',
+            'name': 'Seed Administrator',
+            'created_at': self.opened_at
+        }]
+        for number in range(1, self.delivery_boy_count + 1):
+            users.append({
+                '_id': _object_id(rng, self.opened_at),
+                'username': f'seed_boy{number:03d}',
+                'password': password_hash,
+                'role': 'delivery_boy',
+                'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                'created_at': self.opened_at
+            })
+        return users
+
+    def customers(self):
+        rng = self._rng('customers')
+        return [{
+            '_id': _object_id(rng, self.opened_at),
+            'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            'address': f'{rng.randint(1, 400)} {rng.choice(STREETS)}, Block {rng.choice("ABCDEFGH")}',
+            # 8xxxxxxxxx is not handed out by init_db or the UI, so these stay unique
+            'mobile': f'8{number:09d}',
+            'created_at': self.opened_at
+        } for number in range(self.customer_count)]
+
+    def subscriptions(self, customers, delivery_boys):
+        """One subscription per customer; a delivery boy serves a run of neighbouring customers"""
+        rng = self._rng('subscriptions')
+        subscriptions = []
+        for number, customer in enumerate(customers):
+            roll = rng.random()
+            if roll < 0.8:
+                weekdays = ALL_WEEKDAYS
+            elif roll < 0.95:
+                weekdays = [0, 1, 2, 3, 4]
+            else:
+                weekdays = [0, 2, 4]
+            pauses = []
+            if rng.random() < 0.1:
+                start = self.start_date + timedelta(days=rng.randrange(self.days))
+                pauses.append({'start': start, 'end': start + timedelta(days=rng.randint(2, 14))})
+            subscriptions.append({
+                '_id': _object_id(rng, self.opened_at),
+                'customer_id': customer['_id'],
+                'delivery_boy_id': delivery_boys[number * len(delivery_boys) // len(customers)]['_id'],
+                'quantity': rng.choice((1, 1, 1, 2, 2, 3)),
+                'weekdays': list(weekdays),
+                'pauses': pauses,
+                # Cancelled subscriptions stopped delivering 60 days before the end
+                'active': rng.random() < 0.97,
+                'created_at': self.opened_at
+            })
+        return subscriptions
+
+    def deliveries(self, subscriptions, delivery_date):
+        """The deliveries of one day; those of the last day are all still Pending"""
+        rng = self._rng('deliveries', delivery_date.isoformat())
+        cancelled_from = self.end_date - timedelta(days=60)
+        created_at = datetime.combine(delivery_date - timedelta(days=1), datetime.min.time()) + timedelta(hours=21)
+        deliveries = []
+        for subscription in subscriptions:
+            if delivery_date.weekday() not in subscription['weekdays']:
+                continue
+            if not subscription['active'] and delivery_date >= cancelled_from:
+                continue
+            if any(pause['start'] <= delivery_date <= pause['end'] for pause in subscription['pauses']):
+                continue
+
+            status, notes, timestamp, updated_by = 'Pending', '', created_at, None
+            roll = rng.random()
+            if delivery_date < self.end_date and roll < DELIVERED_SHARE + ISSUE_SHARE:
+                status = 'Delivered' if roll < DELIVERED_SHARE else 'Issue'
+                notes = rng.choice(ISSUE_NOTES) if status == 'Issue' else ''
+                timestamp = datetime.combine(delivery_date, datetime.min.time()) + \
+                    timedelta(hours=5, minutes=30 + rng.randrange(180))
+                updated_by = subscription['delivery_boy_id']
+            deliveries.append({
+                '_id': subscription_delivery_id(subscription['customer_id'], delivery_date),
+                'customer_id': subscription['customer_id'],
+                'delivery_boy_id': subscription['delivery_boy_id'],
+                'delivery_date': delivery_date,
+                'quantity': subscription['quantity'],
+                'status': status,
+                'notes': notes,
+                'photo_proof_url': '',
+                'timestamp': timestamp,
+                'updated_by': updated_by,
+                'created_at': created_at
+            })
+        return deliveries
+
+    @staticmethod
+    def rollups(delivery_date, deliveries):
+        """The daily_rollups documents for one day's deliveries"""
+        totals = {}
+        for delivery_data in deliveries:
+            stats = totals.setdefault(delivery_data['delivery_boy_id'], dict.fromkeys(rollup.STAT_FIELDS, 0))
+            for field, value in rollup.contribution(delivery_data).items():
+                stats[field] += value
+        return [dict({'_id': rollup_id(delivery_date, delivery_boy_id), 'date': delivery_date,
+                      'delivery_boy_id': delivery_boy_id}, **stats)
+                for delivery_boy_id, stats in totals.items()]
+
+def _insert(collection, documents, batch_size):
+    """Unordered insert_many in batches; documents already present are skipped. Returns how many were new"""
+    inserted = 0
+    for start in range(0, len(documents), batch_size):
+        try:
+            inserted += len(collection.insert_many(documents[start:start + batch_size], ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            inserted += e.details['nInserted']
+    return inserted
+
+def load(depot, batch_size=BATCH_SIZE, log=print):
+    """Insert the depot through db_instance; returns {collection: documents inserted}"""
+    db = db_instance.get_db()
+    if db is None:
+        raise RuntimeError('No database available')
+
+    counts = dict.fromkeys(('users', 'customers', 'subscriptions', 'deliveries', 'daily_rollups'), 0)
+    # One hash for everyone: hashing each user's password would dominate small loads
+    users = depot.users(hasher.hash(SEED_PASSWORD))
+    customers = depot.customers()
+    subscriptions = depot.subscriptions(customers, users[1:])
+    counts['users'] = _insert(db.users, users, batch_size)
+    counts['customers'] = _insert(db.customers, customers, batch_size)
+    counts['subscriptions'] = _insert(db.subscriptions, subscriptions, batch_size)
+
+    started = time.time()
+    for offset in range(depot.days):
+        delivery_date = depot.start_date + timedelta(days=offset)
+        deliveries = depot.deliveries(subscriptions, delivery_date)
+        counts['deliveries'] += _insert(db.deliveries, deliveries, batch_size)
+        counts['daily_rollups'] += _insert(db.daily_rollups, depot.rollups(delivery_date, deliveries), batch_size)
+        if log and (offset + 1) % 30 == 0:
+            log(f"  {offset + 1}/{depot.days} days, {counts['deliveries']} deliveries "
+                f"({time.time() - started:.0f}s)")
+
+    # Reports cached before the load would hide the new deliveries
+    report_cache.clear()
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description='Load a synthetic depot')
+    parser.add_argument('--customers', type=int, default=10000)
+    parser.add_argument('--delivery-boys', type=int, default=100)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--end-date', type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                        help='last day of deliveries (default: today)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    depot = Depot(args.seed, args.customers, args.delivery_boys, args.days, args.end_date)
+    print(f"Seeding {args.customers} customers, {args.delivery_boys} delivery boys and "
+          f"{depot.start_date} to {depot.end_date} of deliveries (seed {args.seed})...")
+
+    # A slow MongoDB start should not divert the seed into in-memory storage
+    db_instance.connect(wait=MONGO_SERVER_SELECTION_TIMEOUT_MS / 1000)
+    if db_instance.backend == 'memory' and not os.getenv('INMEMORY_DATA_DIR'):
+        print("⚠️  In-memory storage without INMEMORY_DATA_DIR: the data is gone when this script exits.")
+
+    started = time.time()
+    counts = load(depot, args.batch_size)
+    db_instance.close()
+    print(f"✅ Inserted {', '.join(f'{count} {name}' for name, count in counts.items())} "
+          f"in {time.time() - started:.1f}s")
+    print(f"Log in as {ADMIN_USERNAME} or seed_boy001..seed_boy{args.delivery_boys:03d} "
+          f"with password {SEED_PASSWORD}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+from datetime import datetime, date
+from hashlib import sha1
+from bson import ObjectId
+from src.database.config import db_instance
+from src.models.delivery import Delivery
+
+ALL_WEEKDAYS = [0, 1, 2, 3, 4, 5, 6]  # Monday is 0, as in date.weekday()
+
+def _as_date(value):
+    return value if isinstance(value, date) else datetime.strptime(value, '%Y-%m-%d').date()
+
+def subscription_delivery_id(customer_id, delivery_date):
+    """Deterministic _id for a customer's subscription delivery on a date
+    
+    Re-materializing a day therefore writes the same _ids again. The guard
+    against a second delivery, including one entered by hand, is the unique
+    (customer_id, delivery_date) index on deliveries.
+    """
+    digest = sha1(ObjectId(customer_id).binary + delivery_date.isoformat().encode('ascii')).digest()
+    return ObjectId(digest[:12])
+
+class Subscription:
+    def __init__(self, customer_id, delivery_boy_id, quantity, weekdays=None,
+                 pauses=None, active=True, _id=None):
+        self._id = _id or ObjectId()
+        self.customer_id = ObjectId(customer_id) if isinstance(customer_id, str) else customer_id
+        self.delivery_boy_id = ObjectId(delivery_boy_id) if isinstance(delivery_boy_id, str) else delivery_boy_id
+        self.quantity = quantity
+        self.weekdays = sorted(set(ALL_WEEKDAYS if weekdays is None else weekdays))
+        # Inclusive date ranges during which nothing is delivered
+        self.pauses = [{'start': _as_date(pause['start']), 'end': _as_date(pause['end'])}
+                       for pause in (pauses or [])]
+        self.active = active
+        self.created_at = datetime.utcnow()
+    
+    def to_dict(self):
+        return {
+            'id': str(self._id),
+            'customer_id': str(self.customer_id),
+            'delivery_boy_id': str(self.delivery_boy_id),
+            'quantity': self.quantity,
+            'weekdays': self.weekdays,
+            'pauses': [{'start': pause['start'].isoformat(), 'end': pause['end'].isoformat()}
+                       for pause in self.pauses],
+            'active': self.active,
+            'created_at': self.created_at.isoformat()
+        }
+    
+    def is_due(self, delivery_date):
+        if not self.active or delivery_date.weekday() not in self.weekdays:
+            return False
+        return not any(pause['start'] <= delivery_date <= pause['end'] for pause in self.pauses)
+    
+    def _to_document(self):
+        return {
+            '_id': self._id,
+            'customer_id': self.customer_id,
+            'delivery_boy_id': self.delivery_boy_id,
+            'quantity': self.quantity,
+            'weekdays': self.weekdays,
+            'pauses': self.pauses,
+            'active': self.active,
+            'created_at': self.created_at
+        }
+    
+    def save(self):
+        db = db_instance.get_db()
+        if db is None:
+            return None
+        
+        result = db.subscriptions.insert_one(self._to_document())
+        return result.inserted_id
+    
+    def update(self):
+        db = db_instance.get_db()
+        if db is None:
+            return False
+        
+        update_data = self._to_document()
+        del update_data['_id'], update_data['created_at']
+        
+        result = db.subscriptions.update_one(
+            {'_id': self._id},
+            {'$set': update_data}
+        )
+        return result.modified_count > 0
+    
+    @staticmethod
+    def _from_document(subscription_data):
+        subscription = Subscription(
+            customer_id=subscription_data['customer_id'],
+            delivery_boy_id=subscription_data['delivery_boy_id'],
+            quantity=subscription_data['quantity'],
+            weekdays=subscription_data.get('weekdays'),
+            pauses=subscription_data.get('pauses'),
+            active=subscription_data.get('active', True),
+            _id=subscription_data['_id']
+        )
+        subscription.created_at = subscription_data['created_at']
+        return subscription
+    
+    @staticmethod
+    def find_by_id(subscription_id):
+        db = db_instance.get_db()
+        if db is None:
+            return None
+        
+        subscription_data = db.subscriptions.find_one({'_id': ObjectId(subscription_id)})
+        if subscription_data:
+            return Subscription._from_document(subscription_data)
+        return None
+    
+    @staticmethod
+    def find_by_customer_id(customer_id):
+        db = db_instance.get_db()
+        if db is None:
+            return []
+        
+        return [Subscription._from_document(subscription_data)
+                for subscription_data in db.subscriptions.find({'customer_id': ObjectId(customer_id)})]
+    
+    @staticmethod
+    def get_all():
+        db = db_instance.get_db()
+        if db is None:
+            return []
+        
+        return [Subscription._from_document(subscription_data)
+                for subscription_data in db.subscriptions.find()]
+    
+    @staticmethod
+    def delete_by_id(subscription_id):
+        db = db_instance.get_db()
+        if db is None:
+            return False
+        
+        result = db.subscriptions.delete_one({'_id': ObjectId(subscription_id)})
+        return result.deleted_count > 0
+    
+    @staticmethod
+    def materialize(delivery_date, chunk_size=1000):
+        """Create the deliveries every active subscription owes on delivery_date
+        
+        Subscriptions are streamed from the database in chunks and each chunk
+        is written with one unordered insert_many. Safe to re-run: a customer
+        who already has a delivery that day, materialized or entered by hand,
+        trips the unique (customer_id, delivery_date) index and is counted as
+        skipped, not delivered twice.
+        """
+        delivery_date = _as_date(delivery_date)
+        summary = {'date': delivery_date.isoformat(), 'due': 0, 'created': 0, 'skipped': 0, 'failed': 0}
+        db = db_instance.get_db()
+        if db is None:
+            return summary
+        
+        def flush(deliveries):
+            for error in Delivery.save_many(deliveries, chunk_size):
+                if error is None:
+                    summary['created'] += 1
+                elif error['code'] == 11000:
+                    summary['skipped'] += 1
+                else:
+                    summary['failed'] += 1
+        
+        batch = []
+        for subscription_data in db.subscriptions.find({'active': True}).batch_size(chunk_size):
+            subscription = Subscription._from_document(subscription_data)
+            if not subscription.is_due(delivery_date):
+                continue
+            summary['due'] += 1
+            batch.append(Delivery(
+                customer_id=subscription.customer_id,
+                delivery_boy_id=subscription.delivery_boy_id,
+                delivery_date=delivery_date,
+                quantity=subscription.quantity,
+                _id=subscription_delivery_id(subscription.customer_id, delivery_date)
+            ))
+            if len(batch) >= chunk_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+        return summary
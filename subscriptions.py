@@ -0,0 +1,173 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required
+from datetime import date, datetime, timedelta
+from bson.errors import InvalidId
+import os
+from src.models.customer import Customer
+from src.models.subscription import Subscription, ALL_WEEKDAYS
+from src.models.user import User
+from src.routes.auth import current_role
+
+subscriptions_bp = Blueprint('subscriptions', __name__)
+
+MATERIALIZE_CHUNK_SIZE = int(os.getenv('MATERIALIZE_CHUNK_SIZE', '1000'))
+
+def _validate(data, partial=False):
+    """Return an error message for invalid subscription fields, else None"""
+    required = ('customer_id', 'delivery_boy_id', 'quantity')
+    if not partial:
+        missing = [field for field in required if not data.get(field)]
+        if missing:
+            return f"Missing required fields: {', '.join(missing)}"
+    
+    if 'quantity' in data:
+        if not isinstance(data['quantity'], (int, float)) or isinstance(data['quantity'], bool) \
+                or data['quantity'] <= 0:
+            return 'Quantity must be a positive number'
+    
+    if 'weekdays' in data:
+        weekdays = data['weekdays']
+        if not isinstance(weekdays, list) or any(day not in ALL_WEEKDAYS for day in weekdays):
+            return 'weekdays must be a list of numbers from 0 (Monday) to 6 (Sunday)'
+    
+    if 'pauses' in data:
+        if not isinstance(data['pauses'], list):
+            return 'pauses must be a list of {start, end} dates'
+        for pause in data['pauses']:
+            try:
+                start = datetime.strptime(pause['start'], '%Y-%m-%d').date()
+                end = datetime.strptime(pause['end'], '%Y-%m-%d').date()
+            except (KeyError, TypeError, ValueError):
+                return 'pauses must be a list of {start, end} dates'
+            if end < start:
+                return 'A pause must not end before it starts'
+    
+    if 'customer_id' in data and not Customer.find_by_id(data['customer_id'], ()):
+        return 'Customer not found'
+    if 'delivery_boy_id' in data:
+        delivery_boy = User.find_by_id(data['delivery_boy_id'], ('role',))
+        if not delivery_boy or delivery_boy.role != 'delivery_boy':
+            return 'Delivery boy not found'
+    return None
+
+@subscriptions_bp.route('/', methods=['GET'])
+@jwt_required()
+def get_subscriptions():
+    try:
+        if current_role() != 'admin':
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        customer_id = request.args.get('customer_id')
+        if customer_id:
+            subscriptions = Subscription.find_by_customer_id(customer_id)
+        else:
+            subscriptions = Subscription.get_all()
+        return jsonify([subscription.to_dict() for subscription in subscriptions]), 200
+        
+    except InvalidId as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@subscriptions_bp.route('/', methods=['POST'])
+@jwt_required()
+def create_subscription():
+    try:
+        if current_role() != 'admin':
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        data = request.get_json() or {}
+        error = _validate(data)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        subscription = Subscription(
+            customer_id=data['customer_id'],
+            delivery_boy_id=data['delivery_boy_id'],
+            quantity=data['quantity'],
+            weekdays=data.get('weekdays'),
+            pauses=data.get('pauses'),
+            active=data.get('active', True)
+        )
+        if not subscription.save():
+            return jsonify({'error': 'Failed to create subscription'}), 500
+        
+        return jsonify(subscription.to_dict()), 201
+        
+    except InvalidId as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@subscriptions_bp.route('/<subscription_id>', methods=['PUT'])
+@jwt_required()
+def update_subscription(subscription_id):
+    try:
+        if current_role() != 'admin':
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        subscription = Subscription.find_by_id(subscription_id)
+        if not subscription:
+            return jsonify({'error': 'Subscription not found'}), 404
+        
+        data = request.get_json() or {}
+        error = _validate(data, partial=True)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        updated = Subscription(
+            customer_id=data.get('customer_id', subscription.customer_id),
+            delivery_boy_id=data.get('delivery_boy_id', subscription.delivery_boy_id),
+            quantity=data.get('quantity', subscription.quantity),
+            weekdays=data.get('weekdays', subscription.weekdays),
+            pauses=data.get('pauses', subscription.pauses),
+            active=data.get('active', subscription.active),
+            _id=subscription._id
+        )
+        updated.created_at = subscription.created_at
+        updated.update()
+        
+        return jsonify(updated.to_dict()), 200
+        
+    except InvalidId as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@subscriptions_bp.route('/<subscription_id>', methods=['DELETE'])
+@jwt_required()
+def delete_subscription(subscription_id):
+    try:
+        if current_role() != 'admin':
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        if not Subscription.delete_by_id(subscription_id):
+            return jsonify({'error': 'Subscription not found'}), 404
+        
+        return jsonify({'message': 'Subscription deleted successfully'}), 200
+        
+    except InvalidId as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@subscriptions_bp.route('/materialize', methods=['POST'])
+@jwt_required()
+def materialize_subscriptions():
+    """Create the deliveries due on a date (tomorrow by default); safe to repeat"""
+    try:
+        if current_role() != 'admin':
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        data = request.get_json(silent=True) or {}
+        if data.get('date'):
+            delivery_date = datetime.strptime(data['date'], '%Y-%m-%d').date()
+        else:
+            delivery_date = date.today() + timedelta(days=1)
+        
+        return jsonify(Subscription.materialize(delivery_date, MATERIALIZE_CHUNK_SIZE)), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Columnar aggregation tests for Milk Delivery App
+Loads the same deliveries into document and columnar in-memory storage and
+checks that the vectorized $group path, with and without NumPy, returns what
+the document pipeline does.
+
+Usage: python -m unittest src/test_columnar_aggregation.py
+"""
+
+import os
+import random
+import sys
+import unittest
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from bson import ObjectId
+from src.database import columnar
+from src.database.config import InMemoryStorage, MockDatabase
+from src.models.rollup import delivery_stats_group
+
+START = date(2024, 5, 1)
+
+def deliveries(rng):
+    boys = [ObjectId() for _ in range(3)]
+    documents = []
+    for offset in range(40):
+        documents.append({
+            '_id': ObjectId(),
+            'customer_id': ObjectId(),
+            'delivery_boy_id': rng.choice(boys),
+            'delivery_date': START + timedelta(days=rng.randrange(5)),
+            'quantity': rng.choice([0.5, 1, 1.5, 2, 3]),
+            'status': rng.choice(['Pending', 'Delivered', 'Issue']),
+            'notes': '',
+            'photo_proof_url': '',
+            'timestamp': datetime(2024, 5, 1) + timedelta(minutes=offset),
+            'updated_by': None,
+            'created_at': datetime(2024, 5, 1)
+        })
+    return boys, documents
+
+PIPELINES = [
+    [delivery_stats_group(None)],
+    [delivery_stats_group('$status')],
+    [delivery_stats_group({'date': '$delivery_date', 'delivery_boy_id': '$delivery_boy_id'})],
+    [{'$match': {'delivery_date': {'$gte': START + timedelta(days=1), '$lt': START + timedelta(days=4)}}},
+     delivery_stats_group('$delivery_date'),
+     {'$sort': {'_id': 1}}],
+    [{'$match': {'status': 'Delivered'}}, delivery_stats_group('$delivery_boy_id')],
+    [{'$match': {'status': 'Missing'}}, delivery_stats_group(None)],
+    [{'$facet': {
+        'by_status': [delivery_stats_group('$status')],
+        'overall': [delivery_stats_group(None)]
+    }}],
+]
+
+# Shapes the columns do not answer, served by the document pipeline instead
+FALLBACK_PIPELINES = [
+    [{'$match': {'delivery_date': {'$in': [START, START + timedelta(days=3)]}}},
+     delivery_stats_group('$delivery_boy_id')],
+    [delivery_stats_group('$delivery_date'), {'$match': {'total_deliveries': {'$gt': 5}}}],
+]
+
+def canonical(result):
+    """Groups come back in no particular order; compare them sorted"""
+    if len(result) == 1 and '_id' not in result[0]:
+        return {name: canonical(branch) for name, branch in result[0].items()}
+    return sorted(result, key=repr)
+
+class ColumnarAggregationTest(unittest.TestCase):
+    def load(self, documents, columnar_mode):
+        db = MockDatabase(InMemoryStorage(columnar=columnar_mode))
+        db.deliveries.insert_many([dict(document) for document in documents])
+        return db
+
+    def assert_parity(self, boys, documents):
+        documents_db = self.load(documents, False)
+        columnar_db = self.load(documents, True)
+        pipelines = PIPELINES + FALLBACK_PIPELINES + [
+            [{'$match': {'delivery_boy_id': boys[0]}}, delivery_stats_group('$status')]
+        ]
+        for numpy in (columnar.np, None):
+            with mock.patch.object(columnar, 'np', numpy):
+                for pipeline in pipelines:
+                    with self.subTest(numpy=numpy is not None, pipeline=pipeline):
+                        self.assertEqual(canonical(list(columnar_db.deliveries.aggregate(pipeline))),
+                                         canonical(list(documents_db.deliveries.aggregate(pipeline))))
+
+    def test_vectorized_groups_match_document_pipeline(self):
+        boys, documents = deliveries(random.Random(11))
+        # The fast path must actually answer these, not fall back
+        collection = self.load(documents, True).storage.collections['deliveries']
+        for pipeline in PIPELINES:
+            with self.subTest(pipeline=pipeline):
+                self.assertIsNotNone(collection.aggregate(pipeline, lambda item, query: True, None))
+        self.assert_parity(boys, documents)
+
+    def test_irregular_documents_fall_back(self):
+        boys, documents = deliveries(random.Random(12))
+        # Values the typed columns cannot hold are kept as documents
+        documents[0]['quantity'] = '2'
+        documents[1]['timestamp'] = '2024-05-01T06:30:00'
+        del documents[2]['status']
+        self.assert_parity(boys, documents)
+
+    def test_updates_and_removals_stay_in_step(self):
+        boys, documents = deliveries(random.Random(13))
+        documents_db = self.load(documents, False)
+        columnar_db = self.load(documents, True)
+        for db in (documents_db, columnar_db):
+            for document in documents[:10]:
+                db.deliveries.update_one({'_id': document['_id']}, {'$set': {'status': 'Delivered', 'quantity': 4}})
+            for document in documents[10:15]:
+                db.deliveries.delete_one({'_id': document['_id']})
+        for pipeline in PIPELINES:
+            with self.subTest(pipeline=pipeline):
+                self.assertEqual(canonical(list(columnar_db.deliveries.aggregate(pipeline))),
+                                 canonical(list(documents_db.deliveries.aggregate(pipeline))))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Journal recovery tests for Milk Delivery App
+Journals in-memory storage to a temporary directory, abandons it as a crash
+would, and checks what a fresh storage recovers: after a torn log tail, from
+the previous snapshot when the newest will not load, and never across a gap.
+
+Usage: python -m unittest src/test_journal_recovery.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import date
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from bson import ObjectId
+from src.database.config import InMemoryStorage, MockDatabase
+from src.database.persistence import Journal
+
+class JournalRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.use_new_directory()
+
+    def use_new_directory(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def open(self, columnar=False):
+        storage = InMemoryStorage(columnar=columnar)
+        journal = Journal(self.directory, commit_interval=0.001, snapshot_interval=0).open(storage)
+        self.addCleanup(journal.close)
+        return journal, MockDatabase(storage)
+
+    def crash(self, journal):
+        # Everything appended is on disk; nothing else is shut down cleanly
+        journal._log.flush()
+
+    def write(self, db, count):
+        ids = []
+        for _ in range(count):
+            result = db.deliveries.insert_one({'customer_id': ObjectId(), 'delivery_boy_id': ObjectId(),
+                                               'delivery_date': date(2024, 5, 1), 'quantity': 1,
+                                               'status': 'Pending'})
+            ids.append(result.inserted_id)
+        return ids
+
+    def state(self, db):
+        return sorted(db.deliveries.find({}), key=lambda document: document['_id'])
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.directory) if name.startswith('oplog-'))
+
+    def test_recovers_log_after_crash(self):
+        for columnar in (False, True):
+            with self.subTest(columnar=columnar):
+                self.use_new_directory()
+                journal, db = self.open(columnar)
+                ids = self.write(db, 5)
+                db.deliveries.update_one({'_id': ids[0]}, {'$set': {'status': 'Delivered'}})
+                db.deliveries.delete_one({'_id': ids[1]})
+                expected = self.state(db)
+                self.crash(journal)
+
+                _, recovered = self.open(columnar)
+                self.assertEqual(self.state(recovered), expected)
+
+    def test_torn_tail_is_truncated(self):
+        journal, db = self.open()
+        self.write(db, 3)
+        expected = self.state(db)
+        self.crash(journal)
+        with open(os.path.join(self.directory, self.segments()[-1]), 'ab') as log_file:
+            log_file.write(b'\x40\x00\x00\x00torn')
+
+        journal, recovered = self.open()
+        self.assertEqual(self.state(recovered), expected)
+        # The next write continues the log where the intact records end
+        self.write(recovered, 1)
+        expected = self.state(recovered)
+        self.crash(journal)
+        _, recovered = self.open()
+        self.assertEqual(self.state(recovered), expected)
+
+    def test_snapshot_plus_log(self):
+        journal, db = self.open()
+        self.write(db, 3)
+        journal.snapshot()
+        self.write(db, 2)
+        expected = self.state(db)
+        self.crash(journal)
+
+        journal, recovered = self.open()
+        self.assertEqual(self.state(recovered), expected)
+        self.assertEqual(journal.lsn, 5)
+
+    def test_unloadable_snapshot_falls_back_to_previous(self):
+        journal, db = self.open()
+        self.write(db, 2)
+        journal.snapshot()
+        self.write(db, 2)
+        journal.snapshot()
+        self.write(db, 1)
+        expected = self.state(db)
+        self.crash(journal)
+
+        newest = os.path.join(self.directory, f"snapshot-{4:020d}.pkl")
+        with open(newest, 'r+b') as snapshot_file:
+            snapshot_file.truncate(10)
+        _, recovered = self.open()
+        self.assertEqual(self.state(recovered), expected)
+
+    def test_refuses_to_recover_across_a_gap(self):
+        journal, db = self.open()
+        self.write(db, 2)
+        journal.snapshot()
+        self.write(db, 2)
+        journal.snapshot()
+        self.crash(journal)
+
+        # Without the newest snapshot, the base is at 2 and records 3-4 are gone
+        os.remove(os.path.join(self.directory, f"snapshot-{4:020d}.pkl"))
+        os.remove(os.path.join(self.directory, f"oplog-{3:020d}.log"))
+        with self.assertRaises(RuntimeError):
+            self.open()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Keyset pagination tests for Milk Delivery App
+Pages through deliveries that share a delivery_date on both in-memory storage
+modes; every page has to continue exactly where the previous one stopped.
+
+Usage: python -m unittest src/test_keyset_pagination.py
+"""
+
+import os
+import random
+import sys
+import unittest
+from datetime import date
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from bson import ObjectId
+from src.database.config import InMemoryStorage, MockDatabase
+from src.database.pagination import keyset_page
+
+class KeysetPaginationTest(unittest.TestCase):
+    def load(self, columnar):
+        rng = random.Random(5)
+        db = MockDatabase(InMemoryStorage(columnar=columnar))
+        # _ids out of insertion order, as subscription_delivery_id gives them
+        ids = [ObjectId(rng.randbytes(12)) for _ in range(12)]
+        days = [date(2024, 5, 1)] * 6 + [date(2024, 5, 2)] * 3 + [date(2024, 4, 30)] * 3
+        for _id, day in zip(ids, days):
+            db.deliveries.insert_one({'_id': _id, 'customer_id': ObjectId(), 'delivery_boy_id': ObjectId(),
+                                      'delivery_date': day, 'quantity': 1, 'status': 'Pending'})
+        return db, sorted(zip(days, ids))
+
+    def pages(self, db, direction, limit):
+        documents, cursor = [], None
+        while True:
+            page, cursor = keyset_page(db.deliveries, {}, 'delivery_date', direction, cursor, limit)
+            documents.extend(page)
+            if cursor is None:
+                return [(document['delivery_date'], document['_id']) for document in documents]
+
+    def test_pages_break_ties_on_id(self):
+        for columnar in (False, True):
+            db, expected = self.load(columnar)
+            for direction in (1, -1):
+                for limit in (1, 2, 4, 5):
+                    with self.subTest(columnar=columnar, direction=direction, limit=limit):
+                        self.assertEqual(self.pages(db, direction, limit),
+                                         expected if direction > 0 else expected[::-1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Report cache tests for Milk Delivery App
+Requests the cached report endpoints on in-memory storage: ETags answer
+If-None-Match with 304, and a delivery write makes exactly the reports that
+depend on it stale.
+
+Usage: python -m unittest src/test_report_cache.py
+"""
+
+import os
+import sys
+import unittest
+from datetime import date
+from unittest import mock
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from bson import ObjectId
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from src.database.cache import report_cache
+from src.database.config import InMemoryStorage, MockDatabase, db_instance
+from src.models.customer import Customer
+from src.models.delivery import Delivery
+from src.models.user import User
+from src.routes.reports import reports_bp
+
+DAY = date(2024, 5, 1)
+OTHER_DAY = date(2024, 6, 1)
+
+class ReportCacheTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(db_instance, '_db', MockDatabase(InMemoryStorage()))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        report_cache.clear()
+
+        # Only the reports blueprint; src.main would connect to MongoDB
+        app = Flask(__name__)
+        app.config['JWT_SECRET_KEY'] = 'report-cache-test-secret-of-32-bytes'
+        JWTManager(app)
+        app.register_blueprint(reports_bp, url_prefix='/api/reports')
+        self.client = app.test_client()
+
+        self.admin = User('admin', None, 'admin', 'Admin')
+        self.admin.save()
+        self.delivery_boy = User('boy', None, 'delivery_boy', 'Boy')
+        self.delivery_boy.save()
+        self.customer = Customer('Customer', 'Address', '555')
+        self.customer.save()
+        self.delivery = Delivery(self.customer._id, self.delivery_boy._id, DAY, 2)
+        self.delivery.save()
+        with app.app_context():
+            self.headers = self.token_headers(self.admin)
+            self.delivery_boy_headers = self.token_headers(self.delivery_boy)
+
+    def token_headers(self, user):
+        token = create_access_token(identity=str(user._id), additional_claims=user.token_claims())
+        return {'Authorization': f'Bearer {token}'}
+
+    def get(self, path, etag=None):
+        headers = dict(self.headers)
+        if etag:
+            headers['If-None-Match'] = etag
+        return self.client.get(path, headers=headers)
+
+    def test_etag_answers_not_modified(self):
+        path = f'/api/reports/summary?start_date={DAY}&end_date={DAY}'
+        first = self.get(path)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.get_json()['total_quantity'], 2)
+        etag = first.headers['ETag']
+
+        second = self.get(path, etag)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.headers['ETag'], etag)
+        self.assertEqual(report_cache.stats()['hits'], 1)
+
+        self.assertEqual(self.get(path, '"something-else"').status_code, 200)
+
+    def test_write_invalidates_dependent_reports(self):
+        summary = f'/api/reports/summary?start_date={DAY}&end_date={DAY}'
+        customer = f'/api/reports/customer/{self.customer._id}'
+        daily = f'/api/reports/daily/{DAY}'
+        etags = {path: self.get(path).headers['ETag'] for path in (summary, customer, daily)}
+
+        self.delivery.status = 'Delivered'
+        self.assertTrue(self.delivery.update(self.admin._id))
+
+        for path in (summary, customer, daily):
+            with self.subTest(path=path):
+                response = self.get(path, etags[path])
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response.headers['ETag'], etags[path])
+        self.assertEqual(self.get(summary).get_json()['delivered_count'], 1)
+
+    def test_unrelated_write_keeps_entry(self):
+        path = f'/api/reports/summary?start_date={DAY}&end_date={DAY}'
+        etag = self.get(path).headers['ETag']
+        Delivery(ObjectId(), self.delivery_boy._id, OTHER_DAY, 5).save()
+        self.assertEqual(self.get(path, etag).status_code, 304)
+
+        # An unbounded summary depends on every write
+        path = '/api/reports/summary'
+        etag = self.get(path).headers['ETag']
+        Delivery(ObjectId(), self.delivery_boy._id, OTHER_DAY, 5).save()
+        self.assertEqual(self.get(path, etag).status_code, 200)
+
+    def test_errors_are_not_cached(self):
+        response = self.client.get('/api/reports/summary', headers=self.delivery_boy_headers)
+        self.assertEqual(response.status_code, 403)
+        response = self.get(f'/api/reports/summary?start_date={OTHER_DAY}&end_date={DAY}')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.get(f'/api/reports/customer/{ObjectId()}').status_code, 404)
+        self.assertEqual(report_cache.stats()['size'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Daily rollup tests for Milk Delivery App
+Writes deliveries through the models on both in-memory storage modes and
+checks the incrementally maintained daily_rollups against a full rebuild.
+
+Usage: python -m unittest src/test_rollups.py
+"""
+
+import os
+import sys
+import unittest
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from bson import ObjectId
+from src.database.config import InMemoryStorage, MockDatabase, db_instance
+from src.models import rollup
+from src.models.delivery import Delivery
+
+DAY = date(2024, 5, 1)
+
+class RollupTest(unittest.TestCase):
+    def use_database(self, columnar):
+        db = MockDatabase(InMemoryStorage(columnar=columnar))
+        patcher = mock.patch.object(db_instance, '_db', db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return db
+
+    def rollups(self, db):
+        # Increments only create the fields they touch, and may leave all zeros
+        found = {}
+        for document in db.daily_rollups.find({}):
+            stats = {field: document.get(field, 0) for field in rollup.STAT_FIELDS}
+            if any(stats.values()):
+                found[(document['date'], document['delivery_boy_id'])] = stats
+        return found
+
+    def assert_rebuild_agrees(self, db):
+        maintained = self.rollups(db)
+        rollup.rebuild()
+        self.assertEqual(maintained, self.rollups(db))
+
+    def test_insert_update_delete_keep_rollups_current(self):
+        for columnar in (False, True):
+            with self.subTest(columnar=columnar):
+                db = self.use_database(columnar)
+                boy, other_boy = ObjectId(), ObjectId()
+
+                first = Delivery(ObjectId(), boy, DAY, 2)
+                first.save()
+                self.assertEqual(Delivery.save_many([Delivery(ObjectId(), boy, DAY, 1, status='Delivered'),
+                                                     Delivery(ObjectId(), other_boy, DAY, 3, status='Issue')]),
+                                 [None, None])
+                self.assertEqual(self.rollups(db)[(DAY, boy)], {
+                    'total_deliveries': 2, 'delivered_count': 1, 'pending_count': 1,
+                    'issue_count': 0, 'total_quantity': 3
+                })
+                self.assert_rebuild_agrees(db)
+
+                # A status and quantity change stays on the same rollup
+                first.status, first.quantity = 'Delivered', 4
+                self.assertTrue(first.update(boy))
+                self.assertEqual(self.rollups(db)[(DAY, boy)]['delivered_count'], 2)
+                self.assertEqual(self.rollups(db)[(DAY, boy)]['total_quantity'], 5)
+                self.assert_rebuild_agrees(db)
+
+                # Reassigning to another day and delivery boy moves it
+                first.delivery_date, first.delivery_boy_id = DAY + timedelta(days=1), other_boy
+                self.assertTrue(first.update(boy))
+                self.assertEqual(self.rollups(db)[(DAY, boy)]['total_deliveries'], 1)
+                self.assertEqual(self.rollups(db)[(DAY + timedelta(days=1), other_boy)]['total_quantity'], 4)
+                self.assert_rebuild_agrees(db)
+
+                # A removed delivery takes its contribution with it
+                removed = db.deliveries.find_one({'_id': first._id})
+                db.deliveries.delete_one({'_id': first._id})
+                rollup.apply_change(removed, None)
+                self.assertNotIn((DAY + timedelta(days=1), other_boy), self.rollups(db))
+                self.assert_rebuild_agrees(db)
+
+    def test_sync_statuses_moves_counts(self):
+        for columnar in (False, True):
+            with self.subTest(columnar=columnar):
+                db = self.use_database(columnar)
+                boy = ObjectId()
+                deliveries = [Delivery(ObjectId(), boy, DAY, 1) for _ in range(3)]
+                Delivery.save_many(deliveries)
+                later = datetime.utcnow() + timedelta(minutes=1)
+                outcomes, _, _ = Delivery.sync_statuses([
+                    {'_id': deliveries[0]._id, 'status': 'Delivered', 'timestamp': later, 'key': 'a'},
+                    {'_id': deliveries[1]._id, 'status': 'Issue', 'timestamp': later, 'key': 'b'}
+                ], boy)
+                self.assertEqual(outcomes, ['applied', 'applied'])
+                self.assertEqual(self.rollups(db)[(DAY, boy)], {
+                    'total_deliveries': 3, 'delivered_count': 1, 'pending_count': 1,
+                    'issue_count': 1, 'total_quantity': 3
+                })
+                self.assert_rebuild_agrees(db)
+
+    def test_rebuild_of_some_dates_leaves_the_rest(self):
+        db = self.use_database(False)
+        boy = ObjectId()
+        Delivery.save_many([Delivery(ObjectId(), boy, DAY, 1),
+                            Delivery(ObjectId(), boy, DAY + timedelta(days=1), 1)])
+        # Corrupt both days, then rebuild only the first
+        db.daily_rollups.update_one({'date': DAY}, {'$inc': {'total_quantity': 10}})
+        db.daily_rollups.update_one({'date': DAY + timedelta(days=1)}, {'$inc': {'total_quantity': 10}})
+        rollup.rebuild([DAY])
+        self.assertEqual(self.rollups(db)[(DAY, boy)]['total_quantity'], 1)
+        self.assertEqual(self.rollups(db)[(DAY + timedelta(days=1), boy)]['total_quantity'], 11)
+
+if __name__ == '__main__':
+    unittest.main()
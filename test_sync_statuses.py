@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Offline status sync tests for Milk Delivery App
+Sends batches through Delivery.sync_statuses on both in-memory storage modes:
+last-writer-wins on the device timestamp, and idempotency keys that replay
+the outcome recorded the first time.
+
+Usage: python -m unittest src/test_sync_statuses.py
+"""
+
+import os
+import sys
+import unittest
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from bson import ObjectId
+from src.database.config import InMemoryStorage, MockDatabase, db_instance
+from src.models.delivery import Delivery
+
+class SyncStatusesTest(unittest.TestCase):
+    def setUp(self):
+        self.boy = ObjectId()
+        self.created = datetime.utcnow()
+
+    def use_database(self, columnar):
+        db = MockDatabase(InMemoryStorage(columnar=columnar))
+        patcher = mock.patch.object(db_instance, '_db', db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        deliveries = [Delivery(ObjectId(), self.boy, date(2024, 5, 1), 1) for _ in range(2)]
+        Delivery.save_many(deliveries)
+        return db, [delivery._id for delivery in deliveries]
+
+    def change(self, _id, status, minutes, key):
+        return {'_id': _id, 'status': status, 'timestamp': self.created + timedelta(minutes=minutes), 'key': key}
+
+    def test_latest_change_wins_within_a_batch(self):
+        for columnar in (False, True):
+            with self.subTest(columnar=columnar):
+                db, (first, _) = self.use_database(columnar)
+                outcomes, replayed, documents = Delivery.sync_statuses([
+                    self.change(first, 'Issue', 2, 'late'),
+                    self.change(first, 'Delivered', 1, 'early')
+                ], self.boy)
+                self.assertEqual(outcomes, ['applied', 'stale'])
+                self.assertEqual(replayed, [False, False])
+                self.assertEqual(documents[first]['status'], 'Issue')
+                self.assertEqual(db.deliveries.find_one({'_id': first})['updated_by'], self.boy)
+
+    def test_older_change_loses_to_the_server(self):
+        for columnar in (False, True):
+            with self.subTest(columnar=columnar):
+                db, (first, _) = self.use_database(columnar)
+                Delivery.sync_statuses([self.change(first, 'Delivered', 5, 'newer')], self.boy)
+                outcomes, _, documents = Delivery.sync_statuses([self.change(first, 'Issue', 3, 'older')], self.boy)
+                self.assertEqual(outcomes, ['stale'])
+                self.assertEqual(documents[first]['status'], 'Delivered')
+
+    def test_concurrent_write_is_not_overwritten(self):
+        for columnar in (False, True):
+            with self.subTest(columnar=columnar):
+                db, (first, _) = self.use_database(columnar)
+                # Another writer lands between the read and the conditional update
+                bulk_write = db.deliveries.bulk_write
+                def write_first(requests, **kwargs):
+                    db.deliveries.update_one({'_id': first}, {'$set': {
+                        'status': 'Issue', 'timestamp': self.created + timedelta(minutes=9)}})
+                    return bulk_write(requests, **kwargs)
+                with mock.patch.object(db.deliveries, 'bulk_write', write_first):
+                    outcomes, _, _ = Delivery.sync_statuses([self.change(first, 'Delivered', 1, 'k')], self.boy)
+                self.assertEqual(outcomes, ['stale'])
+                self.assertEqual(db.deliveries.find_one({'_id': first})['status'], 'Issue')
+
+    def test_retried_key_replays_its_outcome(self):
+        for columnar in (False, True):
+            with self.subTest(columnar=columnar):
+                db, (first, second) = self.use_database(columnar)
+                batch = [self.change(first, 'Delivered', 1, 'a'), self.change(second, 'Issue', 1, 'b')]
+                self.assertEqual(Delivery.sync_statuses(batch, self.boy)[:2], (['applied', 'applied'], [False, False]))
+                # A later change from elsewhere must not turn the retry into 'stale'
+                Delivery.sync_statuses([self.change(first, 'Pending', 4, 'c')], self.boy)
+                outcomes, replayed, documents = Delivery.sync_statuses(batch, self.boy)
+                self.assertEqual(outcomes, ['applied', 'applied'])
+                self.assertEqual(replayed, [True, True])
+                self.assertEqual(documents[first]['status'], 'Pending')
+                self.assertEqual(len(list(db.sync_keys.find({}))), 3)
+
+    def test_repeated_key_within_a_batch(self):
+        for columnar in (False, True):
+            with self.subTest(columnar=columnar):
+                db, (first, second) = self.use_database(columnar)
+                outcomes, replayed, _ = Delivery.sync_statuses([
+                    self.change(first, 'Delivered', 1, 'a'),
+                    self.change(first, 'Delivered', 1, 'a'),
+                    self.change(second, 'Issue', 1, 'a')
+                ], self.boy)
+                self.assertEqual(outcomes, ['applied', 'applied', 'key_reused'])
+                self.assertEqual(replayed, [False, True, True])
+                self.assertEqual(db.deliveries.find_one({'_id': second})['status'], 'Pending')
+
+    def test_keys_belong_to_their_user(self):
+        for columnar in (False, True):
+            with self.subTest(columnar=columnar):
+                db, (first, second) = self.use_database(columnar)
+                other = ObjectId()
+                Delivery.sync_statuses([self.change(first, 'Delivered', 1, 'same')], self.boy)
+                outcomes, replayed, _ = Delivery.sync_statuses([self.change(second, 'Issue', 1, 'same')], other)
+                self.assertEqual((outcomes, replayed), (['applied'], [False]))
+                outcomes, _, _ = Delivery.sync_statuses([self.change(second, 'Issue', 2, 'same')], self.boy)
+                self.assertEqual(outcomes, ['key_reused'])
+
+    def test_other_delivery_boys_deliveries_are_not_found(self):
+        for columnar in (False, True):
+            with self.subTest(columnar=columnar):
+                db, (first, _) = self.use_database(columnar)
+                outcomes, _, _ = Delivery.sync_statuses([
+                    self.change(first, 'Delivered', 1, 'a'),
+                    self.change(ObjectId(), 'Delivered', 1, 'b')
+                ], ObjectId(), delivery_boy_id=ObjectId())
+                self.assertEqual(outcomes, ['not_found', 'not_found'])
+                self.assertEqual(db.deliveries.find_one({'_id': first})['status'], 'Pending')
+                # Nothing was decided, so a retry is evaluated afresh
+                self.assertEqual(len(list(db.sync_keys.find({}))), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,25 @@
 from datetime import datetime
 from bson import ObjectId
-import bcrypt
+import os
+from src.database.cache import TTLCache
 from src.database.config import db_instance
+from src.models import identity_map
+from src.models.passwords import hasher
+from src.models.projection import Projectable, hydrate, mongo_projection
 
-class User:
+# Hydrated users for the paths that need the full record, e.g. /api/auth/me
+user_cache = TTLCache(
+    maxsize=int(os.getenv('USER_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('USER_CACHE_TTL', '60'))
+)
+
+class User(Projectable):
+    FIELDS = ('username', 'password', 'role', 'name', 'created_at', 'token_version')
+    # Everything to_dict serializes; leaves the password hash in the database
+    PUBLIC_FIELDS = ('username', 'role', 'name', 'created_at')
+    # What current_role reads on every request to check a token is still valid
+    AUTH_FIELDS = ('role', 'token_version')
+    
     def __init__(self, username, password, role, name, _id=None):
         self._id = _id or ObjectId()
         self.username = username
@@ -11,12 +27,43 @@ class User:
         self.role = role  # 'admin', 'delivery_boy', 'customer'
         self.name = name
         self.created_at = datetime.utcnow()
+        self.token_version = 0  # Bumped by revoke_tokens
     
     def _hash_password(self, password):
-        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        return hasher.hash(password)
     
     def check_password(self, password):
-        return bcrypt.checkpw(password.encode('utf-8'), self.password.encode('utf-8'))
+        return hasher.verify(password, self.password)
+    
+    def password_needs_rehash(self):
+        return hasher.needs_rehash(self.password)
+    
+    def rehash_password_in_background(self, password):
+        """Re-hash at the configured bcrypt cost after a successful login"""
+        user_id, old_hash = self._id, self.password
+        
+        def store(new_hash):
+            db = db_instance.get_db()
+            if db is None:
+                return
+            # Only replace the hash we verified, never a concurrently changed one
+            db.users.update_one(
+                {'_id': user_id, 'password': old_hash},
+                {'$set': {'password': new_hash}}
+            )
+            user_cache.invalidate(user_id)
+        
+        hasher.rehash_in_background(password, store)
+    
+    def token_claims(self):
+        """Extra JWT claims, so authorization checks need no user lookup"""
+        return {'role': self.role, 'name': self.name, 'ver': self.token_version}
+    
+    def role_for_token(self, claims):
+        """The role a token with these claims grants, or None once revoked"""
+        if claims.get('ver', 0) != (self.token_version or 0):
+            return None
+        return claims.get('role') or self.role
     
     def to_dict(self):
         return {
@@ -38,69 +85,108 @@ class User:
             'password': self.password,
             'role': self.role,
             'name': self.name,
-            'created_at': self.created_at
+            'created_at': self.created_at,
+            'token_version': self.token_version
         }
         
         result = db.users.insert_one(user_data)
+        identity_map.forget('users', self._id)
+        user_cache.invalidate(self._id)
         return result.inserted_id
     
     @staticmethod
-    def find_by_username(username):
+    def _from_document(user_data, fields=None):
+        if fields is not None:
+            return hydrate(User, user_data, fields)
+        user = User(
+            username=user_data['username'],
+            password=None,  # Don't pass password to avoid re-hashing
+            role=user_data['role'],
+            name=user_data['name'],
+            _id=user_data['_id']
+        )
+        user.password = user_data.get('password')  # Set hashed password directly
+        user.created_at = user_data['created_at']
+        user.token_version = user_data.get('token_version', 0)
+        return user
+    
+    @staticmethod
+    def revoke_tokens(user_id):
+        """Invalidate every token issued to the user so far
+        
+        Call after changing a user's role or deleting them; current_role
+        rejects older tokens from the next request on.
+        """
+        db = db_instance.get_db()
+        if db is None:
+            return False
+        
+        user_id = ObjectId(user_id)
+        result = db.users.update_one({'_id': user_id}, {'$inc': {'token_version': 1}})
+        identity_map.forget('users', user_id)
+        user_cache.invalidate(user_id)
+        return result.matched_count > 0
+    
+    @staticmethod
+    def find_by_username(username, fields=None):
         db = db_instance.get_db()
         if db is None:
             return None
         
-        user_data = db.users.find_one({'username': username})
+        user_data = db.users.find_one({'username': username}, mongo_projection(fields))
         if user_data:
-            user = User(
-                username=user_data['username'],
-                password=None,  # Don't pass password to avoid re-hashing
-                role=user_data['role'],
-                name=user_data['name'],
-                _id=user_data['_id']
-            )
-            user.password = user_data['password']  # Set hashed password directly
-            user.created_at = user_data['created_at']
-            return user
+            return User._from_document(user_data, fields)
         return None
     
     @staticmethod
-    def find_by_id(user_id):
+    def find_by_id(user_id, fields=None):
         db = db_instance.get_db()
         if db is None:
             return None
         
-        user_data = db.users.find_one({'_id': ObjectId(user_id)})
+        user_id = ObjectId(user_id)
+        user_data = identity_map.lookup('users', user_id, fields)
+        if identity_map.is_miss(user_data):
+            user_data = db.users.find_one({'_id': user_id}, mongo_projection(fields))
+            identity_map.remember('users', user_id, user_data, fields)
         if user_data:
-            user = User(
-                username=user_data['username'],
-                password=None,
-                role=user_data['role'],
-                name=user_data['name'],
-                _id=user_data['_id']
-            )
-            user.password = user_data['password']
-            user.created_at = user_data['created_at']
-            return user
+            return User._from_document(user_data, fields)
         return None
     
     @staticmethod
-    def get_all():
+    def find_by_id_cached(user_id):
+        """find_by_id through the process-wide TTL cache"""
+        user_id = ObjectId(user_id)
+        user = user_cache.get(user_id)
+        if user is None:
+            user = User.find_by_id(user_id)
+            if user is not None:
+                user_cache.set(user_id, user)
+        return user
+    
+    @staticmethod
+    def find_by_ids(user_ids, fields=None):
+        """Load many users with one $in query; returns a dict keyed by _id"""
+        db = db_instance.get_db()
+        if db is None:
+            return {}
+        
+        documents = identity_map.load_many(
+            'users',
+            [ObjectId(user_id) for user_id in user_ids],
+            lambda ids: db.users.find({'_id': {'$in': ids}}, mongo_projection(fields)),
+            fields
+        )
+        return {_id: User._from_document(data, fields) for _id, data in documents.items()}
+    
+    @staticmethod
+    def get_all(fields=None):
         db = db_instance.get_db()
         if db is None:
             return []
         
         users = []
-        for user_data in db.users.find():
-            user = User(
-                username=user_data['username'],
-                password=None,
-                role=user_data['role'],
-                name=user_data['name'],
-                _id=user_data['_id']
-            )
-            user.password = user_data['password']
-            user.created_at = user_data['created_at']
-            users.append(user)
+        for user_data in db.users.find({}, mongo_projection(fields)):
+            users.append(User._from_document(user_data, fields))
         return users
 